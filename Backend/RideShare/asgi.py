@@ -1,11 +1,23 @@
 import os
 from django.core.asgi import get_asgi_application
 from channels.routing import ProtocolTypeRouter, URLRouter
-import chat.routing
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'RideShare.settings')
+django_asgi_app = get_asgi_application()
+
+# Imported after Django is set up: both load models
+import chat.routing
+import sos.routing
+from chat.auth import JWTAuthMiddleware
+from rides.outbox import RideEventDispatcherMiddleware
+from .background import start_background_jobs
+
+# The middleware starts the ride-event dispatcher on the server's event loop
+application = RideEventDispatcherMiddleware(ProtocolTypeRouter({
+    "http": django_asgi_app,
+    "websocket": JWTAuthMiddleware(URLRouter(
+        chat.routing.websocket_urlpatterns + sos.routing.websocket_urlpatterns
+    )),
+}))
 
-application = ProtocolTypeRouter({
-    "http": get_asgi_application(),
-    "websocket": URLRouter(chat.routing.websocket_urlpatterns),  # No AuthMiddlewareStack
-})
\ No newline at end of file
+start_background_jobs(dispatcher_thread=False)
@@ -0,0 +1,28 @@
+"""
+Background jobs of a web server process.
+
+The ride-event dispatcher (rides.outbox), the ride expiry scheduler (rides.expiry) and the SOS
+fan-out sweeper (sos.fanout) run inside the server processes, each behind its own setting. They are
+started from the server entry points, wsgi.py and asgi.py (runserver included), so tests,
+migrations and other commands run none of them. Under ASGI the dispatcher is started on the
+server's event loop by RideEventDispatcherMiddleware instead of a thread.
+
+Gunicorn must not preload the app (--preload), as threads started before the fork do not run in the
+workers. To run the jobs in a process of their own instead, turn the settings off for the web
+servers and run ``manage.py run_background_jobs``.
+"""
+from django.conf import settings
+
+from rides.expiry import start_scheduler
+from rides.outbox import dispatcher
+from sos.fanout import fanout_dispatcher
+
+
+def start_background_jobs(dispatcher_thread=True):
+    """Start the jobs switched on in the settings. Each is started at most once per process."""
+    if settings.RIDE_EVENT_DISPATCHER and dispatcher_thread:
+        dispatcher.start_thread()
+    if settings.RIDE_EXPIRY_SCHEDULER:
+        start_scheduler()
+    if settings.SOS_FANOUT_SWEEPER:
+        fanout_dispatcher.start_sweeper()
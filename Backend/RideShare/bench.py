@@ -0,0 +1,201 @@
+"""
+Helpers shared by the ``bench_*`` management commands.
+
+Benchmarks seed a lot of rows, so they never touch the configured database: they run against
+a throwaway test database that is created for the run and destroyed afterwards.
+"""
+import asyncio
+import itertools
+import json
+import os
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from django.db import connection
+
+
+@contextmanager
+def isolated_database():
+    """Create a fresh test database with all migrations applied for the duration of the block."""
+    old_name = connection.settings_dict['NAME']
+    test_settings = connection.settings_dict['TEST']
+    old_test_name = test_settings.get('NAME')
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        if connection.vendor == 'sqlite':
+            # A file-backed database lets worker threads open their own connections.
+            test_settings['NAME'] = os.path.join(tmp_dir, 'bench.sqlite3')
+        connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        try:
+            yield
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            test_settings['NAME'] = old_test_name
+
+
+def percentile(samples, pct):
+    """Nearest-rank percentile of a list of numbers."""
+    ordered = sorted(samples)
+    if not ordered:
+        return 0.0
+    rank = max(0, min(len(ordered) - 1, int(round(pct / 100 * len(ordered) + 0.5)) - 1))
+    return ordered[rank]
+
+
+def timed(func, *args, **kwargs):
+    """Call func and return (result, elapsed milliseconds)."""
+    start = time.perf_counter()
+    result = func(*args, **kwargs)
+    return result, (time.perf_counter() - start) * 1000
+
+
+def latency_summary(samples_ms):
+    """One-line p50/p99/max summary of latencies in milliseconds."""
+    return (
+        f"p50={percentile(samples_ms, 50):.2f}ms "
+        f"p99={percentile(samples_ms, 99):.2f}ms "
+        f"max={max(samples_ms):.2f}ms (n={len(samples_ms)})"
+    )
+
+
+def rss_bytes():
+    """Resident set size of this process in bytes, or None where /proc is not available."""
+    try:
+        with open('/proc/self/statm') as statm:
+            return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        return None
+
+
+@contextmanager
+def local_redis_server():
+    """
+    Run an in-process fakeredis server on a free local port and yield its redis:// URL.
+    It speaks the Redis protocol over TCP, so other processes can share it like a real server.
+    """
+    from fakeredis import TcpFakeServer
+
+    server = TcpFakeServer(('127.0.0.1', 0), server_type='redis')
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        host, port = server.server_address
+        yield f'redis://{host}:{port}/0'
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def redis_channel_layer(redis_url, capacity=10_000):
+    from channels_redis.core import RedisChannelLayer
+
+    return RedisChannelLayer(hosts=[redis_url], capacity=capacity)
+
+
+def publish_to_group(redis_url, group, producer, count):
+    """
+    Send ``count`` chat_message events to a group from a separate process, the way an HTTP worker
+    broadcasts to sockets held by another worker. Returns the elapsed seconds.
+    """
+    async def publish():
+        layer = redis_channel_layer(redis_url)
+        start = time.perf_counter()
+        for seq in range(count):
+            await layer.group_send(group, {
+                'type': 'chat_message',
+                # A system message in the chat.wire format
+                'message_data': {'s': None, 'm': f'{producer}:{seq}', 'ts': int(time.time() * 1000), 'k': 1},
+            })
+        elapsed = time.perf_counter() - start
+        await layer.close_pools()
+        return elapsed
+
+    return asyncio.run(publish())
+
+
+class StubExpoServer(ThreadingHTTPServer):
+    """
+    Local stand-in for the Expo push API (``/send`` and ``/getReceipts``), for tests and benchmarks.
+
+    Every request waits ``latency`` seconds, like a round trip to Expo. Tokens containing
+    "unregistered" get a DeviceNotRegistered ticket; ``failures`` requests in a row are answered
+    with 503 first. ``requests`` records (path, body) and ``connections`` counts TCP connections.
+    """
+    daemon_threads = True
+
+    def __init__(self, latency=0.0, failures=0):
+        super().__init__(('127.0.0.1', 0), StubExpoHandler)
+        self.latency = latency
+        self.failures = failures
+        self.requests = []
+        self.connections = 0
+        self.receipts = {}
+        self.ticket_ids = itertools.count(1)
+        self.lock = threading.Lock()
+
+    @property
+    def url(self):
+        host, port = self.server_address
+        return f'http://{host}:{port}'
+
+
+class StubExpoHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # Keep-alive, so connection reuse shows in ``connections``
+    # Headers and body go out in separate writes; without this, delayed ACKs add ~40ms per response
+    disable_nagle_algorithm = True
+
+    def setup(self):
+        super().setup()
+        with self.server.lock:
+            self.server.connections += 1
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        time.sleep(self.server.latency)
+        with self.server.lock:
+            self.server.requests.append((self.path, body))
+            if self.server.failures:
+                self.server.failures -= 1
+                return self.reply(503, {'errors': [{'code': 'INTERNAL', 'message': 'Try again'}]})
+            if self.path.endswith('/send'):
+                data = [self.ticket(message['to']) for message in body]
+            elif self.path.endswith('/getReceipts'):
+                data = {ticket_id: self.server.receipts[ticket_id] for ticket_id in body['ids']
+                        if ticket_id in self.server.receipts}
+            else:
+                return self.reply(404, {'errors': [{'code': 'NOT_FOUND'}]})
+        self.reply(200, {'data': data})
+
+    def ticket(self, token):
+        if 'unregistered' in token:
+            return {'status': 'error', 'message': f'"{token}" is not a registered push notification recipient',
+                    'details': {'error': 'DeviceNotRegistered'}}
+        ticket_id = f'ticket-{next(self.server.ticket_ids)}'
+        self.server.receipts[ticket_id] = {'status': 'ok'}
+        return {'status': 'ok', 'id': ticket_id}
+
+    def reply(self, status, payload):
+        encoded = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(encoded)))
+        self.end_headers()
+        self.wfile.write(encoded)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@contextmanager
+def local_expo_server(latency=0.0, failures=0):
+    """Run a StubExpoServer on a free local port for the duration of the block."""
+    server = StubExpoServer(latency=latency, failures=failures)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        yield server
+    finally:
+        server.shutdown()
+        server.server_close()
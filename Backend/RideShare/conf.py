@@ -0,0 +1,13 @@
+"""
+Defaults for the tunables of the per-process singletons (chat.cache, chat.writebehind, sos.nearby,
+sos.locations, sos.fanout, notifications.push).
+
+Each takes its limits as constructor arguments for tests and benchmarks, and otherwise reads the
+setting every time it is used, so override_settings applies to the shared instances too.
+"""
+from django.conf import settings
+
+
+def setting_default(value, name):
+    """``value`` if it was given, else the named setting. An explicit 0 is kept."""
+    return getattr(settings, name) if value is None else value
@@ -0,0 +1,19 @@
+"""
+Shared behaviour of the WebSocket consumers (chat.consumers, sos.consumers).
+"""
+from channels.consumer import get_handler_name
+
+
+class NoDatabaseDispatchMixin:
+    """
+    Channels runs close_old_connections in a worker thread before every handler. Message types
+    listed in ``NO_DB_MESSAGE_TYPES`` are handled without touching the database, so their
+    handlers are called straight from the event loop instead.
+    """
+    NO_DB_MESSAGE_TYPES = frozenset()
+
+    async def dispatch(self, message):
+        if message['type'] in self.NO_DB_MESSAGE_TYPES:
+            await getattr(self, get_handler_name(message))(message)
+        else:
+            await super().dispatch(message)
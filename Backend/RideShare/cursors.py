@@ -0,0 +1,32 @@
+"""
+Opaque keyset cursors shared by the paginated endpoints (rides.pagination, chat.history).
+
+A cursor is the (timestamp, id) of the boundary row: the timestamp as whole microseconds since the
+epoch, so the row compares exactly equal when decoded, and the id as a tie-breaker, packed as
+unpadded url-safe base64 of a JSON pair.
+"""
+import base64
+import json
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+EPOCH = datetime(1970, 1, 1, tzinfo=dt_timezone.utc)
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def encode_cursor(timestamp, row_id):
+    micros = (timestamp - EPOCH) // timedelta(microseconds=1)
+    payload = json.dumps([micros, row_id], separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(payload).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    """(timestamp, id) from a cursor made by encode_cursor. Raises InvalidCursor for anything else."""
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        micros, row_id = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        return EPOCH + timedelta(microseconds=int(micros)), int(row_id)
+    except (TypeError, ValueError, OverflowError):
+        raise InvalidCursor(cursor)
@@ -55,12 +55,50 @@ INSTALLED_APPS = [
 # Define ASGI application
 ASGI_APPLICATION = 'RideShare.asgi.application'
 
-# Configure Channel Layers (using in-memory for simplicity; use Redis in production)
-CHANNEL_LAYERS = {
-    "default": {
-        "BACKEND": "channels.layers.InMemoryChannelLayer"
+# Configure Channel Layers. Set REDIS_URL in production so every daphne process shares one layer
+# and group messages reach sockets held by other processes; without it the in-memory layer is used,
+# which only works inside a single process.
+REDIS_URL = os.environ.get('REDIS_URL')
+if REDIS_URL:
+    CHANNEL_LAYERS = {
+        "default": {
+            "BACKEND": "channels_redis.core.RedisChannelLayer",
+            "CONFIG": {
+                "hosts": [REDIS_URL],
+                "capacity": 1500,
+                "expiry": 60,
+            },
+        }
+    }
+else:
+    # Bounded queues: a socket that falls CHANNEL_CAPACITY messages behind is closed and reconnects
+    # (replaying history) instead of buffering without limit. Counters at /api/chat/layer-stats/.
+    CHANNEL_LAYERS = {
+        "default": {
+            "BACKEND": "chat.layers.BoundedInMemoryChannelLayer",
+            "CONFIG": {
+                "capacity": 100,
+                "expiry": 60,
+                "group_capacity": 50,
+                "overflow_policy": "close",
+            },
+        }
     }
-}
+
+# Messages sent per chat history frame on connect and per history_before request
+CHAT_HISTORY_PAGE_SIZE = 50
+# Recent messages kept in memory per ride for history on connect (chat.cache). The cache only sees
+# writes made by its own process, so it is turned off when several processes share a Redis layer.
+CHAT_CACHE_MESSAGES_PER_RIDE = 0 if REDIS_URL else 100
+CHAT_CACHE_MAX_BYTES = 16 * 1024 * 1024
+CHAT_CACHE_IDLE_SECONDS = 30 * 60
+# Chat messages are written in batches (chat.writebehind): every few ms or once a batch is full. A
+# batch failing more than CHAT_WRITE_MAX_RETRIES times is written message by message, and at most
+# CHAT_WRITE_MAX_PENDING messages wait for the database
+CHAT_WRITE_BATCH_SIZE = 200
+CHAT_WRITE_FLUSH_MS = 20
+CHAT_WRITE_MAX_RETRIES = 5
+CHAT_WRITE_MAX_PENDING = 10_000
 
 CORS_ALLOW_ALL_ORIGINS = True
 
@@ -82,6 +120,61 @@ SIMPLE_JWT = {
 
 AUTH_USER_MODEL = 'users.User'
 
+# WebSocket connects authenticate from a cached user row for this long (users.cache)
+WEBSOCKET_USER_CACHE_TTL = 60
+
+# SOS alerts find nearby users in an in-process index (sos.nearby). Pings other processes have
+# written are read in at most every SYNC_INTERVAL seconds (keep it at LOCATION_FLUSH_INTERVAL), and
+# the index is rebuilt from the database every MAX_AGE seconds for their other location changes
+SOS_NEARBY_RADIUS_KM = 5
+SOS_NEARBY_INDEX_SYNC_INTERVAL = 5
+SOS_NEARBY_INDEX_MAX_AGE = 300
+# Optionally check the closest K users' road distance (0 turns it off), on the offline road graph if
+# ROAD_GRAPH_PATH is set, otherwise with the Distance Matrix API
+GOOGLE_MAPS_API_KEY = os.environ.get('GOOGLE_MAPS_API_KEY')
+SOS_ROAD_DISTANCE_TOP_K = 0
+SOS_ROAD_DISTANCE_TIMEOUT = 2
+
+# Road graph file written by `build_road_graph` (rides.roads); ride matching and SOS alerts use road
+# distance when it is set
+ROAD_GRAPH_PATH = os.environ.get('ROAD_GRAPH_PATH')
+
+# SOS alerts are fanned out by this many worker threads after the create request returns (sos.fanout);
+# 0 fans out inline on commit. Alerts left pending are swept up every SOS_FANOUT_SWEEP_INTERVAL
+# seconds, as are alerts whose worker has held them for SOS_FANOUT_LEASE seconds without finishing
+# (it died). Push receipts are checked SOS_RECEIPT_DELAY seconds after sending
+SOS_FANOUT_WORKERS = 4
+SOS_FANOUT_SWEEP_INTERVAL = 30
+SOS_FANOUT_LEASE = 120
+SOS_RECEIPT_DELAY = 30
+# Run the sweep in a background thread of each web server process (RideShare.background); turn off
+# when `run_background_jobs` runs it
+SOS_FANOUT_SWEEPER = os.environ.get('SOS_FANOUT_SWEEPER', '1') == '1'
+
+# Location pings are coalesced per user and written every LOCATION_FLUSH_INTERVAL seconds, this many
+# users per transaction (sos.locations); 0 writes each ping as it arrives
+LOCATION_FLUSH_INTERVAL = 5
+LOCATION_WRITE_BATCH_SIZE = 500
+
+# Expo push delivery (notifications.push): chunks sent at once, and retries of failed requests
+EXPO_PUSH_URL = os.environ.get('EXPO_PUSH_URL', 'https://exp.host/--/api/v2/push')
+EXPO_PUSH_CONCURRENCY = 8
+EXPO_PUSH_MAX_RETRIES = 3
+EXPO_PUSH_RETRY_BACKOFF = 0.5
+EXPO_PUSH_TIMEOUT = 10
+
+# Rides still open this long after departure_time are completed automatically (rides.expiry)
+RIDE_EXPIRY_GRACE = timedelta(hours=6)
+RIDE_EXPIRY_CHUNK_SIZE = 500
+RIDE_EXPIRY_INTERVAL_SECONDS = 300
+# Run the expiry job in a background thread of each web server process (RideShare.background); turn
+# off when cron runs `expire_rides` or `run_background_jobs` runs it
+RIDE_EXPIRY_SCHEDULER = os.environ.get('RIDE_EXPIRY_SCHEDULER', '1') == '1'
+
+# Deliver ride events (rides.outbox) from each web server process: on the event loop under ASGI, in a
+# thread of its own under WSGI. Turn off when `run_background_jobs` delivers them
+RIDE_EVENT_DISPATCHER = os.environ.get('RIDE_EVENT_DISPATCHER', '1') == '1'
+
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
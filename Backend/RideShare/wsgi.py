@@ -14,3 +14,9 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'RideShare.settings')
 
 application = get_wsgi_application()
+
+# Imported after Django is set up: loads models. There is no event loop here, so the ride-event
+# dispatcher gets a thread of its own
+from .background import start_background_jobs
+
+start_background_jobs()
@@ -5,11 +5,11 @@ from .models import ChatMessage
 class ChatMessageAdmin(admin.ModelAdmin):
     list_display = ('ride', 'user', 'message_preview', 'timestamp')
     search_fields = ('ride__ride_code', 'user__first_name', 'user__last_name')
-    list_filter = ('ride', 'timestamp')
-    readonly_fields = ('message_json',)
+    list_filter = ('ride', 'kind', 'timestamp')
+    readonly_fields = ('text', 'kind')
 
     def message_preview(self, obj):
-        return obj.message_json.get('message', 'No message')[:50] if obj.message_json else 'No data'
+        return obj.text[:50]
     message_preview.short_description = 'Message Preview'
 
     # Allow deletion of ChatMessage objects
@@ -0,0 +1,48 @@
+"""
+JWT authentication for WebSocket connections.
+
+The access token from the ``Authorization: Bearer`` header is validated locally (signature and
+expiry), and the user is looked up through users.cache, so a reconnecting client usually costs no
+database query. The result is put on ``scope['user']``; AnonymousUser if anything is wrong.
+"""
+import logging
+
+from channels.middleware import BaseMiddleware
+from django.contrib.auth.models import AnonymousUser
+from rest_framework_simplejwt.exceptions import TokenError
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.tokens import AccessToken
+
+from users.cache import aget_cached_user
+
+logger = logging.getLogger(__name__)
+
+
+def token_from_headers(headers):
+    for name, value in headers:
+        if name == b'authorization':
+            scheme, _, token = value.decode('latin1').partition(' ')
+            return token.strip() if scheme == 'Bearer' else None
+    return None
+
+
+async def user_from_token(token):
+    if not token:
+        return AnonymousUser()
+    try:
+        user_id = AccessToken(token)[api_settings.USER_ID_CLAIM]
+    except (TokenError, KeyError) as e:
+        logger.error(f"Token authentication failed: {str(e)}")
+        return AnonymousUser()
+
+    user = await aget_cached_user(user_id)
+    if user is None or not user.is_active:
+        logger.warning(f"Token for missing or inactive user {user_id}")
+        return AnonymousUser()
+    return user
+
+
+class JWTAuthMiddleware(BaseMiddleware):
+    async def __call__(self, scope, receive, send):
+        scope = dict(scope, user=await user_from_token(token_from_headers(scope.get('headers', []))))
+        return await super().__call__(scope, receive, send)
@@ -0,0 +1,185 @@
+"""
+Per-ride ring buffers of the most recent chat messages, kept in process memory.
+
+Each ride's buffer holds its last ``CHAT_CACHE_MESSAGES_PER_RIDE`` messages as (id, timestamp,
+message) tuples in (timestamp, id) order, as chat.history reads them from the database, the
+message already in the chat.wire format, so the history frame sent on
+connect, and its cursor, can be built without a query. Buffers are filled from the database on
+the first connect and appended to as messages are written. Rides that go idle, complete or are
+deleted are evicted, and when the buffers together exceed ``CHAT_CACHE_MAX_BYTES`` the least
+recently used rides are dropped.
+
+The cache is per process: it only sees messages written by the same server process, which is how
+the chat is deployed today (one ASGI process with the in-memory channel layer).
+"""
+import json
+import threading
+import time
+from collections import OrderedDict, deque
+
+from RideShare.conf import setting_default
+
+
+def message_size(message):
+    """Rough in-memory size of one cached message, used for the overall cap."""
+    return len(json.dumps(message)) + 100
+
+
+class RideBuffer:
+    __slots__ = ('messages', 'complete', 'size', 'last_used')
+
+    def __init__(self, capacity):
+        self.messages = deque(maxlen=capacity)
+        # True while the buffer holds the ride's whole chat, i.e. there is nothing older in the DB
+        self.complete = True
+        self.size = 0
+        self.last_used = time.monotonic()
+
+    def append(self, message):
+        messages = self.messages
+        key = message[1], message[0]
+        if len(messages) == messages.maxlen:
+            self.complete = False
+            if key < (messages[0][1], messages[0][0]):
+                # Older than everything kept, so it is not among the newest messages
+                return
+            self.size -= message_size(messages.popleft()[2])
+        # Messages commit out of timestamp order: a write-behind message carries the time it was
+        # received, so an event committed while it was queued can come in ahead of it
+        position = len(messages)
+        while position and (messages[position - 1][1], messages[position - 1][0]) > key:
+            position -= 1
+        messages.insert(position, message)
+        self.size += message_size(message[2])
+
+
+class RecentMessageCache:
+    def __init__(self, per_ride=None, max_bytes=None, idle_seconds=None):
+        self._per_ride = per_ride
+        self._max_bytes = max_bytes
+        self._idle_seconds = idle_seconds
+        self.size = 0
+        self._buffers = OrderedDict()  # ride_id -> RideBuffer, least recently used first
+        # Ticks on every write and eviction, so a fill based on an older read is discarded. Cached
+        # rides have their own version; every other ride shares _floor, which moves on writes to
+        # uncached rides and on evictions. Only cached rides take an entry, so this stays bounded.
+        self._clock = 0
+        self._floor = 0
+        self._versions = {}
+        self._lock = threading.Lock()
+
+    @property
+    def per_ride(self):
+        return setting_default(self._per_ride, 'CHAT_CACHE_MESSAGES_PER_RIDE')
+
+    @property
+    def max_bytes(self):
+        return setting_default(self._max_bytes, 'CHAT_CACHE_MAX_BYTES')
+
+    @property
+    def idle_seconds(self):
+        return setting_default(self._idle_seconds, 'CHAT_CACHE_IDLE_SECONDS')
+
+    def __len__(self):
+        return len(self._buffers)
+
+    def version(self, ride_id):
+        with self._lock:
+            return self._versions.get(ride_id, self._floor)
+
+    def latest(self, ride_id, limit):
+        """
+        Return the newest ``limit`` cached messages for a ride as (rows, has_older), oldest first,
+        or None on a miss. ``limit`` must not exceed the per-ride capacity.
+        """
+        with self._lock:
+            self._evict_idle()
+            buffer = self._buffers.get(ride_id)
+            if buffer is None:
+                return None
+            self._touch(ride_id, buffer)
+            rows = list(buffer.messages)
+            complete = buffer.complete
+        return rows[-limit:], len(rows) > limit or not complete
+
+    def fill(self, ride_id, rows, has_older, version):
+        """
+        Store a ride's newest messages (oldest first) read from the database. Ignored if the ride
+        was written to or evicted since ``version`` was taken, because rows may be missing then.
+        """
+        with self._lock:
+            if self._versions.get(ride_id, self._floor) != version:
+                return
+            self._discard(ride_id)
+            self._versions[ride_id] = version
+            buffer = RideBuffer(self.per_ride)
+            for row in rows[-self.per_ride:]:
+                buffer.append(row)
+            buffer.complete = not has_older and len(rows) <= self.per_ride
+            self._buffers[ride_id] = buffer
+            self.size += buffer.size
+            self._enforce_cap()
+
+    def append(self, ride_id, message_id, timestamp, message):
+        """Record a message that has been committed to the database, in its (timestamp, id) place."""
+        with self._lock:
+            self._clock += 1
+            buffer = self._buffers.get(ride_id)
+            if buffer is None:
+                self._floor = self._clock
+                return
+            self._versions[ride_id] = self._clock
+            # A ride being written to is in use, even if nobody has connected for a while
+            self._touch(ride_id, buffer)
+            self.size -= buffer.size
+            buffer.append((message_id, timestamp, message))
+            self.size += buffer.size
+            self._enforce_cap()
+
+    def evict(self, ride_id):
+        self.evict_many([ride_id])
+
+    def evict_many(self, ride_ids):
+        with self._lock:
+            for ride_id in ride_ids:
+                self._discard(ride_id)
+            # Also invalidates fills that started before the ride was cached
+            self._clock += 1
+            self._floor = self._clock
+
+    def clear(self):
+        with self._lock:
+            self._buffers.clear()
+            self._versions.clear()
+            self._clock += 1
+            self._floor = self._clock
+            self.size = 0
+
+    def _touch(self, ride_id, buffer):
+        buffer.last_used = time.monotonic()
+        self._buffers.move_to_end(ride_id)
+
+    def _discard(self, ride_id):
+        buffer = self._buffers.pop(ride_id, None)
+        if buffer is not None:
+            self.size -= buffer.size
+            # The ride falls back to the shared version, which must not match a fill read earlier
+            del self._versions[ride_id]
+            self._clock += 1
+            self._floor = self._clock
+
+    def _evict_idle(self):
+        cutoff = time.monotonic() - self.idle_seconds
+        while self._buffers:
+            ride_id, buffer = next(iter(self._buffers.items()))
+            if buffer.last_used >= cutoff:
+                break
+            self._discard(ride_id)
+
+    def _enforce_cap(self):
+        while self.size > self.max_bytes and self._buffers:
+            ride_id = next(iter(self._buffers))
+            self._discard(ride_id)
+
+
+recent_messages = RecentMessageCache()
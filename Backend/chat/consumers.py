@@ -1,41 +1,58 @@
 import json
+from channels.db import aclose_old_connections
+from channels.exceptions import ChannelFull
 from channels.generic.websocket import AsyncWebsocketConsumer
-from channels.db import database_sync_to_async
+from django.utils import timezone
+from .history import InvalidCursor, ahistory_page
 from .models import ChatMessage
+from .wire import epoch_ms, is_user_message, wire_message
+from .writebehind import chat_writes
+from RideShare.consumers import NoDatabaseDispatchMixin
 from rides.models import Ride
-from django.core.exceptions import ObjectDoesNotExist
+from users.models import User
 import logging
-from rest_framework_simplejwt.authentication import JWTAuthentication
 from django.contrib.auth.models import AnonymousUser
 
 logger = logging.getLogger(__name__)
 
-class RideChatConsumer(AsyncWebsocketConsumer):
+class RideChatConsumer(NoDatabaseDispatchMixin, AsyncWebsocketConsumer):
+    # Incoming chat messages and broadcasts never query the database; history reads, the only
+    # queries reachable from receive(), close old connections themselves
+    NO_DB_MESSAGE_TYPES = frozenset({'websocket.receive', 'chat_message'})
+
     async def connect(self):
-        self.ride_id = self.scope['url_route']['kwargs']['ride_id']
+        self.ride_id = int(self.scope['url_route']['kwargs']['ride_id'])
         self.room_group_name = f"chat_ride_{self.ride_id}"
+        # Senders whose names this connection has been sent (chat.wire)
+        self.senders = set()
 
-        logger.info(f"Attempting connection to ride {self.ride_id}")
-        user = await self.get_user_from_token()
-        self.scope['user'] = user
-        logger.info(f"Authenticated user: {user} (Anonymous: {isinstance(user, AnonymousUser)})")
+        # Set by chat.auth.JWTAuthMiddleware
+        user = self.scope.get('user', AnonymousUser())
+        logger.info(f"Connection to ride {self.ride_id} by {user} (Anonymous: {isinstance(user, AnonymousUser)})")
 
-        if isinstance(user, AnonymousUser) or not await self.is_user_in_ride(user, self.ride_id):
+        # Membership is checked once here and cached for the connection; the leave, complete and
+        # delete flows send membership_changed to the group when it has to be checked again
+        self.is_member = not isinstance(user, AnonymousUser) and await self.is_user_in_ride(user, self.ride_id)
+        if not self.is_member:
             logger.warning(f"Access denied for user {user} to ride {self.ride_id}")
             await self.close(code=4403)
             return
 
         logger.info(f"User {user} connected to {self.room_group_name}")
-        await self.channel_layer.group_add(
-            self.room_group_name,
-            self.channel_name
-        )
+        try:
+            await self.channel_layer.group_add(
+                self.room_group_name,
+                self.channel_name
+            )
+        except ChannelFull:
+            # The ride's group is at the layer's group_capacity; 1013 is "try again later"
+            logger.warning(f"Chat group {self.room_group_name} is full, refusing {user}")
+            await self.close(code=1013)
+            return
         await self.accept()
 
-        # Send all previous messages to the user upon connection
-        previous_messages = await self.get_previous_messages()
-        for message in previous_messages:
-            await self.send(text_data=json.dumps(message))
+        # Send the latest messages as one frame; the client pages further back with history_before
+        await self.send_history()
 
     async def disconnect(self, close_code):
         logger.info(f"Disconnecting from {self.room_group_name} with code {close_code}")
@@ -46,116 +63,111 @@ class RideChatConsumer(AsyncWebsocketConsumer):
 
     async def receive(self, text_data):
         logger.info(f"Received raw data: '{text_data}'")
-        user = self.scope['user']
+        user = self.scope.get('user', AnonymousUser())
 
-        # Revalidate membership before processing the message
-        if not await self.is_user_in_ride(user, self.ride_id):
-            logger.warning(f"User {user} is no longer in ride {self.ride_id}, closing connection")
+        if not self.is_member:
             await self.close(code=4403)
             return
 
         try:
             text_data_json = json.loads(text_data)
-            message = text_data_json['message']
-
-            # Prepare the full message JSON
-            message_data = {
-                'message': message,
-                'First Name': user.first_name,
-                'Last Name': user.last_name,
-                'timestamp': str(await self.get_current_time()),
-            }
-
-            # Save the full message JSON to the database
-            await self.save_message(user, self.ride_id, message_data)
-
-            # Broadcast the message to the group
-            await self.channel_layer.group_send(
-                self.room_group_name,
-                {
-                    'type': 'chat_message',
-                    'message_data': message_data,
-                }
-            )
         except json.JSONDecodeError as e:
             logger.error(f"Failed to parse JSON: {str(e)}")
             message = text_data if text_data else ""
-            if not message:
-                await self.send(text_data=json.dumps({"error": "Empty message received"}))
+        else:
+            if not isinstance(text_data_json, dict):
+                await self.send_json({"error": "Expected a JSON object"})
+                return
+            if text_data_json.get('type') == 'history_before':
+                await self.send_history(text_data_json.get('cursor'))
                 return
-            message_data = {
-                'message': message,
-                'First Name': user.first_name,
-                'Last Name': user.last_name,
-                'timestamp': str(await self.get_current_time()),
+            message = text_data_json['m'] if 'm' in text_data_json else text_data_json.get('message')
+            # Broadcast as received and stored as text, so anything but a string is refused
+            if not isinstance(message, str):
+                await self.send_json({"error": "Message text must be a string in 'm' or 'message'"})
+                return
+        if not message:
+            await self.send_json({"error": "Empty message received"})
+            return
+
+        # Nothing below leaves the event loop: the timestamp is taken here, the write is queued
+        # for chat_writes to batch, and the broadcast goes straight to the channel layer
+        now = timezone.now()
+        chat_writes.add(self.ride_id, user.id, message, now)
+        await self.channel_layer.group_send(
+            self.room_group_name,
+            {
+                'type': 'chat_message',
+                'message_data': wire_message(user.id, message, ChatMessage.Kind.USER, now),
+                # For connections that have not seen this sender yet
+                'sender': [user.first_name, user.last_name],
             }
-            await self.save_message(user, self.ride_id, message_data)
-            await self.channel_layer.group_send(
-                self.room_group_name,
-                {
-                    'type': 'chat_message',
-                    'message_data': message_data,
-                }
-            )
+        )
 
     async def chat_message(self, event):
         # Handle the message payload safely
         message_data = event.get('message_data', {})
-        if not message_data or 'message' not in message_data:
+        if not message_data or 'm' not in message_data:
             logger.error(f"Invalid message_data in event: {event}")
-            await self.send(text_data=json.dumps({
-                "message": "System error: Invalid message format received.",
-                "First Name": "System",
-                "Last Name": "",
-                "timestamp": str(await self.get_current_time())
-            }))
+            await self.send_json({
+                "s": None,
+                "m": "System error: Invalid message format received.",
+                "ts": epoch_ms(timezone.now()),
+                "k": ChatMessage.Kind.SYSTEM,
+            })
             return
-        await self.send(text_data=json.dumps(message_data))
+        sender_id = message_data['s']
+        if is_user_message(message_data) and sender_id not in self.senders and 'sender' in event:
+            self.senders.add(sender_id)
+            await self.send_json({"type": "senders", "senders": {sender_id: event['sender']}})
+        await self.send_json(message_data)
 
-    async def user_leave(self, event):
-        # This handler is kept for future use if we implement channel-specific disconnects
-        logger.info(f"User leave event received for ride {self.ride_id}, but no action taken due to scope issue")
-        # Note: This won't be triggered directly from the view anymore
-
-    @database_sync_to_async
-    def get_user_from_token(self):
-        try:
-            auth = JWTAuthentication()
-            headers = {key.decode(): value.decode() for key, value in self.scope['headers']}
-            token = headers.get('authorization', '').replace('Bearer ', '')
-            validated_token = auth.get_validated_token(token)
-            return auth.get_user(validated_token)
-        except Exception as e:
-            logger.error(f"Token authentication failed: {str(e)}")
-            return AnonymousUser()
-
-    @database_sync_to_async
-    def is_user_in_ride(self, user, ride_id):
+    async def send_history(self, before=None):
         try:
-            ride = Ride.objects.get(id=ride_id)
-            is_member = user == ride.host or user in ride.members.all()
-            logger.info(f"Checking if {user} is in ride {ride_id}: {is_member}")
-            return is_member
-        except ObjectDoesNotExist:
-            logger.error(f"Ride {ride_id} does not exist")
-            return False
-
-    @database_sync_to_async
-    def save_message(self, user, ride_id, message_data):
-        ride = Ride.objects.get(id=ride_id)
-        ChatMessage.objects.create(ride=ride, user=user, message_json=message_data)
-
-    @database_sync_to_async
-    def get_previous_messages(self):
-        try:
-            ride = Ride.objects.get(id=self.ride_id)
-            messages = ChatMessage.objects.filter(ride=ride).order_by('timestamp')
-            return [msg.message_json for msg in messages]
-        except ObjectDoesNotExist:
-            logger.error(f"Ride {self.ride_id} does not exist")
-            return []
-
-    @database_sync_to_async
-    def get_current_time(self):
-        from django.utils import timezone
-        return timezone.now()
\ No newline at end of file
+            messages, history_before = await self.get_history_page(before)
+        except InvalidCursor:
+            await self.send_json({"error": "Invalid history cursor"})
+            return
+        unseen = {message['s'] for message in messages if is_user_message(message)} - self.senders
+        self.senders |= unseen
+        await self.send_json({
+            "type": "history",
+            "senders": await self.sender_names(unseen),
+            "messages": messages,
+            "history_before": history_before,
+        })
+
+    async def send_json(self, content):
+        await self.send(text_data=json.dumps(content, separators=(',', ':')))
+
+    async def channel_overflow(self, event):
+        # The channel layer gave up on this socket because it fell too far behind; the client
+        # reconnects and gets the history frame again
+        logger.warning(f"Closing slow connection for {self.scope['user']} in ride {self.ride_id}")
+        await self.close(code=4008)
+
+    async def membership_changed(self, event):
+        # Sent without a user_id when the ride itself changed, so every connection re-checks
+        user = self.scope.get('user', AnonymousUser())
+        if event.get('user_id') not in (None, user.id):
+            return
+        self.is_member = await self.is_user_in_ride(user, self.ride_id)
+        if not self.is_member:
+            logger.info(f"User {user} is no longer in ride {self.ride_id}, closing connection")
+            await self.close(code=4403)
+
+    async def is_user_in_ride(self, user, ride_id):
+        # A completed ride's chat is purged and closed to everyone
+        is_member = await Ride.objects.involving(user).filter(id=ride_id, is_completed=False).aexists()
+        logger.info(f"Checking if {user} is in ride {ride_id}: {is_member}")
+        return is_member
+
+    async def sender_names(self, user_ids):
+        if not user_ids:
+            return {}
+        users = User.objects.filter(id__in=user_ids).values_list('id', 'first_name', 'last_name')
+        return {user_id: [first_name, last_name] async for user_id, first_name, last_name in users}
+
+    async def get_history_page(self, before=None):
+        await aclose_old_connections()
+        return await ahistory_page(self.ride_id, before=before)
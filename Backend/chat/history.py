@@ -0,0 +1,92 @@
+"""
+Backward paging through a ride's chat history, newest page first.
+
+Pages are keyset ranges on (timestamp, id), so each one is a short range scan on
+chat_ride_timestamp_idx no matter how far back the client has scrolled. The newest page, which
+every connect asks for, is served from the chat.cache ring buffer when the ride is cached.
+"""
+from django.conf import settings
+from django.db.models import Q
+
+from RideShare.cursors import InvalidCursor, decode_cursor, encode_cursor
+from .cache import recent_messages
+from .models import ChatMessage
+from .wire import wire_message
+
+
+def history_page(ride_id, before=None, limit=None):
+    """
+    Return (messages, history_before) for the page of up to ``limit`` messages older than the
+    ``before`` cursor (or the newest page). Messages are oldest first, ready to display;
+    history_before is the cursor for the next older page, or None at the start of the chat.
+    """
+    limit = limit or settings.CHAT_HISTORY_PAGE_SIZE
+    if before is None and limit <= recent_messages.per_ride:
+        page, has_older = latest_rows(ride_id, limit)
+    else:
+        page, has_older = _read_rows(ride_id, before, limit)
+    return _page(page, has_older)
+
+
+async def ahistory_page(ride_id, before=None, limit=None):
+    """history_page for the consumer: a cache hit never leaves the event loop, misses use the async ORM."""
+    limit = limit or settings.CHAT_HISTORY_PAGE_SIZE
+    if before is None and limit <= recent_messages.per_ride:
+        page, has_older = await alatest_rows(ride_id, limit)
+    else:
+        page, has_older = await _aread_rows(ride_id, before, limit)
+    return _page(page, has_older)
+
+
+def _page(page, has_older):
+    # Rows are in (timestamp, id) order, so the first holds the page's smallest key
+    history_before = encode_cursor(page[0][1], page[0][0]) if has_older else None
+    return [message for _, _, message in page], history_before
+
+
+def latest_rows(ride_id, limit):
+    """The newest ``limit`` (id, timestamp, wire message) rows, from the cache or else the DB."""
+    cached = recent_messages.latest(ride_id, limit)
+    if cached is not None:
+        return cached
+    version = recent_messages.version(ride_id)
+    rows, has_older = _read_rows(ride_id, None, recent_messages.per_ride)
+    recent_messages.fill(ride_id, rows, has_older, version)
+    return rows[-limit:], has_older or len(rows) > limit
+
+
+async def alatest_rows(ride_id, limit):
+    cached = recent_messages.latest(ride_id, limit)
+    if cached is not None:
+        return cached
+    version = recent_messages.version(ride_id)
+    rows, has_older = await _aread_rows(ride_id, None, recent_messages.per_ride)
+    recent_messages.fill(ride_id, rows, has_older, version)
+    return rows[-limit:], has_older or len(rows) > limit
+
+
+def _rows_query(ride_id, before, limit):
+    messages = ChatMessage.objects.filter(ride_id=ride_id)
+    if before is not None:
+        timestamp, message_id = decode_cursor(before)
+        messages = messages.filter(Q(timestamp__lt=timestamp) | Q(timestamp=timestamp, id__lt=message_id))
+
+    # One extra row says whether an older page exists
+    return messages.order_by('-timestamp', '-id').values_list('id', 'timestamp', 'user_id', 'text', 'kind')[:limit + 1]
+
+
+def _to_rows(records, limit):
+    rows = [
+        (message_id, timestamp, wire_message(user_id, text, kind, timestamp))
+        for message_id, timestamp, user_id, text, kind in records[:limit]
+    ]
+    return rows[::-1], len(records) > limit
+
+
+def _read_rows(ride_id, before, limit):
+    """Up to ``limit`` rows older than the ``before`` cursor, oldest first, and whether older rows exist."""
+    return _to_rows(list(_rows_query(ride_id, before, limit)), limit)
+
+
+async def _aread_rows(ride_id, before, limit):
+    return _to_rows([record async for record in _rows_query(ride_id, before, limit)], limit)
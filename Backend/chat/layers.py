@@ -0,0 +1,139 @@
+"""
+In-memory channel layer with bounded queues and counters, for single-process deployments.
+
+InMemoryChannelLayer already caps each channel's queue (``capacity``) and expires old messages
+(``expiry``), but a full queue silently loses group messages and nothing reports how much is
+queued. This layer adds:
+
+* ``group_capacity``: the most channels a group may hold; group_add beyond it raises ChannelFull.
+* ``overflow_policy`` for a full channel queue:
+    - ``"raise"``: the stock behaviour; send() raises ChannelFull and group_send skips the channel.
+    - ``"drop_oldest"``: the oldest queued message is dropped to make room.
+    - ``"close"``: the queue is cleared, the channel leaves all its groups and gets one
+      ``channel.overflow`` message, which RideChatConsumer answers by closing the socket.
+* ``clean_interval``: expired messages are swept at most this often instead of on every call.
+* ``stats()``: queue depths, group fan-out and drop/expiry counters.
+"""
+import asyncio
+import time
+from collections import Counter
+from copy import deepcopy
+
+from channels.exceptions import ChannelFull
+from channels.layers import InMemoryChannelLayer
+
+OVERFLOW_POLICIES = ('raise', 'drop_oldest', 'close')
+OVERFLOW_MESSAGE_TYPE = 'channel.overflow'
+
+
+class BoundedInMemoryChannelLayer(InMemoryChannelLayer):
+
+    def __init__(self, group_capacity=None, overflow_policy='raise', clean_interval=1.0, **kwargs):
+        super().__init__(**kwargs)
+        if overflow_policy not in OVERFLOW_POLICIES:
+            raise ValueError(f"overflow_policy must be one of {', '.join(OVERFLOW_POLICIES)}")
+        self.group_capacity = group_capacity
+        self.overflow_policy = overflow_policy
+        self.clean_interval = clean_interval
+        self.counters = Counter()
+        # Channels told to close after overflowing; further messages to them are dropped
+        self.closing = set()
+        self._last_clean = 0.0
+
+    async def send(self, channel, message):
+        assert isinstance(message, dict), "message is not a dict"
+        assert self.valid_channel_name(channel), "Channel name not valid"
+        assert "__asgi_channel__" not in message
+
+        if channel in self.closing:
+            self.counters['dropped_closing'] += 1
+            return
+        queue = self.channels.get(channel)
+        if queue is None:
+            queue = self.channels[channel] = asyncio.Queue(maxsize=self.get_capacity(channel))
+        if queue.full():
+            if self.overflow_policy == 'raise':
+                self.counters['dropped_full'] += 1
+                raise ChannelFull(channel)
+            if self.overflow_policy == 'drop_oldest':
+                queue.get_nowait()
+                self.counters['dropped_oldest'] += 1
+            else:
+                self._close_slow_channel(channel, queue)
+                return
+        queue.put_nowait((time.time() + self.expiry, deepcopy(message)))
+        self.counters['sent'] += 1
+
+    def _close_slow_channel(self, channel, queue):
+        self.counters['dropped_overflow'] += queue.qsize()
+        self.counters['closed_slow_channels'] += 1
+        while not queue.empty():
+            queue.get_nowait()
+        self._remove_from_groups(channel)
+        self.closing.add(channel)
+        queue.put_nowait((time.time() + self.expiry, {'type': OVERFLOW_MESSAGE_TYPE}))
+
+    def _remove_from_groups(self, channel):
+        # Unlike the stock layer, also drop groups left empty so they do not pile up
+        for group, members in list(self.groups.items()):
+            members.pop(channel, None)
+            if not members:
+                del self.groups[group]
+
+    async def receive(self, channel):
+        message = await super().receive(channel)
+        if message.get('type') == OVERFLOW_MESSAGE_TYPE:
+            self.closing.discard(channel)
+        return message
+
+    async def group_add(self, group, channel):
+        members = self.groups.get(group, {})
+        if self.group_capacity is not None and channel not in members and len(members) >= self.group_capacity:
+            self.counters['group_rejections'] += 1
+            raise ChannelFull(group)
+        await super().group_add(group, channel)
+
+    async def group_send(self, group, message):
+        members = len(self.groups.get(group, ()))
+        self.counters['group_sends'] += 1
+        self.counters['group_deliveries'] += members
+        await super().group_send(group, message)
+
+    def _clean_expired(self):
+        now = time.monotonic()
+        if now - self._last_clean < self.clean_interval:
+            return
+        self._last_clean = now
+        queued = sum(queue.qsize() for queue in self.channels.values())
+        super()._clean_expired()
+        self.counters['expired'] += queued - sum(queue.qsize() for queue in self.channels.values())
+        # A closing channel whose overflow message expired unread is gone for good
+        self.closing.intersection_update(self.channels)
+
+    async def flush(self):
+        await super().flush()
+        self.closing.clear()
+
+    def stats(self, top_groups=10):
+        """
+        Snapshot of queue depths, group sizes and counters since start-up. Called from the stats
+        view's worker thread while the event loop changes the layer, so every dict is copied in one
+        step (atomic under the GIL) before it is iterated.
+        """
+        queues = list(self.channels.values())
+        groups = list(self.groups.items())
+        counters = dict(self.counters)
+        depths = [queue.qsize() for queue in queues]
+        group_sizes = sorted(((len(members), group) for group, members in groups), reverse=True)
+        group_sends = counters.get('group_sends', 0)
+        return {
+            'channels': len(queues),
+            'queued_messages': sum(depths),
+            'max_queue_depth': max(depths, default=0),
+            'groups': len(groups),
+            'ride_chat_groups': sum(1 for group, _ in groups if group.startswith('chat_ride_')),
+            'largest_groups': {group: size for size, group in group_sizes[:top_groups]},
+            'average_fan_out': counters.get('group_deliveries', 0) / group_sends if group_sends else 0.0,
+            'overflow_policy': self.overflow_policy,
+            'counters': counters,
+        }
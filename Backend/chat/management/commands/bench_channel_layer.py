@@ -0,0 +1,52 @@
+import asyncio
+import time
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import nullcontext
+from multiprocessing import get_context
+
+from django.core.management.base import BaseCommand
+
+from RideShare.bench import local_redis_server, publish_to_group, redis_channel_layer
+
+
+class Command(BaseCommand):
+    help = ("Group-message throughput through the Redis channel layer with several sending processes, "
+            "as when HTTP workers broadcast to sockets held by another daphne process.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--redis-url', help="Redis server to use (default: an in-process fakeredis server).")
+        parser.add_argument('--processes', type=int, default=4, help="Sending processes.")
+        parser.add_argument('--messages', type=int, default=2000, help="Messages sent by each process.")
+
+    def handle(self, *args, **options):
+        server = nullcontext(options['redis_url']) if options['redis_url'] else local_redis_server()
+        with server as redis_url:
+            sent, elapsed, send_seconds = asyncio.run(
+                self.run(redis_url, options['processes'], options['messages'])
+            )
+
+        backend = options['redis_url'] or 'fakeredis (in-process stand-in, much slower than Redis)'
+        self.stdout.write(f"backend: {backend}")
+        self.stdout.write(f"{sent} messages from {options['processes']} processes received in {elapsed:.2f}s: "
+                          f"{sent / elapsed:,.0f} msg/s end to end")
+        self.stdout.write(f"per sending process: {options['messages'] / max(send_seconds):,.0f} msg/s (slowest)")
+
+    async def run(self, redis_url, processes, per_process):
+        layer = redis_channel_layer(redis_url, capacity=processes * per_process)
+        channel = await layer.new_channel()
+        await layer.group_add('bench', channel)
+        loop = asyncio.get_running_loop()
+        with ProcessPoolExecutor(max_workers=processes, mp_context=get_context('spawn')) as pool:
+            # Start the workers first so interpreter start-up is not counted
+            await asyncio.gather(*(loop.run_in_executor(pool, abs, 0) for _ in range(processes)))
+            start = time.perf_counter()
+            senders = [
+                loop.run_in_executor(pool, publish_to_group, redis_url, 'bench', f'p{i}', per_process)
+                for i in range(processes)
+            ]
+            for _ in range(processes * per_process):
+                await layer.receive(channel)
+            elapsed = time.perf_counter() - start
+            send_seconds = await asyncio.gather(*senders)
+        await layer.close_pools()
+        return processes * per_process, elapsed, send_seconds
@@ -0,0 +1,102 @@
+import asyncio
+import json
+import time
+
+from asgiref.sync import async_to_sync
+from channels.db import database_sync_to_async
+from channels.generic.websocket import AsyncWebsocketConsumer
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+from django.core.management.base import BaseCommand
+from django.urls import re_path
+from django.utils import timezone
+from rest_framework_simplejwt.tokens import AccessToken
+
+from RideShare.bench import isolated_database, latency_summary
+from chat.auth import JWTAuthMiddleware
+from chat.consumers import RideChatConsumer
+from chat.writebehind import chat_writes
+from rides.models import Ride
+from users.models import User
+
+
+class ThreadHopConsumer(RideChatConsumer):
+    """The hot path as it was: stock dispatch, plus a database_sync_to_async hop for the timestamp."""
+
+    async def dispatch(self, message):
+        await AsyncWebsocketConsumer.dispatch(self, message)
+
+    async def receive(self, text_data):
+        await database_sync_to_async(timezone.now)()
+        await super().receive(text_data)
+
+
+class Command(BaseCommand):
+    help = "Per-message latency and per-connection CPU of the chat consumer, with and without thread hops."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--connections', type=int, default=50, help="Concurrent chat connections.")
+        parser.add_argument('--messages', type=int, default=200, help="Messages sent by each connection.")
+
+    def handle(self, *args, **options):
+        with isolated_database():
+            hosts = []
+            for i in range(options['connections']):
+                host = User.objects.create_user(
+                    email=f'bench{i}@northsouth.edu', first_name='Bench', last_name=str(i),
+                    gender='Male', student_id=str(i),
+                )
+                ride = Ride.objects.create(
+                    host=host, vehicle_type='CNG', pickup_name='NSU', destination_name='Gulshan',
+                    departure_time='2030-01-01T00:00:00Z', total_fare=300,
+                )
+                hosts.append((ride.id, str(AccessToken.for_user(host))))
+
+            results = async_to_sync(self.run_all)(hosts, options['messages'])
+
+        self.stdout.write(f"{options['connections']} connections x {options['messages']} messages, "
+                          f"latency from send to the sender's own echo")
+        for name, (latencies, cpu_seconds) in results.items():
+            self.stdout.write(f"{name:<12}: {latency_summary(latencies)}")
+            self.stdout.write(f"{'':<12}  CPU {cpu_seconds * 1000 / options['connections']:.1f} ms per connection, "
+                              f"{cpu_seconds * 1e6 / len(latencies):.0f} us per message")
+
+    async def run_all(self, hosts, messages):
+        results = {}
+        for name, consumer in (('thread hops', ThreadHopConsumer), ('async', RideChatConsumer)):
+            application = JWTAuthMiddleware(URLRouter([
+                re_path(r'ws/ride/(?P<ride_id>\d+)/$', consumer.as_asgi()),
+            ]))
+            results[name] = await self.run(application, hosts, messages)
+        return results
+
+    async def run(self, application, hosts, messages):
+        """Per-message latencies in ms and the process CPU seconds spent sending and echoing them."""
+        communicators = []
+        for ride_id, token in hosts:
+            communicator = WebsocketCommunicator(
+                application, f'/ws/ride/{ride_id}/', headers=[(b'authorization', f'Bearer {token}'.encode())],
+            )
+            await communicator.connect()
+            await communicator.receive_json_from()
+            communicators.append(communicator)
+
+        async def chat(communicator):
+            latencies = []
+            for i in range(messages):
+                start = time.perf_counter()
+                await communicator.send_to(text_data=json.dumps({'message': f'message {i}'}))
+                # Skip the one-off senders frame (chat.wire) that precedes a first message
+                while 'type' in json.loads(await communicator.receive_from()):
+                    pass
+                latencies.append((time.perf_counter() - start) * 1000)
+            return latencies
+
+        cpu_start = time.process_time()
+        per_connection = await asyncio.gather(*(chat(communicator) for communicator in communicators))
+        cpu_seconds = time.process_time() - cpu_start
+
+        for communicator in communicators:
+            await communicator.disconnect()
+        await chat_writes.flush()
+        return [latency for latencies in per_connection for latency in latencies], cpu_seconds
@@ -0,0 +1,180 @@
+import asyncio
+import json
+import random
+import time
+from collections import Counter
+
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+from django.core.management.base import BaseCommand
+from rest_framework_simplejwt.tokens import AccessToken
+
+from RideShare.bench import isolated_database, latency_summary, rss_bytes
+from chat.auth import JWTAuthMiddleware
+from chat.routing import websocket_urlpatterns
+from chat.writebehind import chat_writes
+from rides.models import Ride, RideMembership
+from users.models import User
+
+
+class LoadStats:
+    def __init__(self):
+        self.connect_ms = []  # Initial ramp-up
+        self.reconnect_ms = []  # Churn
+        self.fan_out_ms = []
+        self.counters = Counter()
+        self.close_codes = Counter()
+
+
+class Command(BaseCommand):
+    help = ("Load-test RideChatConsumer in process: many riders in many ride chats sending at a set rate "
+            "with reconnect churn. Reports connect latency, fan-out latency and memory per connection.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rooms', type=int, default=200, help="Ride chats.")
+        parser.add_argument('--riders-per-room', type=int, default=10, help="Riders in each chat, host included.")
+        parser.add_argument('--duration', type=float, default=30, help="Seconds of chatting after everyone is connected.")
+        parser.add_argument('--message-interval', type=float, default=10,
+                            help="Mean seconds between messages from one rider (exponentially distributed).")
+        parser.add_argument('--churn', type=float, default=1,
+                            help="Reconnects per rider per minute; 0 keeps every connection open.")
+        parser.add_argument('--connect-concurrency', type=int, default=200,
+                            help="Riders connecting at the same time in the initial ramp-up.")
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        random.seed(options['seed'])
+        with isolated_database():
+            riders = self.seed(options['rooms'], options['riders_per_room'])
+            stats, memory_per_connection, layer_stats = async_to_sync(self.run)(riders, options)
+
+        total = len(riders)
+        duration = options['duration']
+        self.stdout.write(f"{total} riders in {options['rooms']} rooms, {duration:.0f}s, "
+                          f"one message per {options['message_interval']:g}s per rider, "
+                          f"{options['churn']:g} reconnects per rider per minute")
+        self.stdout.write(f"connects   : {stats.counters['connects']} ({stats.counters['rejected']} rejected)")
+        self.stdout.write(f"  ramp-up  : {latency_summary(stats.connect_ms)}")
+        if stats.reconnect_ms:
+            self.stdout.write(f"  reconnect: {latency_summary(stats.reconnect_ms)}")
+        self.stdout.write(f"messages   : {stats.counters['sent']} sent, {len(stats.fan_out_ms)} delivered "
+                          f"({len(stats.fan_out_ms) / duration:,.0f}/s)")
+        if stats.fan_out_ms:
+            self.stdout.write(f"fan-out    : {latency_summary(stats.fan_out_ms)}")
+        if stats.close_codes:
+            self.stdout.write(f"closed by server: {dict(stats.close_codes)}")
+        if memory_per_connection is not None:
+            self.stdout.write(f"memory     : {memory_per_connection / 1024:.1f} KiB RSS per connection")
+        if layer_stats is not None:
+            self.stdout.write(f"channel layer: max queue depth {layer_stats['max_queue_depth']}, "
+                              f"counters {layer_stats['counters']}")
+
+    def seed(self, rooms, riders_per_room):
+        """Create the users and rides; returns [(ride_id, access token)] for every rider."""
+        users = []
+        for i in range(rooms * riders_per_room):
+            user = User(email=f'load{i}@northsouth.edu', first_name='Load', last_name=str(i), gender='Male')
+            user.set_unusable_password()
+            users.append(user)
+        users = User.objects.bulk_create(users)
+
+        riders, memberships = [], []
+        for room in range(rooms):
+            members = users[room * riders_per_room:(room + 1) * riders_per_room]
+            ride = Ride.objects.create(
+                host=members[0], vehicle_type='CNG', pickup_name='NSU', destination_name='Gulshan',
+                departure_time='2030-01-01T00:00:00Z', total_fare=300,
+            )
+            # Straight to the table: the harness wants bigger chats than the seat limit allows
+            memberships += [RideMembership(ride=ride, user=user) for user in members[1:]]
+            riders += [(ride.id, str(AccessToken.for_user(user))) for user in members]
+        RideMembership.objects.bulk_create(memberships)
+        return riders
+
+    async def run(self, riders, options):
+        application = JWTAuthMiddleware(URLRouter(websocket_urlpatterns))
+        stats = LoadStats()
+
+        # Ramp-up: everyone connects once, and the RSS growth over it is the memory per connection
+        rss_before = rss_bytes()
+        semaphore = asyncio.Semaphore(options['connect_concurrency'])
+
+        async def first_connect(ride_id, token):
+            async with semaphore:
+                return await self.connect(application, ride_id, token, stats, stats.connect_ms)
+
+        communicators = await asyncio.gather(*(first_connect(ride_id, token) for ride_id, token in riders))
+        rss_after = rss_bytes()
+        connected = sum(1 for communicator in communicators if communicator is not None)
+        memory_per_connection = (rss_after - rss_before) / connected if rss_before and connected else None
+
+        deadline = time.monotonic() + options['duration']
+        await asyncio.gather(*(
+            self.rider(application, ride_id, token, communicator, deadline, options, stats)
+            for (ride_id, token), communicator in zip(riders, communicators)
+        ))
+        await chat_writes.flush()
+
+        layer = get_channel_layer()
+        return stats, memory_per_connection, layer.stats() if hasattr(layer, 'stats') else None
+
+    async def connect(self, application, ride_id, token, stats, latencies):
+        """Open a socket and wait for its history frame; returns the communicator, or None if refused."""
+        communicator = WebsocketCommunicator(
+            application, f'/ws/ride/{ride_id}/', headers=[(b'authorization', f'Bearer {token}'.encode())],
+        )
+        start = time.perf_counter()
+        connected, _ = await communicator.connect(timeout=30)
+        if connected:
+            await communicator.receive_output(timeout=30)
+        latencies.append((time.perf_counter() - start) * 1000)
+        stats.counters['connects'] += 1
+        if not connected:
+            stats.counters['rejected'] += 1
+            return None
+        return communicator
+
+    async def rider(self, application, ride_id, token, communicator, deadline, options, stats):
+        """One rider: chat until the deadline, reconnecting after each exponentially distributed session."""
+        churn_per_second = options['churn'] / 60
+        while communicator is not None:
+            now = time.monotonic()
+            session_end = min(deadline, now + random.expovariate(churn_per_second)) if churn_per_second else deadline
+            reader = asyncio.create_task(self.read(communicator, deadline, stats))
+            await self.write(communicator, reader, session_end, options['message_interval'], stats)
+            if reader.done():
+                # Closed by the server (e.g. an overflowing queue); the client reconnects straight away
+                session_end = time.monotonic()
+            else:
+                reader.cancel()
+                await communicator.disconnect()
+            if session_end >= deadline:
+                return
+            communicator = await self.connect(application, ride_id, token, stats, stats.reconnect_ms)
+
+    async def write(self, communicator, reader, session_end, interval, stats):
+        """Send messages until the session ends or the server closes the socket."""
+        while True:
+            pause = random.expovariate(1 / interval)
+            if time.monotonic() + pause >= session_end:
+                await asyncio.wait([reader], timeout=max(0.0, session_end - time.monotonic()))
+                return
+            await asyncio.wait([reader], timeout=pause)
+            if reader.done():
+                return
+            # The send time rides along in the text, so every receiver can time the fan-out
+            await communicator.send_to(text_data=json.dumps({'m': f'{time.perf_counter():.6f}'}))
+            stats.counters['sent'] += 1
+
+    async def read(self, communicator, deadline, stats):
+        """Time every message this socket receives; returns when the server closes it."""
+        while True:
+            output = await communicator.receive_output(timeout=max(1.0, deadline - time.monotonic() + 30))
+            if output['type'] == 'websocket.close':
+                stats.close_codes[output.get('code')] += 1
+                return
+            frame = json.loads(output['text'])
+            if 'type' not in frame and 'm' in frame:
+                stats.fan_out_ms.append((time.perf_counter() - float(frame['m'])) * 1000)
@@ -0,0 +1,81 @@
+import asyncio
+import time
+
+from asgiref.sync import async_to_sync
+from channels.db import database_sync_to_async
+from channels.layers import get_channel_layer
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from RideShare.bench import isolated_database
+from chat.models import ChatMessage
+from chat.wire import wire_message
+from chat.writebehind import ChatWriteBuffer
+from rides.models import Ride
+from users.models import User
+
+
+class Command(BaseCommand):
+    help = "Chat messages/sec per process: a write per message versus the write-behind buffer."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--messages', type=int, default=5000, help="Messages sent in each run.")
+        parser.add_argument('--connections', type=int, default=20, help="Concurrent chat connections.")
+        parser.add_argument('--batch-size', type=int, default=200)
+        parser.add_argument('--flush-ms', type=int, default=20)
+
+    def handle(self, *args, **options):
+        with isolated_database():
+            user = User.objects.create_user(
+                email='bench@northsouth.edu', first_name='Bench', last_name='User', gender='Male', student_id='1'
+            )
+            ride = Ride.objects.create(
+                host=user, vehicle_type='CNG', pickup_name='NSU', destination_name='Gulshan',
+                departure_time='2030-01-01T00:00:00Z', total_fare=300,
+            )
+            per_connection = max(1, options['messages'] // options['connections'])
+            total = per_connection * options['connections']
+
+            def save_message(text, now):
+                ChatMessage.objects.create(ride_id=ride.id, user=user, text=text, timestamp=now)
+
+            async def write_each(layer, text):
+                now = timezone.now()
+                await database_sync_to_async(save_message)(text, now)
+                message_data = wire_message(user.id, text, ChatMessage.Kind.USER, now)
+                await layer.group_send(f"chat_ride_{ride.id}", {'type': 'chat_message', 'message_data': message_data})
+
+            buffer = ChatWriteBuffer(batch_size=options['batch_size'], flush_ms=options['flush_ms'])
+
+            async def write_behind(layer, text):
+                now = timezone.now()
+                buffer.add(ride.id, user.id, text, now)
+                message_data = wire_message(user.id, text, ChatMessage.Kind.USER, now)
+                await layer.group_send(f"chat_ride_{ride.id}", {'type': 'chat_message', 'message_data': message_data})
+
+            before = self.run(write_each, options['connections'], per_connection)
+            stored_before = ChatMessage.objects.count()
+            ChatMessage.objects.all().delete()
+            after = self.run(write_behind, options['connections'], per_connection, buffer.flush)
+            stored_after = ChatMessage.objects.count()
+
+        self.stdout.write(f"messages: {total} over {options['connections']} connections")
+        self.stdout.write(f"write per message: {total / before:,.0f} msg/s ({stored_before} stored)")
+        self.stdout.write(f"write-behind     : {total / after:,.0f} msg/s ({stored_after} stored, "
+                          f"batch {options['batch_size']}, flush every {options['flush_ms']} ms)")
+
+    def run(self, send, connections, per_connection, drain=None):
+        """Seconds for every connection to send its messages and, if given, for drain() to finish."""
+        async def connection(layer, index):
+            for i in range(per_connection):
+                await send(layer, f'{index}-{i}')
+
+        async def scenario():
+            layer = get_channel_layer()
+            start = time.perf_counter()
+            await asyncio.gather(*(connection(layer, index) for index in range(connections)))
+            if drain is not None:
+                await drain()
+            return time.perf_counter() - start
+
+        return async_to_sync(scenario)()
@@ -0,0 +1,20 @@
+# Generated by Django 5.1.7 on 2026-10-17 12:18
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0002_remove_chatmessage_content_chatmessage_message_json'),
+        ('rides', '0007_hot_query_indexes'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='chatmessage',
+            index=models.Index(fields=['ride', 'timestamp'], name='chat_ride_timestamp_idx'),
+        ),
+    ]
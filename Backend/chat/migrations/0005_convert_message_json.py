@@ -0,0 +1,66 @@
+"""
+Move each message's text out of message_json into the text and kind columns.
+
+Rows are converted in id order, CHUNK_SIZE at a time, each chunk in its own transaction, so a
+large table is never locked as a whole and an interrupted run resumes where it stopped (the
+migration is not atomic). The stringified timestamp and the sender's names in message_json are
+dropped: the row's timestamp column and the user foreign key already hold them.
+"""
+from django.db import migrations, transaction
+
+CHUNK_SIZE = 2000
+USER, SYSTEM = 0, 1
+
+
+def convert_message_json(apps, schema_editor):
+    ChatMessage = apps.get_model('chat', 'ChatMessage')
+    db = schema_editor.connection.alias
+    # Rows already converted have text set; re-running skips them
+    messages = ChatMessage.objects.using(db).filter(text='').order_by('id')
+    last_id = 0
+    while True:
+        with transaction.atomic(using=db):
+            chunk = list(messages.filter(id__gt=last_id).only('id', 'message_json')[:CHUNK_SIZE])
+            if not chunk:
+                return
+            for message in chunk:
+                data = message.message_json or {}
+                message.text = str(data.get('message', ''))
+                system = data.get('First Name') == 'System' and not data.get('Last Name')
+                message.kind = SYSTEM if system else USER
+            ChatMessage.objects.using(db).bulk_update(chunk, ['text', 'kind'])
+        last_id = chunk[-1].id
+
+
+def restore_message_json(apps, schema_editor):
+    ChatMessage = apps.get_model('chat', 'ChatMessage')
+    db = schema_editor.connection.alias
+    messages = ChatMessage.objects.using(db).select_related('user').order_by('id')
+    last_id = 0
+    while True:
+        with transaction.atomic(using=db):
+            chunk = list(messages.filter(id__gt=last_id)[:CHUNK_SIZE])
+            if not chunk:
+                return
+            for message in chunk:
+                system = message.kind == SYSTEM
+                message.message_json = {
+                    'message': message.text,
+                    'First Name': 'System' if system else message.user.first_name,
+                    'Last Name': '' if system else message.user.last_name,
+                    'timestamp': str(message.timestamp),
+                }
+            ChatMessage.objects.using(db).bulk_update(chunk, ['message_json'])
+        last_id = chunk[-1].id
+
+
+class Migration(migrations.Migration):
+    atomic = False
+
+    dependencies = [
+        ('chat', '0004_chatmessage_text_kind'),
+    ]
+
+    operations = [
+        migrations.RunPython(convert_message_json, restore_message_json),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 5.1.7 on 2026-10-17 15:04
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0005_convert_message_json'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='chatmessage',
+            name='message_json',
+        ),
+    ]
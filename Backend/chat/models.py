@@ -1,13 +1,25 @@
 from django.db import models
+from django.utils import timezone
 from users.models import User
 from rides.models import Ride
-import json
 
 class ChatMessage(models.Model):
+    class Kind(models.IntegerChoices):
+        USER = 0, 'User'
+        SYSTEM = 1, 'System'  # Posted by the app about the ride (rides.outbox); user is whoever acted (joiner, leaver, approver)
+
     ride = models.ForeignKey(Ride, on_delete=models.CASCADE, related_name='chat_messages')
     user = models.ForeignKey(User, on_delete=models.CASCADE)
-    message_json = models.JSONField(null=True, blank=True)  # Temporarily nullable
-    timestamp = models.DateTimeField(auto_now_add=True)
+    text = models.TextField()
+    kind = models.PositiveSmallIntegerField(choices=Kind.choices, default=Kind.USER)
+    # Not auto_now_add: write-behind inserts keep the time the message was broadcast with
+    timestamp = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [
+            # Chat history for a ride in time order
+            models.Index(fields=['ride', 'timestamp'], name='chat_ride_timestamp_idx'),
+        ]
 
     def __str__(self):
-        return f"{self.user} in Ride {self.ride.id}: {self.message_json.get('message', '')[:20]}"
\ No newline at end of file
+        return f"{self.user} in Ride {self.ride_id}: {self.text[:20]}"
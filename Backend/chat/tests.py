@@ -1,3 +1,780 @@
-from django.test import TestCase
+import asyncio
+import json
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import timedelta
+from importlib import import_module
+from importlib.util import find_spec
+from multiprocessing import get_context
+from unittest import skipUnless
+from unittest.mock import patch
 
-# Create your tests here.
+from asgiref.sync import SyncToAsync, async_to_sync, sync_to_async
+from channels.exceptions import ChannelFull
+from channels.layers import get_channel_layer
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+from django.core.cache import cache
+from django.db import DataError, connection
+from django.db.migrations.executor import MigrationExecutor
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import AccessToken
+
+from RideShare.bench import local_redis_server, publish_to_group
+from rides.expiry import EXPIRY_MESSAGE, expire_stale_rides
+from rides.models import Ride, RideEvent
+from rides.outbox import claim_events, dispatcher
+from rides.services import join_ride
+from rides.tests import QueryPlanAssertions, make_ride, make_user
+from .auth import JWTAuthMiddleware, user_from_token
+from .cache import RecentMessageCache, recent_messages
+from .consumers import RideChatConsumer
+from .history import InvalidCursor, history_page
+from .layers import BoundedInMemoryChannelLayer
+from .models import ChatMessage
+from .routing import websocket_urlpatterns
+from .wire import wire_message
+from .writebehind import ChatWriteBuffer, chat_writes
+
+
+def ride_socket(ride, user, token=None):
+    """A communicator for the ride's chat, going through the same auth middleware as asgi.py."""
+    token = token or AccessToken.for_user(user)
+    return WebsocketCommunicator(
+        JWTAuthMiddleware(URLRouter(websocket_urlpatterns)),
+        f'/ws/ride/{ride.id}/',
+        headers=[(b'authorization', f'Bearer {token}'.encode())],
+    )
+
+
+async def receive_until_closed(socket):
+    """([chat frames received before the close], the close message)."""
+    outputs = [await socket.receive_output()]
+    while outputs[-1]['type'] != 'websocket.close':
+        outputs.append(await socket.receive_output())
+    return [json.loads(output['text']) for output in outputs[:-1]], outputs[-1]
+
+
+def post_messages(ride, user, count):
+    return [
+        ChatMessage.objects.create(ride=ride, user=user, text=f'message {i}')
+        for i in range(count)
+    ]
+
+
+class ChatHistoryPageTests(TestCase):
+    def setUp(self):
+        # Ride ids are reused between tests, so buffers from earlier tests must not leak in
+        recent_messages.clear()
+        self.host = make_user(0)
+        self.ride = make_ride(self.host)
+        post_messages(self.ride, self.host, 5)
+
+    def test_pages_backward_oldest_first_within_page(self):
+        messages, cursor = history_page(self.ride.id, limit=2)
+        self.assertEqual([m['m'] for m in messages], ['message 3', 'message 4'])
+
+        messages, cursor = history_page(self.ride.id, before=cursor, limit=2)
+        self.assertEqual([m['m'] for m in messages], ['message 1', 'message 2'])
+
+        messages, cursor = history_page(self.ride.id, before=cursor, limit=2)
+        self.assertEqual([m['m'] for m in messages], ['message 0'])
+        self.assertIsNone(cursor)
+
+    def test_short_history_has_no_cursor(self):
+        messages, cursor = history_page(self.ride.id, limit=10)
+        self.assertEqual(len(messages), 5)
+        self.assertIsNone(cursor)
+
+    def test_invalid_cursor(self):
+        with self.assertRaises(InvalidCursor):
+            history_page(self.ride.id, before='not-a-cursor')
+
+    def test_latest_page_is_served_from_cache(self):
+        history_page(self.ride.id, limit=2)
+        message = ChatMessage.objects.create(ride=self.ride, user=self.host, text='new')
+        recent_messages.append(self.ride.id, message.id, message.timestamp, wire_message(
+            self.host.id, message.text, message.kind, message.timestamp
+        ))
+
+        with self.assertNumQueries(0):
+            messages, cursor = history_page(self.ride.id, limit=2)
+        self.assertEqual([m['m'] for m in messages], ['message 4', 'new'])
+        # Paging back from the cached page continues in the database
+        messages, _ = history_page(self.ride.id, before=cursor, limit=2)
+        self.assertEqual([m['m'] for m in messages], ['message 2', 'message 3'])
+
+
+class ChatQueryPlanTests(QueryPlanAssertions, TestCase):
+    def test_chat_history_uses_ride_timestamp_index(self):
+        ride = make_ride(make_user(0))
+        messages = ChatMessage.objects.filter(ride=ride).order_by('timestamp')
+        self.assertUsesIndex(messages, 'chat_ride_timestamp_idx')
+
+
+class RecentMessageCacheTests(TestCase):
+    def rows(self, count, start=0):
+        return [(i, None, {'message': str(i)}) for i in range(start, start + count)]
+
+    def test_ring_buffer_keeps_last_messages(self):
+        cache = RecentMessageCache(per_ride=3, max_bytes=10 ** 6, idle_seconds=60)
+        cache.fill(1, self.rows(2), has_older=False, version=0)
+        self.assertEqual(cache.latest(1, 3), (self.rows(2), False))
+
+        cache.append(1, 2, None, {'message': '2'})
+        cache.append(1, 3, None, {'message': '3'})
+        rows, has_older = cache.latest(1, 3)
+        self.assertEqual([row[0] for row in rows], [1, 2, 3])
+        self.assertTrue(has_older)
+
+    def test_messages_are_kept_in_timestamp_order(self):
+        cache = RecentMessageCache(per_ride=3, max_bytes=10 ** 6, idle_seconds=60)
+        cache.fill(1, [(1, 10, {'message': '1'}), (2, 20, {'message': '2'})], has_older=False, version=0)
+        # Committed in id order, but 4 was received before 3
+        cache.append(1, 3, 40, {'message': '3'})
+        cache.append(1, 4, 30, {'message': '4'})
+        self.assertEqual(cache.latest(1, 3), (
+            [(2, 20, {'message': '2'}), (4, 30, {'message': '4'}), (3, 40, {'message': '3'})], True
+        ))
+        # A message older than the whole buffer is not one of the newest
+        cache.append(1, 5, 5, {'message': '5'})
+        self.assertEqual([row[0] for row in cache.latest(1, 3)[0]], [2, 4, 3])
+
+    def test_fill_is_discarded_after_concurrent_write(self):
+        cache = RecentMessageCache(per_ride=3, max_bytes=10 ** 6, idle_seconds=60)
+        version = cache.version(1)
+        cache.append(1, 5, None, {'message': '5'})
+        cache.fill(1, self.rows(2), has_older=False, version=version)
+        self.assertIsNone(cache.latest(1, 3))
+
+    def test_memory_cap_evicts_least_recently_used_ride(self):
+        cache = RecentMessageCache(per_ride=10, max_bytes=500, idle_seconds=60)
+        cache.fill(1, self.rows(2), has_older=False, version=0)
+        cache.fill(2, self.rows(2), has_older=False, version=0)
+        cache.latest(1, 2)
+        cache.fill(3, self.rows(2), has_older=False, version=0)
+        self.assertIsNone(cache.latest(2, 2))
+        self.assertIsNotNone(cache.latest(1, 2))
+        self.assertLessEqual(cache.size, 500)
+
+    def test_idle_and_completed_rides_are_evicted(self):
+        cache = RecentMessageCache(per_ride=10, max_bytes=10 ** 6, idle_seconds=0.01)
+        cache.fill(1, self.rows(2), has_older=False, version=0)
+        time.sleep(0.02)
+        self.assertIsNone(cache.latest(1, 2))
+
+        cache.fill(2, self.rows(2), has_older=False, version=cache.version(2))
+        self.assertIsNotNone(cache.latest(2, 2))
+        cache.evict(2)
+        self.assertIsNone(cache.latest(2, 2))
+        self.assertEqual(cache.size, 0)
+
+    def test_evicted_rides_leave_no_version_behind(self):
+        cache = RecentMessageCache(per_ride=10, max_bytes=10 ** 6, idle_seconds=60)
+        for ride_id in range(100):
+            cache.fill(ride_id, self.rows(2), has_older=False, version=cache.version(ride_id))
+            cache.append(ride_id, 2, None, {'message': '2'})
+            cache.evict(ride_id)
+            cache.append(ride_id, 3, None, {'message': '3'})
+        self.assertEqual(len(cache._versions), 0)
+
+        # A fill read before the eviction is still discarded
+        version = cache.version(1)
+        cache.fill(1, self.rows(2), has_older=False, version=version)
+        stale = cache.version(2)
+        cache.evict(1)
+        cache.fill(2, self.rows(2), has_older=False, version=stale)
+        self.assertIsNone(cache.latest(2, 2))
+
+    def test_explicit_zero_is_not_replaced_by_the_setting(self):
+        cache = RecentMessageCache(per_ride=10, max_bytes=10 ** 6, idle_seconds=0)
+        self.assertEqual(cache.idle_seconds, 0)
+        with override_settings(CHAT_CACHE_MAX_BYTES=123):
+            self.assertEqual(RecentMessageCache().max_bytes, 123)
+
+    def test_ride_written_to_is_not_idle(self):
+        cache = RecentMessageCache(per_ride=10, max_bytes=10 ** 6, idle_seconds=0.05)
+        cache.fill(1, self.rows(2), has_older=False, version=0)
+        cache.fill(2, self.rows(2), has_older=False, version=0)
+        time.sleep(0.03)
+        cache.append(1, 2, None, {'message': '2'})
+        time.sleep(0.03)
+        self.assertIsNotNone(cache.latest(1, 3))
+        self.assertIsNone(cache.latest(2, 2))
+
+
+@override_settings(CHAT_HISTORY_PAGE_SIZE=3)
+class ChatHistoryConsumerTests(TransactionTestCase):
+    def setUp(self):
+        # Ride ids are reused between tests, so buffers from earlier tests must not leak in
+        recent_messages.clear()
+        self.host = make_user(0)
+        self.ride = make_ride(self.host)
+        post_messages(self.ride, self.host, 5)
+
+    def connect(self):
+        return ride_socket(self.ride, self.host)
+
+    def test_connect_sends_latest_page_then_pages_back(self):
+        async def scenario():
+            communicator = self.connect()
+            connected, _ = await communicator.connect()
+            self.assertTrue(connected)
+
+            first = await communicator.receive_json_from()
+            await communicator.send_to(text_data=json.dumps({
+                'type': 'history_before', 'cursor': first['history_before'],
+            }))
+            second = await communicator.receive_json_from()
+            self.assertTrue(await communicator.receive_nothing())
+            await communicator.disconnect()
+            return first, second
+
+        first, second = async_to_sync(scenario)()
+        self.assertEqual(first['type'], 'history')
+        self.assertEqual(first['senders'], {str(self.host.id): [self.host.first_name, self.host.last_name]})
+        self.assertEqual(second['senders'], {})
+        self.assertEqual([m['m'] for m in first['messages']], ['message 2', 'message 3', 'message 4'])
+        self.assertEqual([m['m'] for m in second['messages']], ['message 0', 'message 1'])
+        self.assertIsNone(second['history_before'])
+
+
+class ChatMembershipTests(TransactionTestCase):
+    def setUp(self):
+        self.host = make_user(0)
+        self.rider = make_user(1)
+        self.ride = make_ride(self.host)
+        join_ride(self.ride, self.rider)
+
+    def connect(self, user):
+        return ride_socket(self.ride, user)
+
+    def leave(self, user):
+        client = APIClient()
+        client.force_authenticate(user=user)
+        return client.post(reverse('leave_ride', args=[self.ride.id]))
+
+    def test_messages_do_not_recheck_membership(self):
+        async def scenario():
+            communicator = self.connect(self.rider)
+            await communicator.connect()
+            await communicator.receive_json_from()
+            with patch.object(RideChatConsumer, 'is_user_in_ride') as is_user_in_ride:
+                await communicator.send_to(text_data=json.dumps({'message': 'hello'}))
+                await communicator.receive_json_from()  # The rider's name, first time they send
+                echo = await communicator.receive_json_from()
+            await communicator.disconnect()
+            await chat_writes.flush()
+            return echo, is_user_in_ride
+
+        echo, is_user_in_ride = async_to_sync(scenario)()
+        self.assertEqual(echo['m'], 'hello')
+        is_user_in_ride.assert_not_called()
+        self.assertEqual(ChatMessage.objects.get().text, 'hello')
+
+    @override_settings(CHAT_WRITE_FLUSH_MS=60_000)
+    def test_message_path_stays_on_event_loop(self):
+        # Every sync_to_async / database_sync_to_async call goes through SyncToAsync.__call__
+        hops = []
+        original_call = SyncToAsync.__call__
+
+        async def counting_call(bridge, *args, **kwargs):
+            hops.append(bridge.func)
+            return await original_call(bridge, *args, **kwargs)
+
+        async def scenario():
+            communicator = self.connect(self.rider)
+            await communicator.connect()
+            await communicator.receive_json_from()
+            with patch.object(SyncToAsync, '__call__', counting_call):
+                for text in ('one', 'two', 'three'):
+                    await communicator.send_to(text_data=json.dumps({'message': text}))
+                    while 'type' in await communicator.receive_json_from():
+                        pass
+            await communicator.disconnect()
+            await chat_writes.flush()
+
+        async_to_sync(scenario)()
+        self.assertEqual(hops, [])
+        self.assertEqual(ChatMessage.objects.count(), 3)
+
+    def test_sender_names_are_sent_once_per_connection(self):
+        async def scenario():
+            rider = self.connect(self.rider)
+            host = self.connect(self.host)
+            await rider.connect()
+            await host.connect()
+            await rider.receive_json_from()
+            await host.receive_json_from()
+            for text in ('one', 'two'):
+                await rider.send_to(text_data=json.dumps({'message': text}))
+            frames = [await host.receive_json_from() for _ in range(3)]
+            nothing_else = await host.receive_nothing()
+            await rider.disconnect()
+            await host.disconnect()
+            await chat_writes.flush()
+            return frames, nothing_else
+
+        frames, nothing_else = async_to_sync(scenario)()
+        self.assertEqual(frames[0], {'type': 'senders', 'senders': {str(self.rider.id): ['Rider', '1']}})
+        self.assertEqual([set(frame) for frame in frames[1:]], [{'s', 'm', 'ts'}] * 2)
+        self.assertEqual([frame['m'] for frame in frames[1:]], ['one', 'two'])
+        self.assertTrue(nothing_else)
+
+    def test_malformed_messages_get_an_error(self):
+        async def scenario():
+            communicator = self.connect(self.rider)
+            await communicator.connect()
+            await communicator.receive_json_from()
+            replies = []
+            for payload in ['[1]', '42', '"hi"', '{"m": 5}', '{"message": {"text": "hi"}}', '{"text": "hi"}', '{"m": ""}']:
+                await communicator.send_to(text_data=payload)
+                replies.append(await communicator.receive_json_from())
+            # Still connected and still able to chat
+            await communicator.send_to(text_data=json.dumps({'m': 'hello'}))
+            await communicator.receive_json_from()  # The rider's name
+            echo = await communicator.receive_json_from()
+            await communicator.disconnect()
+            await chat_writes.flush()
+            return replies, echo
+
+        replies, echo = async_to_sync(scenario)()
+        self.assertTrue(all(set(reply) == {'error'} for reply in replies), replies)
+        self.assertEqual(echo['m'], 'hello')
+        self.assertEqual(list(ChatMessage.objects.values_list('text', flat=True)), ['hello'])
+
+    def test_member_who_leaves_is_disconnected(self):
+        async def scenario():
+            # Membership notices go out through the ride-event dispatcher, off the request path
+            dispatcher.start()
+            rider = self.connect(self.rider)
+            host = self.connect(self.host)
+            await rider.connect()
+            await host.connect()
+            await rider.receive_json_from()
+            await host.receive_json_from()
+
+            response = await sync_to_async(self.leave)(self.rider)
+            frames, closed = await receive_until_closed(rider)
+            # The host stays connected and is told the rider left
+            left = await host.receive_json_from()
+            await host.disconnect()
+            dispatcher.stop()
+            return response, frames, closed, left
+
+        response, frames, closed, left = async_to_sync(scenario)()
+        self.assertEqual(response.status_code, 200)
+        # The rider also sees their leave message before the chat closes for them
+        self.assertIn('has left', frames[-1]['m'])
+        self.assertEqual(closed, {'type': 'websocket.close', 'code': 4403})
+        self.assertIn('has left', left['m'])
+
+    def test_completed_ride_disconnects_everyone(self):
+        def complete():
+            client = APIClient()
+            client.force_authenticate(user=self.host)
+            return client.post(reverse('complete_ride', args=[self.ride.id]))
+
+        async def scenario():
+            dispatcher.start()
+            sockets = [self.connect(self.rider), self.connect(self.host)]
+            for socket in sockets:
+                await socket.connect()
+                await socket.receive_json_from()
+
+            response = await sync_to_async(complete)()
+            completed = [await receive_until_closed(socket) for socket in sockets]
+            dispatcher.stop()
+            return response, completed
+
+        response, completed = async_to_sync(scenario)()
+        self.assertEqual(response.status_code, 200)
+        # Everyone connected sees why the chat closes before it does
+        for frames, close in completed:
+            self.assertIn('has marked this ride as completed', frames[-1]['m'])
+            self.assertEqual(close, {'type': 'websocket.close', 'code': 4403})
+
+    def test_expired_ride_sends_its_message_before_closing(self):
+        def expire():
+            Ride.objects.filter(id=self.ride.id).update(departure_time=timezone.now() - timedelta(days=2))
+            expire_stale_rides()
+
+        async def scenario():
+            dispatcher.start()
+            rider = self.connect(self.rider)
+            await rider.connect()
+            await rider.receive_json_from()
+            # Expired by the scheduler rather than by the host
+            await sync_to_async(expire)()
+            result = await receive_until_closed(rider)
+            dispatcher.stop()
+            return result
+
+        frames, close = async_to_sync(scenario)()
+        self.assertEqual(frames[-1]['m'], EXPIRY_MESSAGE)
+        self.assertEqual(close, {'type': 'websocket.close', 'code': 4403})
+
+    @override_settings(CHANNEL_LAYERS={'default': {
+        'BACKEND': 'chat.layers.BoundedInMemoryChannelLayer',
+        'CONFIG': {'group_capacity': 1},
+    }})
+    def test_full_chat_group_refuses_the_connection(self):
+        async def scenario():
+            host = self.connect(self.host)
+            await host.connect()
+            await host.receive_json_from()
+            rider = self.connect(self.rider)
+            refused = await rider.connect()
+            await host.disconnect()
+            return refused
+
+        self.assertEqual(async_to_sync(scenario)(), (False, 1013))
+
+
+class WebsocketAuthTests(TransactionTestCase):
+    def setUp(self):
+        cache.clear()
+        self.host = make_user(0)
+        self.ride = make_ride(self.host)
+
+    def connect_code(self, token=None):
+        async def scenario():
+            communicator = ride_socket(self.ride, self.host, token)
+            connected, code = await communicator.connect()
+            await communicator.disconnect()
+            return connected, code
+
+        return async_to_sync(scenario)()
+
+    def test_user_is_cached_between_connects(self):
+        token = str(AccessToken.for_user(self.host))
+        self.assertEqual(async_to_sync(user_from_token)(token), self.host)
+        with self.assertNumQueries(0):
+            self.assertEqual(async_to_sync(user_from_token)(token), self.host)
+
+    def test_deactivated_user_is_rejected_on_next_connect(self):
+        self.assertEqual(self.connect_code(), (True, None))
+        self.host.is_active = False
+        self.host.save()
+        self.assertEqual(self.connect_code(), (False, 4403))
+
+    def test_invalid_token_is_rejected(self):
+        self.assertEqual(self.connect_code(token='not-a-jwt'), (False, 4403))
+
+
+class ChatWriteBehindTests(TransactionTestCase):
+    def setUp(self):
+        recent_messages.clear()
+        self.host = make_user(0)
+        self.ride = make_ride(self.host)
+        self.other_ride = make_ride(make_user(1))
+
+    def test_flush_writes_messages_in_order(self):
+        buffer = ChatWriteBuffer(batch_size=3, flush_ms=10_000)
+
+        async def scenario():
+            for i in range(7):
+                ride = self.ride if i % 2 == 0 else self.other_ride
+                buffer.add(ride.id, self.host.id, str(i), timezone.now())
+            await buffer.flush()
+
+        async_to_sync(scenario)()
+        stored = ChatMessage.objects.order_by('timestamp', 'id')
+        self.assertEqual([m.text for m in stored], [str(i) for i in range(7)])
+        self.assertEqual(buffer.pending, [])
+
+    def test_event_committed_while_a_message_is_queued_keeps_database_order(self):
+        buffer = ChatWriteBuffer(batch_size=10, flush_ms=10_000)
+        history_page(self.ride.id)
+
+        async def scenario():
+            buffer.add(self.ride.id, self.host.id, 'queued', timezone.now())
+            # A system message is committed before the queued message is flushed
+            await sync_to_async(RideEvent.objects.create)(ride=self.ride, user=self.host, text='event')
+            await sync_to_async(claim_events)()
+            await buffer.flush()
+
+        async_to_sync(scenario)()
+        with self.assertNumQueries(0):
+            messages, _ = history_page(self.ride.id)
+        self.assertEqual([m['m'] for m in messages], ['queued', 'event'])
+        recent_messages.clear()
+        self.assertEqual(history_page(self.ride.id), (messages, None))
+
+    def test_timer_flushes_without_a_full_batch(self):
+        buffer = ChatWriteBuffer(batch_size=100, flush_ms=5)
+
+        async def scenario():
+            buffer.add(self.ride.id, self.host.id, 'hi', timezone.now())
+            await asyncio.sleep(0.2)
+
+        async_to_sync(scenario)()
+        self.assertEqual(ChatMessage.objects.count(), 1)
+
+    def test_message_for_deleted_ride_does_not_block_batch(self):
+        buffer = ChatWriteBuffer(batch_size=10, flush_ms=10_000)
+        deleted_id = self.other_ride.id
+        self.other_ride.delete()
+
+        async def scenario():
+            buffer.add(deleted_id, self.host.id, 'lost', timezone.now())
+            buffer.add(self.ride.id, self.host.id, 'kept', timezone.now())
+            await buffer.flush()
+
+        async_to_sync(scenario)()
+        self.assertEqual([m.text for m in ChatMessage.objects.all()], ['kept'])
+
+    def test_messages_queued_before_completion_stay_purged(self):
+        buffer = ChatWriteBuffer(batch_size=10, flush_ms=10_000)
+
+        async def queue(ride, text):
+            buffer.add(ride.id, self.host.id, text, timezone.now())
+
+        async_to_sync(queue)(self.ride, 'before completion')
+        async_to_sync(queue)(self.other_ride, 'other ride')
+        self.ride.is_completed = True
+        self.ride.save()
+        # The same for a ride the expiry job completes
+        async_to_sync(queue)(self.other_ride, 'before expiry')
+        Ride.objects.filter(id=self.other_ride.id).update(departure_time=timezone.now() - timedelta(days=2))
+        expire_stale_rides()
+
+        async_to_sync(buffer.flush)()
+        self.assertFalse(ChatMessage.objects.filter(kind=ChatMessage.Kind.USER).exists())
+        self.assertEqual(buffer.pending, [])
+
+    def test_batch_that_keeps_failing_is_written_message_by_message(self):
+        buffer = ChatWriteBuffer(batch_size=10, flush_ms=10_000, max_retries=1)
+        bulk_create = ChatMessage.objects.bulk_create
+
+        def failing_bulk_create(messages, *args, **kwargs):
+            if any(message.text == 'poison' for message in messages):
+                raise DataError("value too long")
+            return bulk_create(messages, *args, **kwargs)
+
+        async def scenario():
+            for text in ['before', 'poison', 'after']:
+                buffer.add(self.ride.id, self.host.id, text, timezone.now())
+            await buffer.flush()
+            failures = buffer.failures
+            # Retried once, then written one message at a time
+            await asyncio.sleep(0.3)
+            return failures
+
+        with patch('chat.writebehind.RETRY_BACKOFF', 0), \
+                patch.object(ChatMessage.objects, 'bulk_create', side_effect=failing_bulk_create):
+            failures = async_to_sync(scenario)()
+        self.assertEqual(failures, 1)
+        self.assertEqual([m.text for m in ChatMessage.objects.order_by('id')], ['before', 'after'])
+        self.assertEqual((buffer.pending, buffer.failures), ([], 0))
+
+    def test_queue_drops_the_oldest_messages_when_full(self):
+        buffer = ChatWriteBuffer(batch_size=100, flush_ms=10_000, max_pending=3)
+
+        async def scenario():
+            for i in range(5):
+                buffer.add(self.ride.id, self.host.id, str(i), timezone.now())
+
+        async_to_sync(scenario)()
+        self.assertEqual([m.text for m in buffer.pending], ['2', '3', '4'])
+        self.assertEqual(buffer.dropped, 2)
+
+    def test_shutdown_flush_writes_pending_messages(self):
+        buffer = ChatWriteBuffer(batch_size=10, flush_ms=10_000)
+        buffer.pending.append(ChatMessage(ride_id=self.ride.id, user_id=self.host.id, text='late'))
+        buffer.flush_sync()
+        self.assertEqual(ChatMessage.objects.get().text, 'late')
+
+
+class ChatMessageMigrationTests(TransactionTestCase):
+    before = [('chat', '0004_chatmessage_text_kind')]
+
+    def setUp(self):
+        self.host = make_user(0)
+        self.ride = make_ride(self.host)
+        self.executor = MigrationExecutor(connection)
+        self.executor.migrate(self.before)
+
+    def tearDown(self):
+        executor = MigrationExecutor(connection)
+        executor.migrate(executor.loader.graph.leaf_nodes())
+
+    def test_message_json_is_converted_in_chunks(self):
+        OldMessage = self.executor.loader.project_state(self.before).apps.get_model('chat', 'ChatMessage')
+        for text in ('a', 'b', 'c', 'd'):
+            OldMessage.objects.create(ride_id=self.ride.id, user_id=self.host.id, message_json={
+                'message': text, 'First Name': 'Host', 'Last Name': 'User', 'timestamp': '2026-01-01 00:00:00',
+            })
+        OldMessage.objects.create(ride_id=self.ride.id, user_id=self.host.id, message_json={
+            'message': 'Ride completed', 'First Name': 'System', 'Last Name': '',
+        })
+
+        conversion = import_module('chat.migrations.0005_convert_message_json')
+        with patch.object(conversion, 'CHUNK_SIZE', 2):
+            executor = MigrationExecutor(connection)
+            executor.migrate(executor.loader.graph.leaf_nodes())
+
+        stored = ChatMessage.objects.order_by('id').values_list('text', 'kind')
+        self.assertEqual(list(stored), [
+            ('a', ChatMessage.Kind.USER), ('b', ChatMessage.Kind.USER), ('c', ChatMessage.Kind.USER),
+            ('d', ChatMessage.Kind.USER), ('Ride completed', ChatMessage.Kind.SYSTEM),
+        ])
+
+
+class BoundedChannelLayerTests(TestCase):
+    def layer(self, **config):
+        return BoundedInMemoryChannelLayer(**{'capacity': 2, 'expiry': 60, **config})
+
+    def run_async(self, coroutine_function):
+        return async_to_sync(coroutine_function)()
+
+    def test_drop_oldest_keeps_newest_messages(self):
+        layer = self.layer(overflow_policy='drop_oldest')
+
+        async def scenario():
+            for i in range(4):
+                await layer.send('slow', {'type': 'chat_message', 'n': i})
+            return [(await layer.receive('slow'))['n'] for _ in range(2)]
+
+        self.assertEqual(self.run_async(scenario), [2, 3])
+        self.assertEqual(layer.counters['dropped_oldest'], 2)
+
+    def test_close_policy_tells_slow_channel_to_close(self):
+        layer = self.layer(overflow_policy='close')
+
+        async def scenario():
+            await layer.group_add('chat_ride_1', 'slow')
+            for i in range(3):
+                await layer.group_send('chat_ride_1', {'type': 'chat_message', 'n': i})
+            await layer.send('slow', {'type': 'chat_message', 'n': 99})
+            return await layer.receive('slow')
+
+        self.assertEqual(self.run_async(scenario), {'type': 'channel.overflow'})
+        self.assertNotIn('chat_ride_1', layer.groups)
+        self.assertEqual(layer.counters['closed_slow_channels'], 1)
+        self.assertEqual(layer.counters['dropped_closing'], 1)
+        self.assertEqual(layer.closing, set())
+
+    def test_raise_policy_keeps_stock_behaviour(self):
+        layer = self.layer()
+
+        async def scenario():
+            await layer.send('slow', {'type': 'x'})
+            await layer.send('slow', {'type': 'x'})
+            await layer.send('slow', {'type': 'x'})
+
+        with self.assertRaises(ChannelFull):
+            self.run_async(scenario)
+
+    def test_group_capacity(self):
+        layer = self.layer(group_capacity=1)
+
+        async def scenario():
+            await layer.group_add('chat_ride_1', 'first')
+            await layer.group_add('chat_ride_1', 'second')
+
+        with self.assertRaises(ChannelFull):
+            self.run_async(scenario)
+        self.assertEqual(layer.counters['group_rejections'], 1)
+
+    def test_expired_messages_are_counted(self):
+        layer = self.layer(expiry=0, clean_interval=0)
+
+        async def scenario():
+            await layer.send('gone', {'type': 'x'})
+            await asyncio.sleep(0.01)
+            await layer.group_send('chat_ride_1', {'type': 'x'})
+
+        self.run_async(scenario)
+        self.assertEqual(layer.counters['expired'], 1)
+        self.assertEqual(layer.stats()['queued_messages'], 0)
+
+    def test_stats_report_depth_and_fan_out(self):
+        layer = self.layer(capacity=10)
+
+        async def scenario():
+            for channel in ('a', 'b', 'c'):
+                await layer.group_add('chat_ride_1', channel)
+            await layer.group_add('chat_ride_2', 'a')
+            await layer.group_send('chat_ride_1', {'type': 'x'})
+            await layer.group_send('chat_ride_2', {'type': 'x'})
+
+        self.run_async(scenario)
+        stats = layer.stats()
+        self.assertEqual(stats['ride_chat_groups'], 2)
+        self.assertEqual(stats['largest_groups'], {'chat_ride_1': 3, 'chat_ride_2': 1})
+        self.assertEqual(stats['max_queue_depth'], 2)
+        self.assertEqual(stats['average_fan_out'], 2.0)
+
+    def test_stats_endpoint_is_admin_only(self):
+        client = APIClient()
+        client.force_authenticate(user=make_user(0))
+        self.assertEqual(client.get(reverse('channel_layer_stats')).status_code, 403)
+
+        admin = make_user(1)
+        admin.is_staff = True
+        client.force_authenticate(user=admin)
+        response = client.get(reverse('channel_layer_stats'))
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('queued_messages', response.data)
+
+
+@skipUnless(find_spec('fakeredis') and find_spec('lupa'), 'needs fakeredis[lua] as a local Redis stand-in (requirements-dev.txt)')
+class RedisChannelLayerTests(TransactionTestCase):
+    """Several daphne processes sharing one Redis channel layer, with fakeredis serving over TCP."""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.redis_url = cls.enterClassContext(local_redis_server())
+        cls.processes = cls.enterClassContext(ProcessPoolExecutor(max_workers=2, mp_context=get_context('spawn')))
+
+    def setUp(self):
+        layers = {'default': {
+            'BACKEND': 'channels_redis.core.RedisChannelLayer',
+            'CONFIG': {'hosts': [self.redis_url], 'capacity': 10_000},
+        }}
+        self.enterContext(override_settings(CHANNEL_LAYERS=layers))
+        self.host = make_user(0)
+        self.ride = make_ride(self.host)
+
+    def publish(self, producer, count):
+        return self.processes.submit(publish_to_group, self.redis_url, f'chat_ride_{self.ride.id}', producer, count)
+
+    def test_message_from_another_process_reaches_socket(self):
+        async def scenario():
+            communicator = ride_socket(self.ride, self.host)
+            await communicator.connect()
+            await communicator.receive_json_from()
+            await asyncio.wrap_future(self.publish('http-worker', 1))
+            message = await communicator.receive_json_from(timeout=5)
+            await communicator.disconnect()
+            return message
+
+        self.assertEqual(async_to_sync(scenario)()['m'], 'http-worker:0')
+
+    def test_messages_from_several_processes_all_arrive_in_order(self):
+        # Throughput itself is measured by `manage.py bench_channel_layer`; fakeredis is too slow to time
+        producers, per_producer = 2, 50
+
+        async def scenario():
+            layer = get_channel_layer()
+            channel = await layer.new_channel()
+            await layer.group_add(f'chat_ride_{self.ride.id}', channel)
+            futures = [self.publish(f'p{i}', per_producer) for i in range(producers)]
+            received = [
+                (await asyncio.wait_for(layer.receive(channel), 10))['message_data']['m']
+                for _ in range(producers * per_producer)
+            ]
+            for future in futures:
+                await asyncio.wrap_future(future)
+            return received
+
+        received = async_to_sync(scenario)()
+        # Every message arrives, and each producer's messages arrive in the order they were sent
+        for i in range(producers):
+            sequence = [int(m.split(':')[1]) for m in received if m.startswith(f'p{i}:')]
+            self.assertEqual(sequence, list(range(per_producer)))
@@ -3,4 +3,5 @@ from . import views
 
 urlpatterns = [
     path('ride/<int:ride_id>/', views.chat_room, name='chat_room'),
+    path('layer-stats/', views.ChannelLayerStatsView.as_view(), name='channel_layer_stats'),
 ]
\ No newline at end of file
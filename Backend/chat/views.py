@@ -2,6 +2,11 @@ from django.shortcuts import render, get_object_or_404
 from rides.models import Ride
 from .models import ChatMessage
 from django.contrib.auth.decorators import login_required
+from channels.layers import get_channel_layer
+from rest_framework import status
+from rest_framework.permissions import IsAdminUser
+from rest_framework.response import Response
+from rest_framework.views import APIView
 
 @login_required
 def chat_room(request, ride_id):
@@ -13,4 +18,15 @@ def chat_room(request, ride_id):
     return render(request, 'chat/room.html', {
         'ride': ride,
         'messages': messages,
-    })
\ No newline at end of file
+    })
+
+
+class ChannelLayerStatsView(APIView):
+    """Queue depths, group fan-out and drop counters of this process's channel layer."""
+    permission_classes = [IsAdminUser]
+
+    def get(self, request):
+        layer = get_channel_layer()
+        if not hasattr(layer, 'stats'):
+            return Response({"error": "The configured channel layer does not report stats."}, status=status.HTTP_404_NOT_FOUND)
+        return Response(layer.stats(), status=status.HTTP_200_OK)
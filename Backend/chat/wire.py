@@ -0,0 +1,27 @@
+"""
+Compact WebSocket format for chat messages.
+
+A message is ``{"s": sender id, "m": text, "ts": epoch milliseconds}``, plus ``"k": 1`` for system
+messages (ChatMessage.Kind; omitted for the common user message). Sender names are not repeated
+in every message: a connection is sent ``{"type": "senders", "senders": {"<id>": [first, last]}}``
+(or a ``senders`` key on the history frame) the first time a sender appears on it.
+"""
+from datetime import timedelta
+
+from RideShare.cursors import EPOCH
+from .models import ChatMessage
+
+
+def epoch_ms(timestamp):
+    return (timestamp - EPOCH) // timedelta(milliseconds=1)
+
+
+def wire_message(sender_id, text, kind, timestamp):
+    message = {"s": sender_id, "m": text, "ts": epoch_ms(timestamp)}
+    if kind != ChatMessage.Kind.USER:
+        message["k"] = int(kind)
+    return message
+
+
+def is_user_message(message):
+    return "k" not in message
@@ -0,0 +1,194 @@
+"""
+Write-behind persistence for chat messages.
+
+The consumer broadcasts a message as soon as it arrives and hands it to ``chat_writes``, which
+inserts queued messages with one bulk_create every ``CHAT_WRITE_FLUSH_MS`` milliseconds, or as
+soon as ``CHAT_WRITE_BATCH_SIZE`` messages are waiting. Flushes run one at a time and in arrival
+order, so messages of a ride are stored in the order they were broadcast. Messages for a ride
+completed or deleted while they were queued are dropped, so a purged chat stays purged. Whatever is
+still queued when the process exits is written by an atexit hook.
+
+A batch that fails to write is retried with backoff; after ``CHAT_WRITE_MAX_RETRIES`` failures its
+messages are written one at a time and the ones that still fail are dropped, so one bad message
+cannot hold up every ride's chat. At most ``CHAT_WRITE_MAX_PENDING`` messages are queued; past that
+(the database is down) the oldest are dropped. They were broadcast already, only their history is
+lost.
+"""
+import asyncio
+import atexit
+import logging
+
+from channels.db import database_sync_to_async
+from django.db import IntegrityError, close_old_connections, transaction
+
+from RideShare.conf import setting_default
+from rides.models import Ride
+from .cache import recent_messages
+from .models import ChatMessage
+from .wire import wire_message
+
+logger = logging.getLogger(__name__)
+
+# Seconds before the first retry of a failed batch, doubled for each retry after that
+RETRY_BACKOFF = 0.5
+
+
+class ChatWriteBuffer:
+    def __init__(self, batch_size=None, flush_ms=None, max_retries=None, max_pending=None):
+        self._batch_size = batch_size
+        self._flush_ms = flush_ms
+        self._max_retries = max_retries
+        self._max_pending = max_pending
+        self.pending = []
+        self.failures = 0  # Failed attempts at writing the batch at the front of pending
+        self.dropped = 0  # Messages dropped since the last successful write
+        # The batch being written right now, kept so an exit during the write does not lose it
+        self.inflight = []
+        self._loop = None
+        self._lock = None
+        self._timer = None
+        self._flush_task = None
+
+    @property
+    def batch_size(self):
+        return setting_default(self._batch_size, 'CHAT_WRITE_BATCH_SIZE')
+
+    @property
+    def flush_interval(self):
+        return setting_default(self._flush_ms, 'CHAT_WRITE_FLUSH_MS') / 1000
+
+    @property
+    def max_retries(self):
+        return setting_default(self._max_retries, 'CHAT_WRITE_MAX_RETRIES')
+
+    @property
+    def max_pending(self):
+        return setting_default(self._max_pending, 'CHAT_WRITE_MAX_PENDING')
+
+    def add(self, ride_id, user_id, text, timestamp):
+        """Queue a user message for the database. Must be called on the event loop."""
+        if len(self.pending) >= self.max_pending:
+            if not self.dropped:
+                logger.warning(f"Chat write queue is full ({len(self.pending)} messages), dropping the oldest")
+            del self.pending[0]
+            self.dropped += 1
+        self.pending.append(ChatMessage(ride_id=ride_id, user_id=user_id, text=text, timestamp=timestamp))
+        loop = self._bind()
+        if self.failures and self._timer is not None:
+            # Waiting out a retry backoff
+            return
+        if len(self.pending) >= self.batch_size:
+            self._schedule_flush(loop)
+        elif self._timer is None:
+            self._timer = loop.call_later(self.flush_interval, self._schedule_flush, loop)
+
+    def _bind(self):
+        # Timers, tasks and the lock belong to one event loop; start afresh if the loop changed
+        loop = asyncio.get_running_loop()
+        if loop is not self._loop:
+            self._loop = loop
+            self._lock = asyncio.Lock()
+            self._timer = None
+            self._flush_task = None
+        return loop
+
+    def _schedule_flush(self, loop):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = loop.create_task(self.flush())
+
+    async def flush(self):
+        """Write everything queued so far, in order."""
+        self._bind()
+        async with self._lock:
+            while self.pending:
+                batch = self.pending[:self.batch_size]
+                del self.pending[:len(batch)]
+                self.inflight = batch
+                try:
+                    if self.failures > self.max_retries:
+                        await database_sync_to_async(self._write_each)(batch)
+                    else:
+                        await database_sync_to_async(self._write)(batch)
+                except Exception:
+                    # Put the batch back in front so ordering holds, and retry after a backoff
+                    self.failures += 1
+                    logger.exception(f"Failed to write {len(batch)} chat messages (attempt {self.failures})")
+                    self.pending[:0] = batch
+                    self.inflight = []
+                    if self._timer is not None:
+                        self._timer.cancel()
+                    delay = RETRY_BACKOFF * 2 ** min(self.failures - 1, self.max_retries)
+                    self._timer = self._loop.call_later(delay, self._schedule_flush, self._loop)
+                    return
+                if self.dropped:
+                    logger.warning(f"Dropped {self.dropped} chat messages while the write queue was full")
+                self.failures = self.dropped = 0
+
+    def _write(self, batch):
+        with transaction.atomic():
+            batch = self._open_ride_messages(batch)
+            try:
+                with transaction.atomic():
+                    ChatMessage.objects.bulk_create(batch)
+            except IntegrityError:
+                # A user was deleted after their message was queued; keep the rest of the batch
+                batch = [message for message in batch if self._write_one(message)]
+        self.inflight = []
+        for message in batch:
+            recent_messages.append(message.ride_id, message.id, message.timestamp, wire_message(
+                message.user_id, message.text, message.kind, message.timestamp
+            ))
+
+    def _open_ride_messages(self, batch):
+        """
+        Drop messages for rides completed or deleted since they were queued: completing a ride purges
+        its chat, which must not come back. The rides stay locked until the insert commits, and
+        Ride.save locks the row before purging, so a completion cannot slip in between.
+        """
+        open_rides = set(
+            Ride.objects.select_for_update().filter(id__in={message.ride_id for message in batch}, is_completed=False)
+            .values_list('id', flat=True)
+        )
+        kept = [message for message in batch if message.ride_id in open_rides]
+        if len(kept) < len(batch):
+            logger.info(f"Dropped {len(batch) - len(kept)} chat messages for completed or deleted rides")
+        return kept
+
+    def _write_each(self, batch):
+        """Last resort for a batch that keeps failing: one message at a time, dropping those that fail."""
+        for i, message in enumerate(batch):
+            self.inflight = batch[i:]
+            try:
+                self._write([message])
+            except Exception:
+                logger.exception(f"Dropped chat message for ride {message.ride_id} that could not be written")
+        self.inflight = []
+
+    def _write_one(self, message):
+        try:
+            with transaction.atomic():
+                message.save()
+            return True
+        except IntegrityError:
+            logger.warning(f"Dropped chat message from missing user {message.user_id}")
+            return False
+
+    def flush_sync(self):
+        """Write queued messages from synchronous code; used at interpreter exit."""
+        batch = self.inflight + self.pending
+        self.inflight, self.pending = [], []
+        if not batch:
+            return
+        try:
+            self._write(batch)
+        except Exception:
+            logger.exception(f"Lost {len(batch)} chat messages at shutdown")
+        finally:
+            close_old_connections()
+
+
+chat_writes = ChatWriteBuffer()
+atexit.register(chat_writes.flush_sync)
@@ -0,0 +1,43 @@
+import requests
+from django.core.management.base import BaseCommand
+
+from RideShare.bench import latency_summary, local_expo_server, timed
+from notifications.push import EXPO_PUSH_BATCH_SIZE, PushClient
+
+
+class Command(BaseCommand):
+    help = ("Time an SOS-sized push fan-out against a local stub of the Expo API with a set round-trip "
+            "latency: chunks posted one after another on fresh connections, then notifications.push.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--messages', type=int, default=500, help="Devices to notify per fan-out.")
+        parser.add_argument('--latency-ms', type=float, default=80, help="Stub server round-trip time.")
+        parser.add_argument('--runs', type=int, default=10)
+        parser.add_argument('--concurrency', type=int, default=8)
+
+    def handle(self, *args, **options):
+        messages = [{'to': f'ExponentPushToken[bench{i}]', 'title': 'SOS Alert', 'body': 'Help'}
+                    for i in range(options['messages'])]
+        results = {}
+        with local_expo_server(latency=options['latency_ms'] / 1000) as server:
+            results['sequential'] = self.run(server, options['runs'], lambda: self.sequential(server.url, messages))
+
+            client = PushClient(base_url=server.url, concurrency=options['concurrency'])
+            results['pooled'] = self.run(server, options['runs'], lambda: client.send(messages))
+            client.close()
+
+        self.stdout.write(f"{options['messages']} messages per fan-out, {options['latency_ms']:g}ms round trip, "
+                          f"{-(-options['messages'] // EXPO_PUSH_BATCH_SIZE)} chunks")
+        for name, (latencies, connections) in results.items():
+            self.stdout.write(f"{name:<10}: {latency_summary(latencies)}, "
+                              f"{connections / options['runs']:.1f} new connections per fan-out")
+
+    def run(self, server, runs, fan_out):
+        connections_before = server.connections
+        latencies = [timed(fan_out)[1] for _ in range(runs)]
+        return latencies, server.connections - connections_before
+
+    def sequential(self, url, messages):
+        """Each chunk posted with requests.post, the way the SOS serializer used to send its one body."""
+        for i in range(0, len(messages), EXPO_PUSH_BATCH_SIZE):
+            requests.post(f'{url}/send', json=messages[i:i + EXPO_PUSH_BATCH_SIZE], timeout=10).raise_for_status()
@@ -0,0 +1,223 @@
+"""
+Expo push delivery.
+
+Messages go out in chunks of at most EXPO_PUSH_BATCH_SIZE (Expo's limit per request) over one
+pooled keep-alive session, with up to ``EXPO_PUSH_CONCURRENCY`` chunks in flight at once, so
+notifying a few hundred devices costs about one round trip rather than one per chunk. A chunk that
+fails with a connection error, 429 or 5xx is retried with exponential backoff and jitter, honouring
+Retry-After.
+
+Expo answers each message with a ticket. An ``ok`` ticket only means Expo accepted the message;
+whether it reached the device is in the push receipt, which poll_receipts() fetches later. Devices
+that are no longer registered show up as ``DeviceNotRegistered`` in either and should not be sent
+to again (forget_unregistered_tokens).
+"""
+import logging
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from RideShare.conf import setting_default
+from users.models import User
+
+logger = logging.getLogger(__name__)
+
+# Expo takes at most 100 messages per send request and 1000 ids per receipts request
+EXPO_PUSH_BATCH_SIZE = 100
+EXPO_RECEIPT_BATCH_SIZE = 1000
+RETRY_STATUSES = frozenset({429, 500, 502, 503, 504})
+MAX_RETRY_DELAY = 30
+
+DEVICE_NOT_REGISTERED = 'DeviceNotRegistered'
+REQUEST_FAILED = 'RequestFailed'
+
+
+class PushError(Exception):
+    pass
+
+
+class PushTicket:
+    """What became of one message: accepted (``ok``, with a ticket id) or not (``error``)."""
+
+    __slots__ = ('token', 'status', 'id', 'error', 'message', 'receipt')
+
+    def __init__(self, token, status, id=None, error=None, message=None):
+        self.token = token
+        self.status = status
+        self.id = id
+        self.error = error  # Expo's error code, or REQUEST_FAILED if the request never succeeded
+        self.message = message
+        self.receipt = None  # 'ok' or 'error' once poll_receipts() has heard back
+
+    @property
+    def ok(self):
+        return self.status == 'ok'
+
+    @property
+    def delivered(self):
+        return self.receipt == 'ok'
+
+    def __repr__(self):
+        return f"<PushTicket {self.token} {self.status} {self.error or self.id}>"
+
+
+class PushClient:
+    def __init__(self, base_url=None, concurrency=None, max_retries=None, retry_backoff=None, timeout=None):
+        self._base_url = base_url
+        self._concurrency = concurrency
+        self._max_retries = max_retries
+        self._retry_backoff = retry_backoff
+        self._timeout = timeout
+        self._session = None
+        self._executor = None
+        self._lock = threading.Lock()
+
+    @property
+    def base_url(self):
+        return setting_default(self._base_url, 'EXPO_PUSH_URL').rstrip('/')
+
+    @property
+    def concurrency(self):
+        return setting_default(self._concurrency, 'EXPO_PUSH_CONCURRENCY')
+
+    @property
+    def max_retries(self):
+        return setting_default(self._max_retries, 'EXPO_PUSH_MAX_RETRIES')
+
+    @property
+    def retry_backoff(self):
+        return setting_default(self._retry_backoff, 'EXPO_PUSH_RETRY_BACKOFF')
+
+    @property
+    def timeout(self):
+        return setting_default(self._timeout, 'EXPO_PUSH_TIMEOUT')
+
+    def send(self, messages):
+        """Send Expo push messages (dicts with at least ``to``); returns one PushTicket per message, in order."""
+        chunks = [messages[i:i + EXPO_PUSH_BATCH_SIZE] for i in range(0, len(messages), EXPO_PUSH_BATCH_SIZE)]
+        return [ticket for tickets in self._map(self._send_chunk, chunks) for ticket in tickets]
+
+    def poll_receipts(self, tickets, interval=5.0, timeout=60.0):
+        """
+        Fill in ``receipt`` on accepted tickets, asking again every ``interval`` seconds for receipts
+        Expo does not have yet, until all are in or ``timeout`` has passed. Returns the tickets
+        still waiting for a receipt.
+        """
+        pending = {ticket.id: ticket for ticket in tickets if ticket.ok and ticket.receipt is None}
+        deadline = time.monotonic() + timeout
+        while pending:
+            ids = list(pending)
+            chunks = [ids[i:i + EXPO_RECEIPT_BATCH_SIZE] for i in range(0, len(ids), EXPO_RECEIPT_BATCH_SIZE)]
+            for receipts in self._map(self._get_receipts, chunks):
+                for ticket_id, receipt in receipts.items():
+                    ticket = pending.pop(ticket_id, None)
+                    if ticket is not None:
+                        ticket.receipt = receipt.get('status')
+                        if ticket.receipt != 'ok':
+                            ticket.error = receipt.get('details', {}).get('error')
+                            ticket.message = receipt.get('message')
+            if not pending or time.monotonic() + interval > deadline:
+                break
+            time.sleep(interval)
+        return list(pending.values())
+
+    def close(self):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown()
+            if self._session is not None:
+                self._session.close()
+            self._session = self._executor = None
+
+    def _map(self, func, chunks):
+        # A single chunk is sent from the calling thread
+        if len(chunks) <= 1:
+            return [func(chunk) for chunk in chunks]
+        return list(self._get_executor().map(func, chunks))
+
+    def _send_chunk(self, chunk):
+        try:
+            data = self._post('/send', chunk)['data']
+            if len(data) != len(chunk):
+                raise PushError(f"expected {len(chunk)} tickets, got {len(data)}")
+        except (PushError, KeyError, TypeError) as e:
+            logger.warning(f"Expo push request for {len(chunk)} messages failed: {e}")
+            return [PushTicket(message['to'], 'error', error=REQUEST_FAILED, message=str(e)) for message in chunk]
+        return [
+            PushTicket(message['to'], ticket.get('status'), id=ticket.get('id'),
+                       error=ticket.get('details', {}).get('error'), message=ticket.get('message'))
+            for message, ticket in zip(chunk, data)
+        ]
+
+    def _get_receipts(self, ids):
+        try:
+            return self._post('/getReceipts', {'ids': ids})['data']
+        except (PushError, KeyError, TypeError) as e:
+            # Those receipts stay pending and are asked for again on the next poll
+            logger.warning(f"Expo receipts request for {len(ids)} tickets failed: {e}")
+            return {}
+
+    def _post(self, path, body):
+        """POST JSON, retrying connection errors, 429 and 5xx. Returns the decoded response."""
+        session = self._get_session()
+        for attempt in range(self.max_retries + 1):
+            retry_after = None
+            try:
+                response = session.post(self.base_url + path, json=body, timeout=self.timeout)
+            except requests.RequestException as e:
+                error = e
+            else:
+                if response.status_code == 200:
+                    try:
+                        return response.json()
+                    except ValueError as e:
+                        raise PushError(f"invalid JSON response: {e}")
+                error = f"HTTP {response.status_code}: {response.text[:200]}"
+                if response.status_code not in RETRY_STATUSES:
+                    raise PushError(error)
+                retry_after = _retry_after(response)
+            if attempt == self.max_retries:
+                raise PushError(f"{error} (after {attempt + 1} attempts)")
+            if retry_after is None:
+                retry_after = self.retry_backoff * 2 ** attempt * random.uniform(0.5, 1.5)
+            time.sleep(min(retry_after, MAX_RETRY_DELAY))
+
+    def _get_session(self):
+        with self._lock:
+            if self._session is None:
+                session = requests.Session()
+                session.headers.update({'Accept': 'application/json', 'Accept-Encoding': 'gzip, deflate'})
+                # One kept-alive connection per worker thread
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.concurrency)
+                session.mount('https://', adapter)
+                session.mount('http://', adapter)
+                self._session = session
+            return self._session
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix='expo-push')
+            return self._executor
+
+
+def _retry_after(response):
+    try:
+        return float(response.headers['Retry-After'])
+    except (KeyError, ValueError):
+        return None
+
+
+def forget_unregistered_tokens(tickets):
+    """Clear push tokens Expo reported as no longer registered. Returns how many users were updated."""
+    tokens = {ticket.token for ticket in tickets if ticket.error == DEVICE_NOT_REGISTERED}
+    if not tokens:
+        return 0
+    return User.objects.filter(expo_push_token__in=tokens).update(expo_push_token=None)
+
+
+push_client = PushClient()
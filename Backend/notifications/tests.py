@@ -1,3 +1,69 @@
+import time
+
 from django.test import TestCase
 
-# Create your tests here.
+from RideShare.bench import local_expo_server
+from users.models import User
+from .push import DEVICE_NOT_REGISTERED, REQUEST_FAILED, PushClient, forget_unregistered_tokens
+
+
+def push_messages(count, prefix='device'):
+    return [{'to': f'ExponentPushToken[{prefix}{i}]', 'title': 'SOS Alert', 'body': 'Help'} for i in range(count)]
+
+
+class PushClientTests(TestCase):
+    def client_for(self, server, **kwargs):
+        client = PushClient(base_url=server.url, retry_backoff=0, **kwargs)
+        self.addCleanup(client.close)
+        return client
+
+    def test_chunks_go_out_together_over_pooled_connections(self):
+        with local_expo_server(latency=0.3) as server:
+            client = self.client_for(server, concurrency=8)
+            start = time.monotonic()
+            tickets = client.send(push_messages(450))
+            elapsed = time.monotonic() - start
+            client.send(push_messages(450))
+
+        self.assertEqual(sorted(len(body) for _, body in server.requests[:5]), [50, 100, 100, 100, 100])
+        self.assertEqual(len(tickets), 450)
+        self.assertTrue(all(ticket.ok and ticket.id for ticket in tickets))
+        self.assertEqual(tickets[-1].token, 'ExponentPushToken[device449]')
+        # Five chunks one after another would take 1.5 s
+        self.assertLess(elapsed, 0.9)
+        # The second send reused the first one's connections
+        self.assertLessEqual(server.connections, 5)
+
+    def test_retries_server_errors(self):
+        with local_expo_server(failures=2) as server:
+            tickets = self.client_for(server).send(push_messages(3))
+        self.assertEqual(len(server.requests), 3)
+        self.assertTrue(all(ticket.ok for ticket in tickets))
+
+    def test_gives_up_after_max_retries(self):
+        with local_expo_server(failures=10) as server:
+            tickets = self.client_for(server, max_retries=2).send(push_messages(3))
+        self.assertEqual(len(server.requests), 3)
+        self.assertEqual({ticket.error for ticket in tickets}, {REQUEST_FAILED})
+
+    def test_receipts_and_unregistered_tokens(self):
+        user = User.objects.create_user(email='gone@northsouth.edu', first_name='Gone', last_name='User',
+                                        student_id='1', expo_push_token='ExponentPushToken[unregistered]')
+        messages = push_messages(3) + [{'to': user.expo_push_token, 'body': 'Help'}]
+        with local_expo_server() as server:
+            client = self.client_for(server)
+            tickets = client.send(messages)
+            self.assertEqual(tickets[3].error, DEVICE_NOT_REGISTERED)
+
+            server.receipts[tickets[1].id] = {'status': 'error', 'message': 'Rate exceeded',
+                                              'details': {'error': 'MessageRateExceeded'}}
+            del server.receipts[tickets[2].id]  # Not ready yet
+            pending = client.poll_receipts(tickets, interval=0, timeout=0)
+
+        self.assertEqual(pending, [tickets[2]])
+        self.assertTrue(tickets[0].delivered)
+        self.assertEqual((tickets[1].receipt, tickets[1].error), ('error', 'MessageRateExceeded'))
+
+        self.assertEqual(forget_unregistered_tokens(tickets), 1)
+        user.refresh_from_db()
+        self.assertIsNone(user.expo_push_token)
@@ -0,0 +1,20 @@
+# Generated by Django 5.1.7 on 2026-10-17 12:18
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('reviews', '0002_alter_badge_level'),
+        ('rides', '0007_hot_query_indexes'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='review',
+            index=models.Index(fields=['reviewed_user', 'rating'], name='review_user_rating_idx'),
+        ),
+    ]
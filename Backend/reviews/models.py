@@ -1,4 +1,5 @@
 from django.db import models
+from django.db.models import Avg
 from django.core.exceptions import ValidationError
 from users.models import User
 from rides.models import Ride
@@ -12,7 +13,12 @@ class Review(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
 
     class Meta:
+        # The unique index also serves the (reviewer, reviewed_user, ride) existence checks in the views
         unique_together = ('reviewer', 'reviewed_user', 'ride')
+        indexes = [
+            # Reviews of a user and their average rating, answered from the index alone
+            models.Index(fields=['reviewed_user', 'rating'], name='review_user_rating_idx'),
+        ]
 
     def clean(self):
         if self.reviewer == self.reviewed_user:
@@ -44,19 +50,11 @@ class Badge(models.Model):
 
     def update_badge(self):
         """Update badge based on average rating and number of completed rides with reviews."""
-        # Get all reviews for this user
-        reviews = Review.objects.filter(reviewed_user=self.user)
-        review_count = reviews.count()
-
         # Count completed rides where the user was either host or member
-        completed_rides = (Ride.objects.filter(host=self.user, is_completed=True) | 
-                          Ride.objects.filter(members=self.user, is_completed=True)).distinct().count()
+        completed_rides = Ride.objects.involving(self.user).filter(is_completed=True).count()
 
         # Calculate average rating
-        if review_count > 0:
-            avg_rating = sum(review.rating for review in reviews) / review_count
-        else:
-            avg_rating = 0
+        avg_rating = self.get_average_rating()
 
         # Badge logic based on completed rides and average rating
         if completed_rides >= 25 and avg_rating >= 4:
@@ -74,10 +72,9 @@ class Badge(models.Model):
 
     def get_average_rating(self):
         """Calculate the average rating for the user."""
-        reviews = Review.objects.filter(reviewed_user=self.user)
-        if reviews.exists():
-            return sum(review.rating for review in reviews) / reviews.count()
-        return 0
+        # Answered from review_user_rating_idx without reading the review rows
+        average = Review.objects.filter(reviewed_user=self.user).aggregate(average=Avg('rating'))['average']
+        return average if average is not None else 0
 
     def __str__(self):
         return f"{self.user} - {self.level}"
\ No newline at end of file
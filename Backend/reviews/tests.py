@@ -1,3 +1,10 @@
 from django.test import TestCase
 
-# Create your tests here.
+from rides.tests import QueryPlanAssertions, make_user
+from .models import Review
+
+
+class ReviewQueryPlanTests(QueryPlanAssertions, TestCase):
+    def test_average_rating_uses_covering_index(self):
+        plan = Review.objects.filter(reviewed_user=make_user(0)).values('rating').explain()
+        self.assertIn('USING COVERING INDEX review_user_rating_idx', plan)
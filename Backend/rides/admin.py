@@ -6,8 +6,8 @@ from chat.models import ChatMessage
 class ChatMessageInline(admin.TabularInline):
     model = ChatMessage
     extra = 0  # No extra empty forms by default
-    readonly_fields = ('message_json', 'timestamp')  # Make these fields read-only
-    fields = ('message_json', 'timestamp', 'user')  # Fields to display in the inline
+    readonly_fields = ('text', 'kind', 'timestamp')  # Make these fields read-only
+    fields = ('text', 'kind', 'timestamp', 'user')  # Fields to display in the inline
 
     def has_add_permission(self, request, obj):
         return False  # Prevent adding new messages via admin
@@ -0,0 +1,111 @@
+"""
+Auto-completion of rides the host forgot to complete.
+
+A ride is stale once its departure_time is more than ``RIDE_EXPIRY_GRACE`` in the past. Stale rides
+are completed in chunks with one UPDATE per chunk instead of a save() per ride, so they drop out of
+the open-ride indexes and the "already in an active ride" checks. Every expired ride still gets the
+usual system message in its chat, through the ride-event outbox.
+"""
+import logging
+import threading
+from functools import partial
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.utils import timezone
+
+from chat.cache import recent_messages
+from chat.models import ChatMessage
+from .models import Ride, RideEvent
+from .outbox import dispatcher, notify_membership_changed
+
+logger = logging.getLogger(__name__)
+
+EXPIRY_MESSAGE = "This ride was automatically marked as completed after its departure time passed."
+
+
+def stale_rides(grace=None, now=None):
+    """Open rides whose departure_time is older than the grace period."""
+    grace = settings.RIDE_EXPIRY_GRACE if grace is None else grace
+    now = now or timezone.now()
+    return Ride.objects.filter(is_completed=False, departure_time__lt=now - grace)
+
+
+def expire_stale_rides(grace=None, chunk_size=None, now=None):
+    """Complete every stale ride, chunk_size rides per transaction. Returns how many were completed."""
+    chunk_size = chunk_size or settings.RIDE_EXPIRY_CHUNK_SIZE
+    now = now or timezone.now()
+    expired = 0
+    while True:
+        completed = _expire_chunk(stale_rides(grace, now), chunk_size)
+        if not completed:
+            return expired
+        expired += completed
+
+
+def _expire_chunk(rides, chunk_size):
+    """Complete one chunk of rides and queue their system messages. Returns how many were completed."""
+    with transaction.atomic():
+        # Rows locked by a host completing the ride right now are left for the next run
+        rows = list(
+            rides.order_by('departure_time', 'id')
+            .select_for_update(skip_locked=True)
+            .values_list('id', 'host_id')[:chunk_size]
+        )
+        if not rows:
+            return 0
+        ride_ids = [ride_id for ride_id, _ in rows]
+
+        # Same effect as Ride.save() completing a ride: pending events and the chat are purged
+        RideEvent.objects.filter(ride_id__in=ride_ids).delete()
+        ChatMessage.objects.filter(ride_id__in=ride_ids).delete()
+        Ride.objects.filter(id__in=ride_ids).update(is_completed=True)
+
+        RideEvent.objects.bulk_create([
+            RideEvent(ride_id=ride_id, user_id=host_id, text=EXPIRY_MESSAGE)
+            for ride_id, host_id in rows
+        ])
+        transaction.on_commit(partial(recent_messages.evict_many, ride_ids))
+        for ride_id in ride_ids:
+            # Chat connections to a completed ride are closed, as when the host completes it; the
+            # dispatcher broadcasts EXPIRY_MESSAGE before the notice, so riders see it first
+            notify_membership_changed(ride_id)
+        transaction.on_commit(dispatcher.wake)
+    return len(rows)
+
+
+class RideExpiryScheduler(threading.Thread):
+    """Runs expire_stale_rides every ``interval`` seconds in a daemon thread."""
+
+    def __init__(self, interval):
+        super().__init__(name='ride-expiry', daemon=True)
+        self.interval = interval
+        self._stopped = threading.Event()
+
+    def run(self):
+        while not self._stopped.wait(self.interval):
+            try:
+                expired = expire_stale_rides()
+                if expired:
+                    logger.info(f"Auto-completed {expired} stale rides")
+            except Exception:
+                logger.exception("Stale ride expiry failed")
+            finally:
+                close_old_connections()
+
+    def stop(self):
+        self._stopped.set()
+
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+
+def start_scheduler(interval=None):
+    """Start the in-process expiry scheduler once per process and return it."""
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None or not _scheduler.is_alive():
+            _scheduler = RideExpiryScheduler(interval or settings.RIDE_EXPIRY_INTERVAL_SECONDS)
+            _scheduler.start()
+        return _scheduler
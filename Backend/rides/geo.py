@@ -0,0 +1,74 @@
+import math
+
+EARTH_RADIUS_KM = 6371.0088
+
+# Size of one grid cell in degrees. 0.01 degrees is roughly 1.1 km of latitude,
+# so a typical 5 km search touches about ten cell rows.
+GRID_CELL_DEGREES = 0.01
+
+# Number of cell columns around the globe; used to pack (row, col) into one integer.
+GRID_COLUMNS = int(round(360 / GRID_CELL_DEGREES))
+
+# Above this many cells a search falls back to the latitude band alone (only reachable near the poles).
+MAX_COVERING_CELLS = 10000
+
+
+def haversine_km(lat1, lng1, lat2, lng2):
+    """Great-circle distance in kilometres between two points."""
+    lat1, lng1, lat2, lng2 = map(math.radians, (lat1, lng1, lat2, lng2))
+    a = (math.sin((lat2 - lat1) / 2) ** 2
+         + math.cos(lat1) * math.cos(lat2) * math.sin((lng2 - lng1) / 2) ** 2)
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+
+
+def bounding_box(lat, lng, radius_km):
+    """Return (min_lat, max_lat, min_lng, max_lng) enclosing a circle of radius_km."""
+    lat_delta = math.degrees(radius_km / EARTH_RADIUS_KM)
+    cos_lat = math.cos(math.radians(lat))
+    if cos_lat < 1e-6:
+        lng_delta = 180.0
+    else:
+        lng_delta = min(180.0, math.degrees(radius_km / (EARTH_RADIUS_KM * cos_lat)))
+    return (
+        max(-90.0, lat - lat_delta),
+        min(90.0, lat + lat_delta),
+        lng - lng_delta,
+        lng + lng_delta,
+    )
+
+
+def _row(lat):
+    return int(math.floor((min(lat, 90.0 - 1e-9) + 90.0) / GRID_CELL_DEGREES))
+
+
+def _col(lng):
+    return int(math.floor(((lng + 180.0) % 360.0) / GRID_CELL_DEGREES))
+
+
+def grid_cell(lat, lng):
+    """Return the integer grid cell id for a coordinate, or None if it is missing."""
+    if lat is None or lng is None:
+        return None
+    return _row(lat) * GRID_COLUMNS + _col(lng)
+
+
+def covering_cells(lat, lng, radius_km):
+    """
+    Return the ids of every grid cell that intersects the bounding box of a search circle,
+    or None if that would be more than MAX_COVERING_CELLS cells.
+    """
+    min_lat, max_lat, min_lng, max_lng = bounding_box(lat, lng, radius_km)
+    if max_lng - min_lng >= 360.0:
+        cols = range(GRID_COLUMNS)
+    else:
+        first_col, last_col = _col(min_lng), _col(max_lng)
+        if first_col <= last_col:
+            cols = range(first_col, last_col + 1)
+        else:
+            # The box crosses the antimeridian
+            cols = [*range(first_col, GRID_COLUMNS), *range(0, last_col + 1)]
+
+    rows = range(_row(min_lat), _row(max_lat) + 1)
+    if len(rows) * len(cols) > MAX_COVERING_CELLS:
+        return None
+    return [row * GRID_COLUMNS + col for row in rows for col in cols]
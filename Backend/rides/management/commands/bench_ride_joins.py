@@ -0,0 +1,96 @@
+import threading
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.db.utils import OperationalError
+from django.utils import timezone
+
+from RideShare.bench import isolated_database
+from rides.models import Ride, RideRequest
+from rides.services import RideJoinError, join_ride
+from users.models import User
+
+
+class Command(BaseCommand):
+    help = "Stress-test concurrent ride joins: many threads race for a limited number of seats."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rides', type=int, default=20, help="Number of rides to fill.")
+        parser.add_argument('--seats', type=int, default=10, help="Seats offered by each ride.")
+        parser.add_argument('--riders', type=int, default=40, help="Riders racing for each ride.")
+        parser.add_argument('--threads', type=int, default=16)
+
+    def handle(self, *args, **options):
+        with isolated_database():
+            rides, attempts = self.seed(options['rides'], options['seats'], options['riders'])
+            joined, rejected, errors, elapsed = self.race(attempts, options['threads'])
+
+            overbooked = 0
+            for ride in rides:
+                ride.refresh_from_db()
+                members = ride.members.count()
+                requests = RideRequest.objects.filter(ride=ride).count()
+                if (members > options['seats'] or members != requests or members != ride.member_count
+                        or members + ride.seats_available != options['seats']):
+                    overbooked += 1
+
+        self.stdout.write(f"attempts: {len(attempts)} over {options['threads']} threads in {elapsed:.2f}s")
+        self.stdout.write(f"joined: {joined} (capacity {options['rides'] * options['seats']}), "
+                          f"rejected: {rejected}, database errors: {errors}")
+        self.stdout.write(f"throughput: {len(attempts) / elapsed:.0f} join attempts/s, {joined / elapsed:.0f} joins/s")
+        if overbooked:
+            self.stdout.write(self.style.ERROR(f"{overbooked} rides are overbooked or inconsistent"))
+        else:
+            self.stdout.write(self.style.SUCCESS("No ride was overbooked."))
+
+    def seed(self, ride_count, seats, riders_per_ride):
+        hosts = User.objects.bulk_create(
+            User(email=f"host{i}@northsouth.edu", first_name="Host", last_name=str(i))
+            for i in range(ride_count)
+        )
+        riders = User.objects.bulk_create(
+            User(email=f"rider{i}@northsouth.edu", first_name="Rider", last_name=str(i))
+            for i in range(riders_per_ride)
+        )
+        departure = timezone.now() + timedelta(hours=1)
+        rides = Ride.objects.bulk_create(
+            Ride(host=host, vehicle_type='CNG', pickup_name="A", destination_name="B",
+                 departure_time=departure, total_fare=300, seats_available=seats, ride_code=f"J{i:05d}")
+            for i, host in enumerate(hosts)
+        )
+        # Interleave attempts so every thread contends on every ride
+        attempts = [(ride, rider) for rider in riders for ride in rides]
+        return rides, attempts
+
+    def race(self, attempts, thread_count):
+        counts = {'joined': 0, 'rejected': 0, 'errors': 0}
+        lock = threading.Lock()
+        start_barrier = threading.Barrier(thread_count)
+
+        def worker(chunk):
+            start_barrier.wait()
+            local = {'joined': 0, 'rejected': 0, 'errors': 0}
+            for ride, rider in chunk:
+                try:
+                    join_ride(Ride.objects.get(pk=ride.pk), rider)
+                    local['joined'] += 1
+                except RideJoinError:
+                    local['rejected'] += 1
+                except OperationalError:
+                    local['errors'] += 1
+            connection.close()
+            with lock:
+                for key, value in local.items():
+                    counts[key] += value
+
+        threads = [threading.Thread(target=worker, args=(attempts[i::thread_count],))
+                   for i in range(thread_count)]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - start
+        return counts['joined'], counts['rejected'], counts['errors'], elapsed
@@ -0,0 +1,119 @@
+import random
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from RideShare.bench import isolated_database, latency_summary, percentile, timed
+from rides.geo import grid_cell, haversine_km
+from rides.matching import RideCandidates, WEIGHTS, match_rides, score_candidates, top_k
+from rides.models import Ride
+from users.models import User
+
+CENTER_LAT, CENTER_LNG = 23.8103, 90.4125
+SPREAD_DEGREES = 0.15
+TARGET_MS = 20
+
+
+class Command(BaseCommand):
+    help = "Benchmark route-similarity matching of open rides, end to end and the vectorised scoring alone."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rides', type=int, default=50_000, help="Number of open rides to seed.")
+        parser.add_argument('--queries', type=int, default=50, help="Number of trips to match.")
+        parser.add_argument('--seed', type=int, default=7)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        now = timezone.now()
+        with isolated_database():
+            rider = User.objects.create(email="rider@northsouth.edu", first_name="Bench", last_name="Rider",
+                                        gender='Female')
+            self.seed(rng, options['rides'], now)
+
+            all_open = Ride.objects.filter(is_completed=False, seats_available__gt=0).order_by()
+            candidates, load_ms = timed(RideCandidates.from_queryset, all_open)
+
+            trips = [(self.random_point(rng), self.random_point(rng)) for _ in range(options['queries'])]
+            departure = now + timedelta(hours=1)
+            window = 3600.0
+
+            score_ms = []
+            for origin, destination in trips:
+                def score():
+                    scores, _, _ = score_candidates(candidates, origin, destination, departure, window, True,
+                                                    max_pickup_km=50, max_destination_km=50)
+                    return top_k(scores, 10)
+                _, elapsed = timed(score)
+                score_ms.append(elapsed)
+
+            loop_ms = []
+            for origin, destination in trips[:3]:
+                _, elapsed = timed(self.python_loop, candidates, origin, destination, departure, window)
+                loop_ms.append(elapsed)
+
+            match_ms = []
+            for origin, destination in trips:
+                _, elapsed = timed(match_rides, rider, origin, destination,
+                                   now, now + timedelta(hours=2), limit=10)
+                match_ms.append(elapsed)
+
+        self.stdout.write(f"candidates: {len(candidates)} (loaded in {load_ms:.1f}ms)")
+        self.stdout.write(f"numpy scoring + top-k : {latency_summary(score_ms)}")
+        self.stdout.write(f"per-row python loop   : {latency_summary(loop_ms)}")
+        self.stdout.write(f"match_rides end to end: {latency_summary(match_ms)}")
+        # The budget is for what a request pays: the candidate query, scoring and loading the winners
+        if percentile(match_ms, 99) <= TARGET_MS:
+            self.stdout.write(self.style.SUCCESS(f"match_rides p99 is within the {TARGET_MS}ms budget."))
+        else:
+            self.stdout.write(self.style.ERROR(f"match_rides p99 exceeds the {TARGET_MS}ms budget."))
+
+    def random_point(self, rng):
+        return (CENTER_LAT + rng.uniform(-SPREAD_DEGREES, SPREAD_DEGREES),
+                CENTER_LNG + rng.uniform(-SPREAD_DEGREES, SPREAD_DEGREES))
+
+    def python_loop(self, candidates, origin, destination, departure, window):
+        """Reference implementation: the same score computed one ride at a time."""
+        best = []
+        target = departure.timestamp()
+        fares = candidates.total_fare / (candidates.max_seats - candidates.seats_available + 1)
+        max_fare = max(fares)
+        for i in range(len(candidates)):
+            pickup = haversine_km(origin[0], origin[1], candidates.pickup_lat[i], candidates.pickup_lng[i])
+            dest = haversine_km(destination[0], destination[1],
+                                candidates.destination_lat[i], candidates.destination_lng[i])
+            penalty = (WEIGHTS['pickup'] * pickup / 50 + WEIGHTS['destination'] * dest / 50
+                       + WEIGHTS['departure'] * abs(candidates.departure[i] - target) / window
+                       + WEIGHTS['fare'] * fares[i] / max_fare)
+            best.append((1 - penalty, i))
+        best.sort(reverse=True)
+        return best[:10]
+
+    def seed(self, rng, count, now):
+        hosts = User.objects.bulk_create(
+            User(email=f"bench{i}@northsouth.edu", first_name="Bench", last_name=str(i), gender='Female')
+            for i in range(1000)
+        )
+        batch = []
+        for i in range(count):
+            (lat, lng), (dest_lat, dest_lng) = self.random_point(rng), self.random_point(rng)
+            batch.append(Ride(
+                host=hosts[i % len(hosts)],
+                vehicle_type=rng.choice(['CNG', 'Uber', 'Private Bike']),
+                pickup_name="Bench pickup",
+                destination_name="Bench destination",
+                departure_time=now + timedelta(minutes=rng.uniform(0, 120)),
+                total_fare=rng.randint(100, 600),
+                seats_available=rng.randint(1, 2),
+                is_female_only=rng.random() < 0.1,
+                ride_code=f"{i:06X}",
+                pickup_latitude=lat,
+                pickup_longitude=lng,
+                destination_latitude=dest_lat,
+                destination_longitude=dest_lng,
+                pickup_cell=grid_cell(lat, lng),
+            ))
+            if len(batch) == 5000:
+                Ride.objects.bulk_create(batch)
+                batch = []
+        Ride.objects.bulk_create(batch)
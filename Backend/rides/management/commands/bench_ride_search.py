@@ -0,0 +1,84 @@
+import random
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from RideShare.bench import isolated_database, latency_summary, timed
+from rides.geo import grid_cell, haversine_km
+from rides.models import Ride
+from users.models import User
+
+# Seed rides around Dhaka, spread over roughly 200 x 200 km.
+CENTER_LAT, CENTER_LNG = 23.8103, 90.4125
+SPREAD_DEGREES = 1.0
+
+
+class Command(BaseCommand):
+    help = "Benchmark proximity ride search (grid prefilter + haversine) against a full scan."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rides', type=int, default=100_000, help="Number of open rides to seed.")
+        parser.add_argument('--queries', type=int, default=200, help="Number of proximity queries to time.")
+        parser.add_argument('--radius', type=float, default=3.0, help="Search radius in km.")
+        parser.add_argument('--seed', type=int, default=42)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        with isolated_database():
+            self.seed(rng, options['rides'])
+            points = [self.random_point(rng) for _ in range(options['queries'])]
+            open_rides = Ride.objects.filter(seats_available__gt=0, is_completed=False)
+            radius = options['radius']
+
+            grid_ms, hits = [], 0
+            for lat, lng in points:
+                result, elapsed = timed(open_rides.nearby, lat, lng, radius)
+                grid_ms.append(elapsed)
+                hits += len(result)
+
+            scan_ms = []
+            for lat, lng in points[:max(1, len(points) // 10)]:
+                _, elapsed = timed(self.full_scan, open_rides, lat, lng, radius)
+                scan_ms.append(elapsed)
+
+        self.stdout.write(f"open rides: {options['rides']}, radius: {radius} km, "
+                          f"avg matches/query: {hits / len(points):.1f}")
+        self.stdout.write(f"grid index : {latency_summary(grid_ms)}")
+        self.stdout.write(f"full scan  : {latency_summary(scan_ms)}")
+
+    def random_point(self, rng):
+        return (CENTER_LAT + rng.uniform(-SPREAD_DEGREES, SPREAD_DEGREES),
+                CENTER_LNG + rng.uniform(-SPREAD_DEGREES, SPREAD_DEGREES))
+
+    def full_scan(self, rides, lat, lng, radius):
+        coords = rides.values_list('id', 'pickup_latitude', 'pickup_longitude')
+        return [ride_id for ride_id, r_lat, r_lng in coords
+                if haversine_km(lat, lng, r_lat, r_lng) <= radius]
+
+    def seed(self, rng, count):
+        hosts = User.objects.bulk_create(
+            User(email=f"bench{i}@northsouth.edu", first_name="Bench", last_name=str(i))
+            for i in range(1000)
+        )
+        departure = timezone.now() + timedelta(hours=2)
+        batch = []
+        for i in range(count):
+            lat, lng = self.random_point(rng)
+            batch.append(Ride(
+                host=hosts[i % len(hosts)],
+                vehicle_type='CNG',
+                pickup_name="Bench pickup",
+                destination_name="Bench destination",
+                departure_time=departure,
+                total_fare=300,
+                seats_available=2,
+                ride_code=f"{i:06X}",
+                pickup_latitude=lat,
+                pickup_longitude=lng,
+                pickup_cell=grid_cell(lat, lng),
+            ))
+            if len(batch) == 5000:
+                Ride.objects.bulk_create(batch)
+                batch = []
+        Ride.objects.bulk_create(batch)
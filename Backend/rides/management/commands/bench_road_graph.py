@@ -0,0 +1,95 @@
+import math
+import os
+import tempfile
+
+import numpy as np
+from django.core.management.base import BaseCommand
+
+from RideShare.bench import latency_summary, percentile, timed
+from rides.roads import RoadGraph
+
+CENTER_LAT, CENTER_LNG = 23.8103, 90.4125
+TARGET_MS = 100
+
+
+def synthetic_city(rows, cols, spacing_m, rng, missing=0.1, oneway=0.2):
+    """
+    A rows x cols street grid centred on Dhaka: a share of the blocks have no street, some streets
+    are one-way and every street is a little longer than the straight line between its corners.
+    """
+    lat_step = spacing_m / 111_320
+    lng_step = spacing_m / (111_320 * math.cos(math.radians(CENTER_LAT)))
+    row, col = np.divmod(np.arange(rows * cols), cols)
+    lats = CENTER_LAT + (row - rows / 2) * lat_step
+    lngs = CENTER_LNG + (col - cols / 2) * lng_step
+
+    node = np.arange(rows * cols).reshape(rows, cols)
+    tails = np.concatenate((node[:, :-1].ravel(), node[:-1, :].ravel()))
+    heads = np.concatenate((node[:, 1:].ravel(), node[1:, :].ravel()))
+    kept = rng.random(len(tails)) >= missing
+    tails, heads = tails[kept], heads[kept]
+    lengths = spacing_m * rng.uniform(1.0, 1.3, len(tails))
+
+    both_ways = rng.random(len(tails)) >= oneway
+    sources = np.concatenate((tails, heads[both_ways]))
+    targets = np.concatenate((heads, tails[both_ways]))
+    return RoadGraph.from_edges(lats, lngs, sources, targets, np.concatenate((lengths, lengths[both_ways])))
+
+
+class Command(BaseCommand):
+    help = "Benchmark one-to-many road distance queries (rides.roads) on a city-sized synthetic street grid."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--size', type=int, default=320, help="Streets per side; the graph has size^2 nodes.")
+        parser.add_argument('--spacing', type=float, default=100, help="Metres between intersections.")
+        parser.add_argument('--targets', type=int, default=1000, help="Destinations per query.")
+        parser.add_argument('--radius-km', type=float, default=5, help="Targets lie within this distance.")
+        parser.add_argument('--queries', type=int, default=50)
+        parser.add_argument('--seed', type=int, default=7)
+
+    def handle(self, *args, **options):
+        rng = np.random.default_rng(options['seed'])
+        graph, build_ms = timed(synthetic_city, options['size'], options['size'], options['spacing'], rng)
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, 'roads.graph')
+            graph.save(path)
+            graph, open_ms = timed(RoadGraph.open, path)
+
+            radius_km = options['radius_km']
+            half_width_km = options['size'] * options['spacing'] / 2000
+            snap_ms, query_ms, reached = [], [], []
+            for _ in range(options['queries']):
+                lat, lng = self.random_point(rng, half_width_km - radius_km)
+                lats, lngs = self.around(rng, lat, lng, radius_km, options['targets'])
+                _, elapsed = timed(graph.snap, lats, lngs)
+                snap_ms.append(elapsed)
+                # Road distances run longer than straight lines; bound the search at twice the radius
+                distances, elapsed = timed(graph.distances_from, lat, lng, lats, lngs, max_km=2 * radius_km)
+                query_ms.append(elapsed)
+                reached.append(np.isfinite(distances).mean())
+            file_size = os.path.getsize(path)
+            del graph
+
+        self.stdout.write(f"graph: {options['size'] ** 2} nodes, built in {build_ms:.0f}ms, "
+                          f"{file_size / 2 ** 20:.1f} MiB on disk, opened in {open_ms:.2f}ms")
+        self.stdout.write(f"one-to-{options['targets']} within {radius_km:g} km:")
+        self.stdout.write(f"  snapping targets: {latency_summary(snap_ms)}")
+        self.stdout.write(f"  whole query     : {latency_summary(query_ms)}")
+        self.stdout.write(f"  targets reached : {100 * sum(reached) / len(reached):.1f}%")
+        if percentile(query_ms, 99) <= TARGET_MS:
+            self.stdout.write(self.style.SUCCESS(f"Query p99 is within the {TARGET_MS}ms budget."))
+        else:
+            self.stdout.write(self.style.ERROR(f"Query p99 exceeds the {TARGET_MS}ms budget."))
+
+    def random_point(self, rng, spread_km):
+        """A point within spread_km of the centre, so the targets around it stay on the grid."""
+        spread = max(spread_km, 0) / 111
+        return (CENTER_LAT + rng.uniform(-spread, spread), CENTER_LNG + rng.uniform(-spread, spread))
+
+    def around(self, rng, lat, lng, radius_km, count):
+        distance = radius_km * np.sqrt(rng.random(count))
+        bearing = rng.uniform(0, 2 * math.pi, count)
+        lats = lat + np.degrees(distance * np.cos(bearing) / 6371)
+        lngs = lng + np.degrees(distance * np.sin(bearing) / (6371 * math.cos(math.radians(lat))))
+        return lats, lngs
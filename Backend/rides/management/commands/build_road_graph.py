@@ -0,0 +1,48 @@
+import csv
+
+from django.core.management.base import BaseCommand, CommandError
+
+from rides.roads import RoadGraph
+
+TRUE_VALUES = {'1', 'true', 'yes', 'y'}
+
+
+class Command(BaseCommand):
+    help = ("Build a road graph file for rides.roads from a road-network extract: a nodes CSV "
+            "(id, lat, lng) and an edges CSV (from, to, optional length_m and oneway).")
+
+    def add_arguments(self, parser):
+        parser.add_argument('nodes', help="CSV with id, lat and lng columns.")
+        parser.add_argument('edges', help="CSV with from and to columns; length_m defaults to the straight-line "
+                                          "length and edges run both ways unless oneway is 1/true/yes.")
+        parser.add_argument('output', help="Graph file to write; point ROAD_GRAPH_PATH at it.")
+
+    def handle(self, *args, **options):
+        index, lats, lngs = {}, [], []
+        with open(options['nodes'], newline='') as f:
+            for row in csv.DictReader(f):
+                index[row['id']] = len(lats)
+                lats.append(float(row['lat']))
+                lngs.append(float(row['lng']))
+
+        sources, targets, lengths = [], [], []
+        with open(options['edges'], newline='') as f:
+            reader = csv.DictReader(f)
+            has_lengths = 'length_m' in (reader.fieldnames or ())
+            for line, row in enumerate(reader, start=2):
+                try:
+                    tail, head = index[row['from']], index[row['to']]
+                except KeyError as e:
+                    raise CommandError(f"{options['edges']}:{line}: unknown node {e}")
+                directions = [(tail, head)]
+                if row.get('oneway', '').strip().lower() not in TRUE_VALUES:
+                    directions.append((head, tail))
+                for source, target in directions:
+                    sources.append(source)
+                    targets.append(target)
+                    if has_lengths:
+                        lengths.append(float(row['length_m']))
+
+        graph = RoadGraph.from_edges(lats, lngs, sources, targets, lengths if has_lengths else None)
+        graph.save(options['output'])
+        self.stdout.write(f"Wrote {len(graph)} nodes and {graph.edge_count} directed edges to {options['output']}")
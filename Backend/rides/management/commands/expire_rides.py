@@ -0,0 +1,24 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from rides.expiry import expire_stale_rides, stale_rides
+
+
+class Command(BaseCommand):
+    help = "Complete open rides whose departure time is older than the grace period."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--grace-hours', type=float, default=None,
+                            help="Hours after departure before a ride expires (default: RIDE_EXPIRY_GRACE).")
+        parser.add_argument('--chunk-size', type=int, default=settings.RIDE_EXPIRY_CHUNK_SIZE)
+        parser.add_argument('--dry-run', action='store_true', help="Only count the stale rides.")
+
+    def handle(self, *args, **options):
+        grace = timedelta(hours=options['grace_hours']) if options['grace_hours'] is not None else None
+        if options['dry_run']:
+            self.stdout.write(f"{stale_rides(grace).count()} stale rides")
+            return
+        expired = expire_stale_rides(grace=grace, chunk_size=options['chunk_size'])
+        self.stdout.write(f"Completed {expired} stale rides")
@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand
+
+from rides.expiry import start_scheduler
+from rides.outbox import dispatcher
+from sos.fanout import fanout_dispatcher
+
+
+class Command(BaseCommand):
+    help = (
+        "Run the ride-event dispatcher, the ride expiry scheduler and the SOS fan-out sweeper in this "
+        "process until interrupted. Use with RIDE_EVENT_DISPATCHER, RIDE_EXPIRY_SCHEDULER and "
+        "SOS_FANOUT_SWEEPER turned off for the web servers."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--no-expiry', action='store_true', help="Leave ride expiry to cron (`expire_rides`).")
+        parser.add_argument('--no-sweeper', action='store_true', help="Do not sweep up pending SOS alerts.")
+
+    def handle(self, *args, **options):
+        if not options['no_expiry']:
+            start_scheduler()
+        if not options['no_sweeper']:
+            fanout_dispatcher.start_sweeper()
+        self.stdout.write("Running background jobs, Ctrl-C to stop")
+        thread = dispatcher.start_thread()
+        try:
+            thread.join()
+        except KeyboardInterrupt:
+            dispatcher.stop()
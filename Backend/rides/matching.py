@@ -0,0 +1,197 @@
+"""
+Route-similarity matching between a rider's trip and open rides.
+
+Candidates are loaded once into NumPy arrays and scored as a batch: every component is a
+vectorised expression over the whole candidate set, so cost grows with array length rather
+than with Python-level work per ride.
+"""
+import numpy as np
+from django.db import connections
+from django.db.models import FloatField, Func
+
+from .geo import EARTH_RADIUS_KM, bounding_box
+from .models import Ride
+
+# Relative importance of each score component. Each component is normalised to [0, 1].
+WEIGHTS = {
+    'pickup': 0.35,
+    'destination': 0.35,
+    'departure': 0.2,
+    'fare': 0.1,
+}
+
+DEFAULT_MAX_PICKUP_KM = 3.0
+DEFAULT_MAX_DESTINATION_KM = 3.0
+
+
+def haversine_km_many(lat, lng, lats, lngs):
+    """Great-circle distance in km from one point to arrays of points."""
+    lat, lng = np.radians(lat), np.radians(lng)
+    lats, lngs = np.radians(lats), np.radians(lngs)
+    a = np.sin((lats - lat) / 2) ** 2 + np.cos(lat) * np.cos(lats) * np.sin((lngs - lng) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
+
+class EpochSeconds(Func):
+    """
+    A datetime column as seconds since the epoch, computed by the database, so loading thousands
+    of candidates skips building (and time-zone converting) a datetime object per row.
+    """
+    output_field = FloatField()
+
+    def as_sqlite(self, compiler, connection, **extra_context):
+        return self.as_sql(compiler, connection, template="(julianday(%(expressions)s) - 2440587.5) * 86400.0",
+                           **extra_context)
+
+    def as_postgresql(self, compiler, connection, **extra_context):
+        return self.as_sql(compiler, connection, template="EXTRACT(EPOCH FROM %(expressions)s)::float",
+                           **extra_context)
+
+
+class RideCandidates:
+    """Column arrays for a set of open rides, in the order of ``ids``."""
+
+    # The query selects expressions after plain columns, so the departure time comes last
+    FIELDS = (
+        'id', 'pickup_latitude', 'pickup_longitude', 'destination_latitude', 'destination_longitude',
+        'total_fare', 'seats_available', 'vehicle_type', 'is_female_only', EpochSeconds('departure_time'),
+    )
+
+    def __init__(self, rows):
+        columns = list(zip(*rows)) if rows else [()] * len(self.FIELDS)
+        (ids, pickup_lat, pickup_lng, dest_lat, dest_lng,
+         fare, seats, vehicle, female_only, departure) = columns
+        self.ids = np.array(ids, dtype=np.int64)
+        self.pickup_lat = np.array(pickup_lat, dtype=np.float64)
+        self.pickup_lng = np.array(pickup_lng, dtype=np.float64)
+        self.destination_lat = np.array(dest_lat, dtype=np.float64)
+        self.destination_lng = np.array(dest_lng, dtype=np.float64)
+        self.departure = np.array(departure, dtype=np.float64)
+        self.seats_available = np.array(seats, dtype=np.float64)
+        # Used to work out how many people already share a ride
+        max_seats = {value: Ride.max_seats_for(value) for value in set(vehicle)}
+        self.max_seats = np.array([max_seats[value] for value in vehicle], dtype=np.float64)
+        self.total_fare = np.array(fare, dtype=np.float64)
+        self.is_female_only = np.array(female_only, dtype=bool)
+
+    def __len__(self):
+        return len(self.ids)
+
+    @classmethod
+    def from_queryset(cls, rides):
+        # Rows are read straight off the cursor: the arrays only need numbers, so the per-row
+        # Decimal and bool conversion the queryset would do is skipped
+        sql, params = rides.values_list(*cls.FIELDS).query.sql_with_params()
+        with connections[rides.db].cursor() as cursor:
+            cursor.execute(sql, params)
+            return cls(cursor.fetchall())
+
+
+def score_candidates(candidates, origin, destination, departure, window_seconds, is_female,
+                     max_pickup_km=DEFAULT_MAX_PICKUP_KM, max_destination_km=DEFAULT_MAX_DESTINATION_KM,
+                     graph=None):
+    """
+    Score every candidate for a trip; higher is better.
+
+    Returns (scores, pickup_km, destination_km). Rides the rider cannot join (too far away,
+    full, or female-only for a non-female rider) score -inf. With a road graph (rides.roads),
+    pickup distance is the road distance from the rider to each pickup.
+    """
+    pickup_km = haversine_km_many(origin[0], origin[1], candidates.pickup_lat, candidates.pickup_lng)
+    if graph is not None:
+        road_km = graph.distances_from(origin[0], origin[1], candidates.pickup_lat, candidates.pickup_lng,
+                                       max_km=max_pickup_km)
+        # Pickups off the graph keep their straight-line distance
+        pickup_km = np.where(np.isnan(road_km), pickup_km, road_km)
+    destination_km = haversine_km_many(destination[0], destination[1],
+                                       candidates.destination_lat, candidates.destination_lng)
+    departure_delta = np.abs(candidates.departure - departure.timestamp())
+
+    # The rider would share the fare with everyone already on board plus themselves.
+    occupants = candidates.max_seats - candidates.seats_available
+    fare_per_seat = candidates.total_fare / (occupants + 1)
+    max_fare = fare_per_seat.max() if len(candidates) else 0.0
+
+    penalty = (
+        WEIGHTS['pickup'] * (pickup_km / max_pickup_km)
+        + WEIGHTS['destination'] * (destination_km / max_destination_km)
+        + WEIGHTS['departure'] * (departure_delta / max(window_seconds, 1.0))
+        + WEIGHTS['fare'] * (fare_per_seat / max_fare if max_fare > 0 else 0.0)
+    )
+    scores = 1.0 - penalty
+
+    eligible = (
+        (pickup_km <= max_pickup_km)
+        & (destination_km <= max_destination_km)
+        & (candidates.seats_available > 0)
+        & (is_female | ~candidates.is_female_only)
+    )
+    scores = np.where(eligible, scores, -np.inf)
+    return scores, pickup_km, destination_km
+
+
+def top_k(scores, k):
+    """Indices of the k highest finite scores, best first."""
+    finite = np.flatnonzero(np.isfinite(scores))
+    if len(finite) > k:
+        finite = finite[np.argpartition(-scores[finite], k - 1)[:k]]
+    return finite[np.argsort(-scores[finite], kind='stable')]
+
+
+def candidate_rides(user, origin, destination, departure_after, departure_before,
+                    max_pickup_km=DEFAULT_MAX_PICKUP_KM, max_destination_km=DEFAULT_MAX_DESTINATION_KM):
+    """
+    Open rides the user could join that leave inside the departure window, with pickup and
+    destination inside the bounding boxes of the two search circles. A superset of what
+    score_candidates accepts, so the exact checks stay there.
+    """
+    rides = Ride.objects.filter(
+        is_completed=False,
+        seats_available__gt=0,
+        departure_time__range=(departure_after, departure_before),
+        destination_latitude__isnull=False,
+        destination_longitude__isnull=False,
+    ).within_bounding_box(origin[0], origin[1], max_pickup_km).order_by()
+    # Most rides near the pickup go somewhere else; ride_open_pickup_cell_idx carries the
+    # destination, so they are dropped in SQL without reading their rows
+    min_lat, max_lat, min_lng, max_lng = bounding_box(destination[0], destination[1], max_destination_km)
+    rides = rides.filter(destination_latitude__range=(min_lat, max_lat))
+    if min_lng >= -180.0 and max_lng <= 180.0:
+        rides = rides.filter(destination_longitude__range=(min_lng, max_lng))
+    if user.gender != 'Female':
+        rides = rides.exclude(is_female_only=True)
+    return rides
+
+
+def match_rides(user, origin, destination, departure_after, departure_before, limit=10,
+                max_pickup_km=DEFAULT_MAX_PICKUP_KM, max_destination_km=DEFAULT_MAX_DESTINATION_KM):
+    """
+    Return up to ``limit`` dicts of {ride, score, pickup_km, destination_km} for rides that
+    leave inside the departure window and go where the rider is going, best match first.
+    """
+    from .roads import road_graph
+
+    rides = candidate_rides(user, origin, destination, departure_after, departure_before,
+                            max_pickup_km, max_destination_km)
+    candidates = RideCandidates.from_queryset(rides)
+    if not len(candidates):
+        return []
+
+    window_middle = departure_after + (departure_before - departure_after) / 2
+    window_half = max((departure_before - departure_after).total_seconds() / 2, 1.0)
+    scores, pickup_km, destination_km = score_candidates(
+        candidates, origin, destination, window_middle, window_half, user.gender == 'Female',
+        max_pickup_km=max_pickup_km, max_destination_km=max_destination_km, graph=road_graph(),
+    )
+    best = top_k(scores, limit)
+    rides_by_id = Ride.objects.for_listing().in_bulk(candidates.ids[best].tolist())
+    return [
+        {
+            'ride': rides_by_id[int(candidates.ids[i])],
+            'score': float(scores[i]),
+            'pickup_km': float(pickup_km[i]),
+            'destination_km': float(destination_km[i]),
+        }
+        for i in best
+        if int(candidates.ids[i]) in rides_by_id
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 5.1.7 on 2026-10-17 12:07
+
+from django.conf import settings
+from django.db import migrations, models
+
+from rides.geo import grid_cell
+
+
+def populate_pickup_cells(apps, schema_editor):
+    Ride = apps.get_model('rides', 'Ride')
+    rides = Ride.objects.filter(pickup_latitude__isnull=False, pickup_longitude__isnull=False)
+    for ride in rides.iterator():
+        ride.pickup_cell = grid_cell(ride.pickup_latitude, ride.pickup_longitude)
+        ride.save(update_fields=['pickup_cell'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rides', '0003_alter_ride_seats_available'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='ride',
+            name='pickup_cell',
+            field=models.IntegerField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='ride',
+            index=models.Index(condition=models.Q(('is_completed', False)), fields=['pickup_cell'], name='ride_open_pickup_cell_idx'),
+        ),
+        migrations.RunPython(populate_pickup_cells, migrations.RunPython.noop),
+    ]
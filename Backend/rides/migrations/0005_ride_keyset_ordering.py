@@ -0,0 +1,23 @@
+# Generated by Django 5.1.7 on 2026-10-17 12:14
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rides', '0004_ride_pickup_cell'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name='ride',
+            options={'ordering': ['-departure_time', '-id']},
+        ),
+        migrations.AddIndex(
+            model_name='ride',
+            index=models.Index(fields=['-departure_time', '-id'], name='ride_departure_id_idx'),
+        ),
+    ]
@@ -0,0 +1,77 @@
+# Generated by Django 5.1.7 on 2026-10-17 12:16
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models.functions import Coalesce
+
+
+def backfill_memberships(apps, schema_editor):
+    """Order existing members by when their join request was made, and count them per ride."""
+    Ride = apps.get_model('rides', 'Ride')
+    RideMembership = apps.get_model('rides', 'RideMembership')
+    RideRequest = apps.get_model('rides', 'RideRequest')
+
+    requested_at = {
+        (ride_id, user_id): timestamp
+        for ride_id, user_id, timestamp in RideRequest.objects.values_list('ride_id', 'user_id', 'requested_at')
+    }
+    for membership in RideMembership.objects.select_related('ride').iterator():
+        membership.joined_at = requested_at.get((membership.ride_id, membership.user_id), membership.ride.created_at)
+        membership.save(update_fields=['joined_at'])
+
+    counts = models.Subquery(
+        RideMembership.objects.filter(ride=models.OuterRef('pk')).order_by()
+        .values('ride').annotate(total=models.Count('pk')).values('total')
+    )
+    Ride.objects.update(member_count=Coalesce(counts, 0))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rides', '0005_ride_keyset_ordering'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        # The auto-created rides_ride_members table already has the right columns and unique
+        # constraint, so the through model takes it over without touching the database.
+        migrations.SeparateDatabaseAndState(
+            state_operations=[
+                migrations.CreateModel(
+                    name='RideMembership',
+                    fields=[
+                        ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                        ('ride', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='memberships', to='rides.ride')),
+                        ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='ride_memberships', to=settings.AUTH_USER_MODEL)),
+                    ],
+                    options={
+                        'db_table': 'rides_ride_members',
+                        'unique_together': {('ride', 'user')},
+                    },
+                ),
+                migrations.AlterField(
+                    model_name='ride',
+                    name='members',
+                    field=models.ManyToManyField(blank=True, related_name='ride_members', through='rides.RideMembership', to=settings.AUTH_USER_MODEL),
+                ),
+            ],
+        ),
+        migrations.AddField(
+            model_name='ridemembership',
+            name='joined_at',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        migrations.AddField(
+            model_name='ride',
+            name='member_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(backfill_memberships, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='ridemembership',
+            index=models.Index(fields=['ride', 'joined_at', 'id'], name='ride_membership_order_idx'),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.1.7 on 2026-10-17 12:18
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rides', '0006_ride_membership'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='ride',
+            index=models.Index(condition=models.Q(('is_completed', False), ('seats_available__gt', 0)), fields=['-departure_time', '-id'], name='ride_joinable_departure_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='ride',
+            index=models.Index(condition=models.Q(('is_completed', False)), fields=['host', '-departure_time'], name='ride_host_open_idx'),
+        ),
+    ]
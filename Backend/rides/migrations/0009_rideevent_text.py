@@ -0,0 +1,42 @@
+# Generated by Django 5.1.7 on 2026-10-17 15:05
+
+from django.db import migrations, models
+
+
+def copy_text(apps, schema_editor):
+    # Pending outbox events are few (the dispatcher drains them within seconds), so no chunking
+    RideEvent = apps.get_model('rides', 'RideEvent')
+    events = list(RideEvent.objects.all())
+    for event in events:
+        event.text = str((event.message_json or {}).get('message', ''))
+    RideEvent.objects.bulk_update(events, ['text'])
+
+
+def copy_message_json(apps, schema_editor):
+    RideEvent = apps.get_model('rides', 'RideEvent')
+    events = list(RideEvent.objects.all())
+    for event in events:
+        event.message_json = {'message': event.text, 'First Name': 'System', 'Last Name': '',
+                              'timestamp': str(event.created_at)}
+    RideEvent.objects.bulk_update(events, ['message_json'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rides', '0008_ride_event_outbox'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='rideevent',
+            name='text',
+            field=models.TextField(default=''),
+            preserve_default=False,
+        ),
+        migrations.RunPython(copy_text, copy_message_json),
+        migrations.RemoveField(
+            model_name='rideevent',
+            name='message_json',
+        ),
+    ]
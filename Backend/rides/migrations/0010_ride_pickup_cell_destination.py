@@ -0,0 +1,21 @@
+# Generated by Django 5.1.7 on 2026-10-17 14:18
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rides', '0009_rideevent_text'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='ride',
+            name='ride_open_pickup_cell_idx',
+        ),
+        migrations.AddIndex(
+            model_name='ride',
+            index=models.Index(condition=models.Q(('is_completed', False)), fields=['pickup_cell', 'destination_latitude', 'destination_longitude'], name='ride_open_pickup_cell_idx'),
+        ),
+    ]
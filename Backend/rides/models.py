@@ -1,6 +1,15 @@
-from django.db import models
+from contextlib import nullcontext
+from functools import partial
+from django.db import models, transaction
+from django.db.models import Count, OuterRef, Q, Subquery
+from django.db.models.functions import Coalesce
+from django.db.models.signals import m2m_changed
+from django.dispatch import receiver
+from django.utils import timezone
 from django.core.exceptions import ValidationError
 from users.models import User
+from chat.cache import recent_messages
+from .geo import grid_cell, covering_cells, bounding_box, haversine_km
 import random
 import string
 
@@ -9,6 +18,48 @@ def generate_ride_code():
     characters = string.ascii_uppercase + string.digits
     return ''.join(random.choice(characters) for _ in range(6))
 
+class RideQuerySet(models.QuerySet):
+    def for_listing(self):
+        """
+        Everything RideSerializer reads, fetched up front: the host is joined and members are
+        prefetched in one query, so serializing N rides costs a constant number of queries.
+        """
+        return self.select_related('host').prefetch_related('members')
+
+    def involving(self, user):
+        """
+        Rides the user hosts or is a member of.
+
+        Membership is matched with a subquery rather than a join, so each row appears once without
+        DISTINCT and both halves of the OR can use their own index.
+        """
+        memberships = RideMembership.objects.filter(user=user).values('ride')
+        return self.filter(Q(host=user) | Q(pk__in=memberships))
+
+    def within_bounding_box(self, lat, lng, radius_km):
+        """Prefilter rides whose pickup point lies in the grid cells and latitude band around a circle."""
+        min_lat, max_lat, _, _ = bounding_box(lat, lng, radius_km)
+        rides = self.filter(pickup_latitude__range=(min_lat, max_lat))
+        cells = covering_cells(lat, lng, radius_km)
+        if cells is not None:
+            rides = rides.filter(pickup_cell__in=cells)
+        return rides
+
+    def nearby(self, lat, lng, radius_km):
+        """
+        Return (ride, distance_km) pairs within radius_km of a point, closest first.
+
+        The grid/bounding-box prefilter runs in SQL; only its survivors get the exact haversine check.
+        """
+        results = []
+        for ride in self.within_bounding_box(lat, lng, radius_km):
+            distance = haversine_km(lat, lng, ride.pickup_latitude, ride.pickup_longitude)
+            if distance <= radius_km:
+                results.append((ride, distance))
+        results.sort(key=lambda pair: pair[1])
+        return results
+
+
 class Ride(models.Model):
     VEHICLE_TYPE_CHOICES = [
         ('Private Car', 'Private Car'),
@@ -31,18 +82,44 @@ class Ride(models.Model):
     ride_code = models.CharField(max_length=6, unique=True, default=generate_ride_code)
     is_completed = models.BooleanField(default=False)
     created_at = models.DateTimeField(auto_now_add=True)
-    members = models.ManyToManyField(User, related_name='ride_members', blank=True)
+    members = models.ManyToManyField(User, through='RideMembership', related_name='ride_members', blank=True)
+    # Denormalised count of members (host excluded); updated in the same transaction as the membership rows
+    member_count = models.PositiveIntegerField(default=0, editable=False)
     pickup_longitude = models.FloatField(null=True, blank=True)
     pickup_latitude = models.FloatField(null=True, blank=True)
     destination_longitude = models.FloatField(null=True, blank=True)
     destination_latitude = models.FloatField(null=True, blank=True)
     vehicle_number_plate = models.CharField(max_length=20, blank=True, null=True)
+    pickup_cell = models.IntegerField(null=True, blank=True, editable=False)
+
+    objects = RideQuerySet.as_manager()
 
     class Meta:
-        ordering = ['-departure_time']
+        ordering = ['-departure_time', '-id']
+        indexes = [
+            # Backs keyset pagination in rides.pagination.RideCursorPagination
+            models.Index(fields=['-departure_time', '-id'], name='ride_departure_id_idx'),
+            # ListRidesView: open rides with free seats, newest departure first
+            models.Index(
+                fields=['-departure_time', '-id'],
+                condition=Q(is_completed=False, seats_available__gt=0),
+                name='ride_joinable_departure_idx',
+            ),
+            # "Is this user already hosting an active ride?" in CreateRideView. Boolean filters
+            # compile to NOT is_completed, which only a partial index with the same condition can use.
+            models.Index(fields=['host', '-departure_time'], condition=Q(is_completed=False), name='ride_host_open_idx'),
+            # Only open rides are searchable, so completed rides drop out of the index. The destination
+            # columns let rides.matching drop rides going elsewhere without reading their rows.
+            models.Index(
+                fields=['pickup_cell', 'destination_latitude', 'destination_longitude'],
+                condition=Q(is_completed=False),
+                name='ride_open_pickup_cell_idx',
+            ),
+        ]
 
-    def get_max_seats(self):
-        """Return maximum seats based on vehicle_type."""
+    @staticmethod
+    def max_seats_for(vehicle_type):
+        """Return maximum seats for a vehicle_type."""
         max_seats = {
             'CNG': 3,
             'Uber': 3,
@@ -51,7 +128,11 @@ class Ride(models.Model):
             'Private Bike': 2,
             'Rickshaw': 2,
         }
-        return max_seats.get(self.vehicle_type, 3)
+        return max_seats.get(vehicle_type, 3)
+
+    def get_max_seats(self):
+        """Return maximum seats based on vehicle_type."""
+        return self.max_seats_for(self.vehicle_type)
 
     def set_initial_seats(self):
         """Set initial seats_available (max seats - 1 for host)."""
@@ -61,29 +142,109 @@ class Ride(models.Model):
         if self.is_female_only and self.host.gender != 'Female':
             raise ValidationError("Only female hosts can create female-only ride groups.")
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Snapshot of the loaded row, keyed by attname, used to find changed fields on save
+        instance._loaded_values = dict(zip(field_names, values))
+        return instance
+
+    def refresh_from_db(self, using=None, fields=None, from_queryset=None):
+        super().refresh_from_db(using=using, fields=fields, from_queryset=from_queryset)
+        self._snapshot(fields)
+
+    def _snapshot(self, fields=None):
+        loaded = getattr(self, '_loaded_values', {})
+        for field in self._meta.concrete_fields:
+            if fields is None or field.name in fields or field.attname in fields:
+                loaded[field.attname] = getattr(self, field.attname)
+        self._loaded_values = loaded
+
+    def get_changed_fields(self):
+        """Return the attnames of concrete fields that differ from the values loaded from the database."""
+        loaded = getattr(self, '_loaded_values', {})
+        return {
+            field.attname for field in self._meta.concrete_fields
+            if field.attname not in loaded or getattr(self, field.attname) != loaded[field.attname]
+        }
+
     def save(self, *args, **kwargs):
-        # Check if this is an update and is_completed has changed to True
-        if self.pk:  # If the instance already exists (update)
-            old_instance = Ride.objects.get(pk=self.pk)
-            if not old_instance.is_completed and self.is_completed:
-                # Ride just completed, delete all chat messages immediately
-                self.chat_messages.all().delete()
+        adding = self._state.adding
 
         # Set seats_available only on creation
-        if not self.pk:
+        if adding:
             self.seats_available = self.set_initial_seats()
 
-        self.full_clean()
-        super().save(*args, **kwargs)
+        self.pickup_cell = grid_cell(self.pickup_latitude, self.pickup_longitude)
+        changed = self.get_changed_fields()
+        completing = not adding and 'is_completed' in changed and self.is_completed
+
+        with transaction.atomic() if completing else nullcontext():
+            if completing:
+                # Ride just completed, delete all chat messages immediately. The row is locked first
+                # and held until the update commits: queued chat writes check the ride is still open
+                # under the same lock (chat.writebehind). Undelivered events go first, so the outbox
+                # dispatcher cannot write their messages back after the purge.
+                list(Ride.objects.select_for_update().filter(pk=self.pk).values_list('pk'))
+                self.events.all().delete()
+                self.chat_messages.all().delete()
+                transaction.on_commit(partial(recent_messages.evict, self.pk))
+
+            if adding:
+                self.full_clean()
+            elif changed:
+                # Only validate what changed; clean() needs the host, so skip it unless it can be affected
+                unchanged = [field.name for field in self._meta.concrete_fields if field.attname not in changed]
+                self.clean_fields(exclude=unchanged)
+                if changed & {'host_id', 'is_female_only'}:
+                    self.clean()
+                if 'ride_code' in changed:
+                    self.validate_unique(exclude=unchanged)
+
+            super().save(*args, **kwargs)
+        self._snapshot(kwargs.get('update_fields'))
 
     def delete(self, *args, **kwargs):
         # Delete all associated chat messages before deleting the ride
         self.chat_messages.all().delete()
+        transaction.on_commit(partial(recent_messages.evict, self.pk))
         super().delete(*args, **kwargs)
 
     def __str__(self):
         return f"{self.vehicle_type} ({self.ride_code}) from {self.pickup_name} to {self.destination_name}"
 
+class RideMembership(models.Model):
+    """A rider (other than the host) on a ride, in join order."""
+    ride = models.ForeignKey(Ride, on_delete=models.CASCADE, related_name='memberships')
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='ride_memberships')
+    joined_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        # Keeps the table Django created for the original auto-generated members relation
+        db_table = 'rides_ride_members'
+        unique_together = ('ride', 'user')
+        indexes = [
+            # Earliest member first, for host hand-over
+            models.Index(fields=['ride', 'joined_at', 'id'], name='ride_membership_order_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.user} on {self.ride}"
+
+
+def member_count_subquery():
+    """Correlated subquery counting a ride's membership rows, for bulk re-syncing Ride.member_count."""
+    counts = (
+        RideMembership.objects
+        .filter(ride=OuterRef('pk'))
+        .order_by()
+        .values('ride')
+        .annotate(total=Count('pk'))
+        .values('total')
+    )
+    return Coalesce(Subquery(counts), 0)
+
+
 class RideRequest(models.Model):
     ride = models.ForeignKey(Ride, on_delete=models.CASCADE, related_name='requests')
     user = models.ForeignKey(User, on_delete=models.CASCADE)
@@ -102,4 +263,43 @@ class RideRequest(models.Model):
         super().save(*args, **kwargs)
 
     def __str__(self):
-        return f"{self.user} requested to join {self.ride}"
\ No newline at end of file
+        return f"{self.user} requested to join {self.ride}"
+
+
+class RideEvent(models.Model):
+    """
+    Outbox row for a system message in a ride's chat (rides.outbox).
+
+    Written in the same transaction as the ride change it announces; the dispatcher turns it into
+    a ChatMessage, deletes it and broadcasts the message to the ride's WebSocket group.
+    """
+    ride = models.ForeignKey(Ride, on_delete=models.CASCADE, related_name='events')
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='+')
+    text = models.TextField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"Event for {self.ride}: {self.text[:20]}"
+
+
+@receiver(m2m_changed, sender=Ride.members.through)
+def sync_member_count(sender, instance, action, reverse, pk_set, **kwargs):
+    """
+    Keep Ride.member_count right when members are changed through the related manager
+    (admin, ride.members.add/remove). The join and leave services update it themselves.
+    """
+    if reverse:
+        if action == 'pre_clear':
+            instance._cleared_ride_ids = list(instance.ride_members.values_list('pk', flat=True))
+            return
+        if action == 'post_clear':
+            ride_ids = instance.__dict__.pop('_cleared_ride_ids', [])
+        elif action in ('post_add', 'post_remove'):
+            ride_ids = pk_set
+        else:
+            return
+    elif action in ('post_add', 'post_remove', 'post_clear'):
+        ride_ids = [instance.pk]
+    else:
+        return
+    Ride.objects.filter(pk__in=ride_ids).update(member_count=member_count_subquery())
@@ -0,0 +1,228 @@
+"""
+Ride-event outbox for the system messages posted to a ride's chat.
+
+Views record a RideEvent inside the transaction that changes the ride, so the message exists if and
+only if the change was committed. The dispatcher, an asyncio task on the ASGI server's event loop
+or, under WSGI, on its own loop in a daemon thread (RideShare.background), claims pending events in batches, writes their ChatMessages, deletes the events and then
+broadcasts to the ride's WebSocket group. It also sends the membership_changed notices that make
+chat connections re-check membership. None of that work happens on the request path.
+"""
+import asyncio
+import logging
+import threading
+from collections import deque
+from functools import partial
+
+from asgiref.sync import async_to_sync
+from channels.db import database_sync_to_async
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.db import transaction
+
+from chat.cache import recent_messages
+from chat.models import ChatMessage
+from chat.wire import wire_message
+from .models import RideEvent
+
+logger = logging.getLogger(__name__)
+
+# Membership notices waiting for the dispatcher; past this the oldest are dropped
+MAX_PENDING_NOTICES = 10_000
+
+
+def record_ride_event(ride, user, text):
+    """Queue a system message for ride's chat. Call inside the transaction that changes the ride."""
+    event = RideEvent.objects.create(ride=ride, user=user, text=text)
+    transaction.on_commit(dispatcher.wake)
+    return event
+
+
+def claim_events(batch_size=100):
+    """
+    Turn up to batch_size pending events into chat messages and delete them, oldest first.
+    Returns [(ride_id, message), ...], messages in the chat.wire format, to broadcast once the
+    transaction has committed.
+    """
+    with transaction.atomic():
+        # Events another dispatcher is working on are skipped, not waited for
+        events = list(
+            RideEvent.objects.select_for_update(skip_locked=True)
+            .order_by('id')
+            .values_list('id', 'ride_id', 'user_id', 'text', 'created_at')[:batch_size]
+        )
+        if not events:
+            return []
+        messages = ChatMessage.objects.bulk_create([
+            ChatMessage(ride_id=ride_id, user_id=user_id, text=text, kind=ChatMessage.Kind.SYSTEM, timestamp=created_at)
+            for _, ride_id, user_id, text, created_at in events
+        ])
+        RideEvent.objects.filter(id__in=[event_id for event_id, *_ in events]).delete()
+
+    claimed = []
+    for message in messages:
+        message_data = wire_message(message.user_id, message.text, message.kind, message.timestamp)
+        recent_messages.append(message.ride_id, message.id, message.timestamp, message_data)
+        claimed.append((message.ride_id, message_data))
+    return claimed
+
+
+async def broadcast(channel_layer, ride_id, message_data):
+    await channel_layer.group_send(
+        f"chat_ride_{ride_id}",
+        {
+            "type": "chat_message",
+            "message_data": message_data,
+        }
+    )
+
+
+def notify_membership_changed(ride_id, user_id=None):
+    """
+    Tell the ride's chat connections, once the current transaction commits, that user_id left the
+    ride, or with user_id=None that the ride itself changed (completed or deleted). Connections
+    cache their membership and re-check it only when told to. This is a hint, not an outbox event:
+    a lost notification only delays the disconnect until the connection re-checks. The dispatcher
+    sends it, so the request does not wait on the channel layer.
+    """
+    transaction.on_commit(partial(dispatcher.notify, ride_id, user_id))
+
+
+async def send_membership_changed(channel_layer, ride_id, user_id):
+    await channel_layer.group_send(
+        f"chat_ride_{ride_id}",
+        {
+            "type": "membership_changed",
+            "user_id": user_id,
+        }
+    )
+
+
+def dispatch_pending(batch_size=100):
+    """
+    Deliver every pending event, and this process's queued membership notices, from synchronous
+    code. Returns how many events were delivered.
+    """
+    channel_layer = get_channel_layer()
+    notices = dispatcher.take_notices()
+    delivered = 0
+    while True:
+        claimed = claim_events(batch_size)
+        for ride_id, message_data in claimed:
+            async_to_sync(broadcast)(channel_layer, ride_id, message_data)
+        delivered += len(claimed)
+        if len(claimed) < batch_size:
+            break
+    for notice in notices:
+        async_to_sync(send_membership_changed)(channel_layer, *notice)
+    return delivered
+
+
+class RideEventDispatcher:
+    """
+    Delivers outbox events from a task on the ASGI event loop, so broadcasts go through the same
+    loop as the consumers, or from a thread of its own where there is no such loop. It wakes when a transaction with events commits and also polls every
+    poll_interval seconds to pick up events committed by other processes.
+    """
+
+    def __init__(self, batch_size=100, poll_interval=1.0):
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self.loop = None
+        self._task = None
+        self._wakeup = None
+        self._notices = deque(maxlen=MAX_PENDING_NOTICES)
+        self._thread = None
+        self._thread_lock = threading.Lock()
+
+    def start(self):
+        """Start the dispatcher on the running event loop if it is not already running there."""
+        loop = asyncio.get_running_loop()
+        if self._task is not None and not self._task.done() and self.loop is loop:
+            return
+        self.loop = loop
+        self._wakeup = asyncio.Event()
+        self._task = loop.create_task(self.run())
+
+    def start_thread(self):
+        """Run the dispatcher on an event loop of its own in a daemon thread, for WSGI servers."""
+        with self._thread_lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(
+                    target=asyncio.run, args=(self._run_in_thread(),), name='ride-event-dispatcher', daemon=True
+                )
+                self._thread.start()
+            return self._thread
+
+    async def _run_in_thread(self):
+        self.start()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+
+    def stop(self):
+        """Cancel the dispatcher task. Safe to call from any thread."""
+        loop, task = self.loop, self._task
+        if task is not None and not loop.is_closed():
+            loop.call_soon_threadsafe(task.cancel)
+
+    def wake(self):
+        """Ask the dispatcher to look for events now. Safe to call from any thread."""
+        loop = self.loop
+        if loop is not None and not loop.is_closed():
+            loop.call_soon_threadsafe(self._wakeup.set)
+
+    def notify(self, ride_id, user_id=None):
+        """Queue a membership_changed notice for the ride's chat connections. Safe to call from any thread."""
+        self._notices.append((ride_id, user_id))
+        self.wake()
+
+    def take_notices(self):
+        """
+        Remove and return the queued notices. Take them before claiming events: a notice is queued
+        once its transaction commits, so the claim that follows sees that transaction's events, and
+        a ride's last system message ("completed") goes out before the notice that closes its chat.
+        """
+        notices = []
+        while self._notices:
+            notices.append(self._notices.popleft())
+        return notices
+
+    async def run(self):
+        channel_layer = get_channel_layer()
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            notices = self.take_notices()
+            try:
+                while True:
+                    claimed = await database_sync_to_async(claim_events)(self.batch_size)
+                    for ride_id, message_data in claimed:
+                        await broadcast(channel_layer, ride_id, message_data)
+                    if len(claimed) < self.batch_size:
+                        break
+            except Exception:
+                logger.exception("Ride event dispatch failed")
+            try:
+                for notice in notices:
+                    await send_membership_changed(channel_layer, *notice)
+            except Exception:
+                logger.exception("Membership notice failed")
+
+
+dispatcher = RideEventDispatcher()
+
+
+class RideEventDispatcherMiddleware:
+    """ASGI middleware that starts the dispatcher on the server's event loop with the first connection."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if settings.RIDE_EVENT_DISPATCHER:
+            dispatcher.start()
+        return await self.app(scope, receive, send)
@@ -0,0 +1,81 @@
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+from RideShare.cursors import InvalidCursor, decode_cursor, encode_cursor
+
+
+class RideCursorPagination(BasePagination):
+    """
+    Keyset pagination over (departure_time, id), newest departure first, matching Ride.Meta.ordering.
+
+    The next page is selected with a range condition on the last row of the current page instead
+    of an OFFSET, so every page is an index range scan on (departure_time, id). Cursors are the
+    opaque tokens of RideShare.cursors. Pagination is opt-in: it applies only when the request sends ``cursor`` or
+    ``page_size``, so clients that expect a plain list keep working.
+    """
+    cursor_query_param = 'cursor'
+    page_size_query_param = 'page_size'
+    page_size = 20
+    max_page_size = 100
+    invalid_cursor_message = 'Invalid cursor'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        params = request.query_params
+        if self.cursor_query_param not in params and self.page_size_query_param not in params:
+            return None
+
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        queryset = queryset.order_by('-departure_time', '-id')
+        cursor = params.get(self.cursor_query_param)
+        if cursor:
+            departure_time, ride_id = self.decode_cursor(cursor)
+            queryset = queryset.filter(
+                Q(departure_time__lt=departure_time) | Q(departure_time=departure_time, id__lt=ride_id)
+            )
+
+        # One extra row tells us whether there is a next page without a COUNT
+        rows = list(queryset[:self.page_size + 1])
+        self.has_next = len(rows) > self.page_size
+        self.page = rows[:self.page_size]
+        return self.page
+
+    def get_page_size(self, request):
+        try:
+            size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        return max(1, min(size, self.max_page_size))
+
+    def get_next_cursor(self):
+        if not self.has_next:
+            return None
+        last = self.page[-1]
+        return self.encode_cursor(last.departure_time, last.id)
+
+    def get_next_link(self):
+        cursor = self.get_next_cursor()
+        if cursor is None:
+            return None
+        url = self.request.build_absolute_uri()
+        url = replace_query_param(url, self.page_size_query_param, self.page_size)
+        return replace_query_param(url, self.cursor_query_param, cursor)
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next': self.get_next_link(),
+            'next_cursor': self.get_next_cursor(),
+            'results': data,
+        })
+
+    def encode_cursor(self, departure_time, ride_id):
+        return encode_cursor(departure_time, ride_id)
+
+    def decode_cursor(self, cursor):
+        try:
+            return decode_cursor(cursor)
+        except InvalidCursor:
+            raise NotFound(self.invalid_cursor_message)
@@ -0,0 +1,247 @@
+"""
+Offline road-network distances, for SOS alerts and ride matching.
+
+A road graph is built once from a local extract (``manage.py build_road_graph``) into a single
+binary file of NumPy arrays, which is memory-mapped when opened, so processes share its pages and
+start without parsing anything:
+
+* node coordinates, with nodes sorted by snap cell (a lat/lng grid like rides.geo's, but finer) and
+  a cell index next to them, so points snap to their nearest node with a few binary searches;
+* forward and reverse adjacency in CSR form (offsets, neighbour ids, lengths in metres), the
+  reverse half answering "distance from many points to this one".
+
+A query runs one Dijkstra search from the origin's node, bounded by a maximum distance and
+stopped as soon as every target node is settled. For one-to-many that settles each node once,
+which is cheaper than one bidirectional search per target.
+"""
+import heapq
+import json
+import logging
+import math
+import mmap
+import os
+from functools import lru_cache
+
+import numpy as np
+from django.conf import settings
+
+from .matching import haversine_km_many
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b'RSROADS1'
+# Snap cells of 0.002 degrees (~220 m): points farther than a cell from every node are off the graph
+DEFAULT_SNAP_CELL_DEGREES = 0.002
+ARRAYS = {
+    'lat': np.float64,
+    'lng': np.float64,
+    'cells': np.int64,  # Sorted distinct grid cells that hold nodes
+    'cell_start': np.int32,  # Nodes of cells[i] are cell_start[i]:cell_start[i + 1]
+    'offsets': np.int64,
+    'heads': np.int32,
+    'lengths': np.float32,
+    'reverse_offsets': np.int64,
+    'reverse_heads': np.int32,
+    'reverse_lengths': np.float32,
+}
+
+
+class RoadGraph:
+    def __init__(self, arrays, snap_cell_degrees=DEFAULT_SNAP_CELL_DEGREES):
+        for name in ARRAYS:
+            setattr(self, name, arrays[name])
+        self.snap_cell_degrees = snap_cell_degrees
+
+    def __len__(self):
+        return len(self.lat)
+
+    @property
+    def edge_count(self):
+        return len(self.heads)
+
+    @classmethod
+    def from_edges(cls, lats, lngs, sources, targets, lengths_m=None,
+                   snap_cell_degrees=DEFAULT_SNAP_CELL_DEGREES):
+        """
+        Build a graph from node coordinates and directed edges (indices into lats/lngs). Edge
+        lengths default to the straight-line distance between their ends.
+        """
+        lats, lngs = np.asarray(lats, dtype=np.float64), np.asarray(lngs, dtype=np.float64)
+        sources, targets = np.asarray(sources, dtype=np.int64), np.asarray(targets, dtype=np.int64)
+        if lengths_m is None:
+            lengths_m = haversine_km_many(lats[sources], lngs[sources], lats[targets], lngs[targets]) * 1000
+        lengths_m = np.asarray(lengths_m, dtype=np.float32)
+
+        # Renumber nodes in cell order, so each cell's nodes are one contiguous range
+        node_cells = snap_cells(lats, lngs, snap_cell_degrees)
+        order = np.argsort(node_cells, kind='stable')
+        new_id = np.empty_like(order)
+        new_id[order] = np.arange(len(order))
+        cells, cell_start = np.unique(node_cells[order], return_index=True)
+        sources, targets = new_id[sources], new_id[targets]
+
+        arrays = {
+            'lat': lats[order], 'lng': lngs[order], 'cells': cells,
+            'cell_start': np.append(cell_start, len(order)).astype(np.int32),
+        }
+        for prefix, tails, heads in (('', sources, targets), ('reverse_', targets, sources)):
+            by_tail = np.argsort(tails, kind='stable')
+            degrees = np.bincount(tails, minlength=len(order))
+            arrays[prefix + 'offsets'] = np.concatenate(([0], np.cumsum(degrees)))
+            arrays[prefix + 'heads'] = heads[by_tail].astype(np.int32)
+            arrays[prefix + 'lengths'] = lengths_m[by_tail]
+        return cls(arrays, snap_cell_degrees)
+
+    def save(self, path):
+        """
+        Write the graph as one file: magic, JSON header, then 8-byte aligned arrays. The file is
+        replaced in one step, so processes that have the old one mapped keep reading it intact.
+        """
+        header, position = {'snap_cell_degrees': self.snap_cell_degrees, 'arrays': {}}, 0
+        for name, dtype in ARRAYS.items():
+            array = np.ascontiguousarray(getattr(self, name), dtype=dtype)
+            header['arrays'][name] = [position, len(array)]
+            position += -(-array.nbytes // 8) * 8
+        encoded = json.dumps(header).encode()
+        data_start = -(-(len(MAGIC) + 4 + len(encoded)) // 8) * 8
+        with open(f'{path}.tmp', 'wb') as f:
+            f.write(MAGIC + len(encoded).to_bytes(4, 'little') + encoded)
+            for name, dtype in ARRAYS.items():
+                offset, _ = header['arrays'][name]
+                f.seek(data_start + offset)
+                f.write(np.ascontiguousarray(getattr(self, name), dtype=dtype).tobytes())
+        os.replace(f'{path}.tmp', path)
+
+    @classmethod
+    def open(cls, path):
+        """Memory-map a graph written by save(); pages are read from the file as they are used."""
+        with open(path, 'rb') as f:
+            if f.read(len(MAGIC)) != MAGIC:
+                raise ValueError(f"{path} is not a road graph file")
+            header = json.loads(f.read(int.from_bytes(f.read(4), 'little')))
+            data_start = -(-f.tell() // 8) * 8
+            # Plain read-only arrays over the mapping; np.memmap slices are much slower to make
+            buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        arrays = {
+            name: np.frombuffer(buffer, dtype=dtype, count=header['arrays'][name][1],
+                                offset=data_start + header['arrays'][name][0])
+            for name, dtype in ARRAYS.items()
+        }
+        return cls(arrays, header['snap_cell_degrees'])
+
+    def snap(self, lats, lngs):
+        """
+        Nearest node to each point, searching the point's snap cell and the eight around it.
+        Returns (nodes, offsets_km); nodes is -1 where no node is that close.
+        """
+        lats = np.atleast_1d(np.asarray(lats, dtype=np.float64))
+        lngs = np.atleast_1d(np.asarray(lngs, dtype=np.float64))
+        nodes = np.full(len(lats), -1, dtype=np.int64)
+        offsets_km = np.full(len(lats), np.nan)
+        if not len(self.cells):
+            return nodes, offsets_km
+        columns = int(round(360 / self.snap_cell_degrees))
+        cells = snap_cells(lats, lngs, self.snap_cell_degrees)
+        rows, cols = np.divmod(cells, columns)
+        neighbours = np.array([-1, 0, 1])
+        cell_ids = (
+            (rows[:, None, None] + neighbours[None, :, None]) * columns
+            + (cols[:, None, None] + neighbours[None, None, :]) % columns
+        ).reshape(len(lats), 9)
+
+        # Node ranges of every neighbouring cell, flattened into one candidate list per point
+        position = np.searchsorted(self.cells, cell_ids).clip(max=len(self.cells) - 1)
+        found = self.cells[position] == cell_ids
+        start = np.where(found, self.cell_start[position], 0)
+        count = np.where(found, self.cell_start[position + 1] - start, 0).ravel()
+        owner = np.repeat(np.repeat(np.arange(len(lats)), 9), count)
+        first = np.cumsum(count) - count
+        candidates = np.repeat(start.ravel() - first, count) + np.arange(count.sum())
+
+        if len(candidates):
+            distances = haversine_km_many(lats[owner], lngs[owner], self.lat[candidates], self.lng[candidates])
+            best = np.lexsort((distances, owner))
+            first_of_owner = best[np.r_[True, owner[best][1:] != owner[best][:-1]]]
+            nodes[owner[first_of_owner]] = candidates[first_of_owner]
+            offsets_km[owner[first_of_owner]] = distances[first_of_owner]
+        return nodes, offsets_km
+
+    def distances_from(self, lat, lng, lats, lngs, max_km=math.inf):
+        """
+        Road distance in km from (lat, lng) to each point, including the straight legs to and from
+        the nearest nodes. inf when farther than max_km by road; nan when a point (or the origin)
+        is off the graph, so callers can fall back to straight-line distance.
+        """
+        return self._one_to_many(lat, lng, lats, lngs, max_km, self.offsets, self.heads, self.lengths)
+
+    def distances_to(self, lat, lng, lats, lngs, max_km=math.inf):
+        """Like distances_from, for travel from each point to (lat, lng), over the reverse graph."""
+        return self._one_to_many(lat, lng, lats, lngs, max_km,
+                                 self.reverse_offsets, self.reverse_heads, self.reverse_lengths)
+
+    def _one_to_many(self, lat, lng, lats, lngs, max_km, offsets, heads, lengths):
+        nodes, offsets_km = self.snap(np.append(lats, lat), np.append(lngs, lng))
+        source, source_km = nodes[-1], offsets_km[-1]
+        nodes, offsets_km = nodes[:-1], offsets_km[:-1]
+        result = np.full(len(nodes), np.nan)
+        if source < 0:
+            return result
+
+        on_graph = nodes >= 0
+        limit_m = (max_km - source_km) * 1000
+        settled = dijkstra(offsets, heads, lengths, int(source), set(nodes[on_graph].tolist()), limit_m)
+        road_m = np.array([settled.get(node, math.inf) for node in nodes[on_graph].tolist()])
+        result[on_graph] = source_km + road_m / 1000 + offsets_km[on_graph]
+        result[on_graph & (result > max_km)] = math.inf
+        return result
+
+
+def snap_cells(lats, lngs, cell_degrees):
+    """Snap cell ids of arrays of points, numbered like rides.geo.grid_cell."""
+    rows = np.floor((np.minimum(lats, 90.0 - 1e-9) + 90.0) / cell_degrees).astype(np.int64)
+    cols = np.floor(((lngs + 180.0) % 360.0) / cell_degrees).astype(np.int64)
+    return rows * int(round(360 / cell_degrees)) + cols
+
+
+def dijkstra(offsets, heads, lengths, source, targets, limit_m=math.inf):
+    """
+    Shortest distances in metres from source over a CSR graph, stopping once every target is
+    settled or nothing closer than limit_m is left. Returns {node: distance} of settled nodes.
+    """
+    remaining = set(targets)
+    settled = {}
+    best = {source: 0.0}
+    heap = [(0.0, source)]
+    while heap and remaining:
+        distance, node = heapq.heappop(heap)
+        if node in settled:
+            continue
+        settled[node] = distance
+        remaining.discard(node)
+        start, end = offsets[node:node + 2].tolist()
+        for head, length in zip(heads[start:end].tolist(), lengths[start:end].tolist()):
+            candidate = distance + length
+            if candidate <= limit_m and candidate < best.get(head, math.inf):
+                best[head] = candidate
+                heapq.heappush(heap, (candidate, head))
+    return settled
+
+
+@lru_cache(maxsize=None)
+def open_road_graph(path):
+    """
+    Open a graph once per process. A missing or broken file is logged (once, as the result is
+    cached) and gives None, so callers fall back to straight-line distance instead of failing.
+    """
+    try:
+        return RoadGraph.open(path)
+    except (OSError, ValueError, KeyError) as e:
+        logger.error(f"Road graph {path} could not be opened, using straight-line distance: {e}")
+        return None
+
+
+def road_graph():
+    """The graph at settings.ROAD_GRAPH_PATH, opened once per process, or None if none is usable."""
+    path = settings.ROAD_GRAPH_PATH
+    return open_road_graph(path) if path else None
+
@@ -18,7 +18,7 @@ class RideSerializer(serializers.ModelSerializer):
         read_only_fields = ['id', 'host', 'created_at', 'ride_code', 'is_completed', 'seats_available']
 
     def get_per_person_fare(self, obj):
-        total_members = obj.members.count() + 1  # Host + joined members
+        total_members = obj.member_count + 1  # Host + joined members
         return float(obj.total_fare / total_members) if total_members > 0 else float(obj.total_fare)
 
     def get_members(self, obj):
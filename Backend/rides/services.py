@@ -0,0 +1,84 @@
+from django.db import IntegrityError, transaction
+from django.db.models import F
+
+from .models import Ride, RideMembership, RideRequest
+
+
+class RideJoinError(Exception):
+    """A rider cannot join a ride. The message is meant for the client."""
+
+
+def join_ride(ride, user, full_message="This ride is full."):
+    """
+    Add user to ride as an approved member.
+
+    The seat is reserved with a single conditional UPDATE (seats_available > 0), so two riders
+    racing for the last seat cannot both get it; the approved RideRequest and the membership row
+    are written in the same short transaction and roll back together with the seat if anything fails.
+    """
+    if ride.is_completed:
+        raise RideJoinError("This ride is already completed.")
+    if ride.host_id == user.id or ride.members.filter(id=user.id).exists():
+        raise RideJoinError("You are already a member of this ride.")
+    if ride.is_female_only and user.gender != 'Female':
+        raise RideJoinError("Only female users can join female-only ride groups.")
+
+    with transaction.atomic():
+        reserved = Ride.objects.filter(
+            pk=ride.pk, is_completed=False, seats_available__gt=0
+        ).update(seats_available=F('seats_available') - 1, member_count=F('member_count') + 1)
+        if not reserved:
+            raise RideJoinError(full_message)
+        try:
+            # Eligibility was checked above, so the row is inserted without RideRequest.save()'s
+            # full_clean and its SELECT; only the unique (ride, user) constraint can fail
+            RideRequest.objects.bulk_create([RideRequest(ride=ride, user=user, is_approved=True)])
+        except IntegrityError:
+            raise RideJoinError("You have already requested to join this ride.")
+        RideMembership.objects.create(ride=ride, user=user)
+
+    ride.refresh_from_db(fields=['seats_available', 'member_count'])
+    return ride
+
+
+def leave_ride(ride, user):
+    """Remove a member (not the host) from a ride and give their seat back. Returns False if they were not a member."""
+    with transaction.atomic():
+        removed, _ = RideMembership.objects.filter(ride=ride, user=user).delete()
+        if not removed:
+            return False
+        Ride.objects.filter(pk=ride.pk).update(
+            seats_available=F('seats_available') + 1, member_count=F('member_count') - 1
+        )
+        RideRequest.objects.filter(ride=ride, user=user).delete()
+    ride.refresh_from_db(fields=['seats_available', 'member_count'])
+    return True
+
+
+def hand_over_host(ride):
+    """
+    The host leaves: the earliest member becomes host and the old host's seat is freed.
+    Returns the new host, or None if the ride has no members.
+
+    The membership row is locked and only counts once this call has deleted it: if that member
+    left at the same moment, their row is already gone and the next member is tried instead.
+    """
+    with transaction.atomic():
+        while True:
+            earliest = (
+                RideMembership.objects.filter(ride=ride)
+                .select_related('user')
+                .select_for_update(of=('self',))
+                .order_by('joined_at', 'id')
+                .first()
+            )
+            if earliest is None:
+                return None
+            deleted, _ = earliest.delete()
+            if deleted:
+                break
+        Ride.objects.filter(pk=ride.pk).update(
+            host=earliest.user, seats_available=F('seats_available') + 1, member_count=F('member_count') - 1
+        )
+    ride.refresh_from_db(fields=['host', 'seats_available', 'member_count'])
+    return earliest.user
@@ -1,3 +1,645 @@
-from django.test import TestCase
+import math
+import os
+import tempfile
+import time
+from datetime import timedelta
+from io import StringIO
+from unittest import skipUnless
+from unittest.mock import patch
+from rest_framework.test import APITestCase, APIClient
+from rest_framework import status
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.core.exceptions import ValidationError
+from django.core.management import call_command
+from django.db import connection, transaction
+from django.test import TransactionTestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from users.models import User
+from .models import Ride, RideEvent, RideMembership, RideRequest
+from .geo import haversine_km, grid_cell
+from .matching import RideCandidates, candidate_rides, match_rides
+from .roads import RoadGraph
+from .services import hand_over_host, join_ride, leave_ride, RideJoinError
+from .expiry import expire_stale_rides, EXPIRY_MESSAGE
+from .outbox import dispatch_pending, dispatcher, record_ride_event
+from chat.models import ChatMessage
+from chat.wire import wire_message
 
-# Create your tests here.
+# Reference point: North South University, Dhaka
+NSU_LAT, NSU_LNG = 23.8151, 90.4255
+
+
+def make_user(index, gender='Male'):
+    return User.objects.create_user(
+        email=f'rider{index}@northsouth.edu',
+        first_name='Rider',
+        last_name=str(index),
+        gender=gender,
+        student_id=f'2000{index}',
+    )
+
+
+def make_ride(host, lat=NSU_LAT, lng=NSU_LNG, **kwargs):
+    fields = {
+        'vehicle_type': 'CNG',
+        'pickup_name': 'NSU',
+        'destination_name': 'Gulshan',
+        'departure_time': timezone.now() + timedelta(hours=1),
+        'total_fare': 300,
+        'pickup_latitude': lat,
+        'pickup_longitude': lng,
+    }
+    fields.update(kwargs)
+    return Ride.objects.create(host=host, **fields)
+
+
+class GeoTests(APITestCase):
+    def test_haversine_known_distance(self):
+        # NSU to Shahjalal airport is about 4.2 km as the crow flies
+        self.assertAlmostEqual(haversine_km(NSU_LAT, NSU_LNG, 23.8433, 90.3978), 4.2, delta=0.3)
+
+    def test_grid_cell_requires_both_coordinates(self):
+        self.assertIsNone(grid_cell(None, NSU_LNG))
+        self.assertIsNotNone(grid_cell(NSU_LAT, NSU_LNG))
+
+    def test_ride_save_sets_pickup_cell(self):
+        ride = make_ride(make_user(1))
+        self.assertEqual(ride.pickup_cell, grid_cell(NSU_LAT, NSU_LNG))
+
+
+class ProximityListRidesTests(APITestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.rider = make_user(0)
+        self.client.force_authenticate(user=self.rider)
+
+        self.near = make_ride(make_user(1), lat=NSU_LAT + 0.01, lng=NSU_LNG)  # ~1.1 km north
+        self.nearer = make_ride(make_user(2), lat=NSU_LAT, lng=NSU_LNG + 0.005)  # ~0.5 km east
+        self.far = make_ride(make_user(3), lat=22.3569, lng=91.7832)  # Chattogram
+        self.no_location = make_ride(make_user(4), lat=None, lng=None)
+
+    def list_rides(self, **params):
+        return self.client.get(reverse('list_rides'), params)
+
+    def test_without_location_lists_every_open_ride(self):
+        response = self.list_rides()
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data), 4)
+
+    def test_proximity_search_returns_nearby_rides_closest_first(self):
+        response = self.list_rides(lat=NSU_LAT, lng=NSU_LNG, radius_km=2)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([ride['id'] for ride in response.data], [self.nearer.id, self.near.id])
+        self.assertLess(response.data[0]['distance_km'], response.data[1]['distance_km'])
+
+    def test_proximity_search_excludes_completed_rides(self):
+        self.nearer.is_completed = True
+        self.nearer.save()
+        response = self.list_rides(lat=NSU_LAT, lng=NSU_LNG, radius_km=2)
+        self.assertEqual([ride['id'] for ride in response.data], [self.near.id])
+
+    def test_proximity_search_rejects_bad_parameters(self):
+        self.assertEqual(self.list_rides(lat='abc', lng=NSU_LNG).status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.list_rides(lat=NSU_LAT).status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.list_rides(lat=NSU_LAT, lng=NSU_LNG, radius_km=500).status_code,
+                         status.HTTP_400_BAD_REQUEST)
+
+
+class MatchRidesTests(APITestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.rider = make_user(0, gender='Female')
+        self.client.force_authenticate(user=self.rider)
+        # Rider goes from NSU to Gulshan 2
+        self.params = {
+            'origin_lat': NSU_LAT, 'origin_lng': NSU_LNG,
+            'destination_lat': 23.7925, 'destination_lng': 90.4078,
+        }
+
+        self.good = make_ride(make_user(1), destination_latitude=23.7930, destination_longitude=90.4080)
+        self.wrong_way = make_ride(make_user(2), destination_latitude=23.7104, destination_longitude=90.4074)
+        self.later = make_ride(make_user(3), destination_latitude=23.7930, destination_longitude=90.4080,
+                               departure_time=timezone.now() + timedelta(hours=1, minutes=50))
+        self.female_only = make_ride(make_user(4, gender='Female'), is_female_only=True,
+                                     destination_latitude=23.7926, destination_longitude=90.4079)
+
+    def test_ranks_rides_going_the_same_way(self):
+        response = self.client.get(reverse('match_rides'), self.params)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        ids = [ride['id'] for ride in response.data]
+        self.assertNotIn(self.wrong_way.id, ids)
+        self.assertEqual(set(ids), {self.good.id, self.later.id, self.female_only.id})
+        self.assertLess(ids.index(self.good.id), ids.index(self.later.id))
+        scores = [ride['match_score'] for ride in response.data]
+        self.assertEqual(scores, sorted(scores, reverse=True))
+
+    def test_female_only_rides_hidden_from_male_riders(self):
+        self.client.force_authenticate(user=make_user(5, gender='Male'))
+        response = self.client.get(reverse('match_rides'), self.params)
+        self.assertNotIn(self.female_only.id, [ride['id'] for ride in response.data])
+
+    def test_limit_and_departure_window(self):
+        params = dict(self.params, limit=1)
+        response = self.client.get(reverse('match_rides'), params)
+        self.assertEqual(len(response.data), 1)
+
+        window_end = (timezone.now() + timedelta(hours=1, minutes=30)).isoformat()
+        response = self.client.get(reverse('match_rides'), dict(self.params, departure_before=window_end))
+        self.assertNotIn(self.later.id, [ride['id'] for ride in response.data])
+
+    def test_missing_destination(self):
+        params = dict(self.params)
+        del params['destination_lat']
+        response = self.client.get(reverse('match_rides'), params)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class RoadGraphTests(APITestCase):
+    def setUp(self):
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        self.path = os.path.join(tmp_dir.name, 'roads.graph')
+        # NSU -> B (1 km east) both ways, B -> C (1 km north of B) one way, and D with no streets
+        self.b = (NSU_LAT, NSU_LNG + 0.0098)
+        self.c = (NSU_LAT + 0.009, NSU_LNG + 0.0098)
+        self.d = (NSU_LAT - 0.0045, NSU_LNG)
+        lats, lngs = zip((NSU_LAT, NSU_LNG), self.b, self.c, self.d)
+        RoadGraph.from_edges(lats, lngs, [0, 1, 1], [1, 0, 2], [1200, 1200, 1000]).save(self.path)
+        self.graph = RoadGraph.open(self.path)
+
+    def distances(self, method, *points, **kwargs):
+        lats, lngs = zip(*points)
+        return method(NSU_LAT, NSU_LNG, lats, lngs, **kwargs).tolist()
+
+    def test_one_to_many_follows_streets(self):
+        off_graph = (NSU_LAT + 0.05, NSU_LNG)
+        distances = self.distances(self.graph.distances_from, self.b, self.c, self.d, off_graph)
+        self.assertAlmostEqual(distances[0], 1.2, places=5)
+        self.assertAlmostEqual(distances[1], 2.2, places=5)
+        self.assertEqual(distances[2], math.inf)
+        self.assertTrue(math.isnan(distances[3]))
+
+    def test_one_way_streets_and_limit(self):
+        # C cannot get back to NSU, and is out of reach within 2 km
+        distances = self.distances(self.graph.distances_to, self.b, self.c)
+        self.assertAlmostEqual(distances[0], 1.2, places=5)
+        self.assertEqual(distances[1], math.inf)
+        self.assertEqual(self.distances(self.graph.distances_from, self.c, max_km=2), [math.inf])
+
+    def test_snap_adds_straight_legs(self):
+        near_b = (self.b[0] + 0.0005, self.b[1])
+        distance, = self.distances(self.graph.distances_from, near_b)
+        self.assertAlmostEqual(distance, 1.2 + haversine_km(*self.b, *near_b), places=5)
+
+    def test_build_command_reads_csv(self):
+        directory = os.path.dirname(self.path)
+        path = os.path.join(directory, 'built.graph')
+        with open(os.path.join(directory, 'nodes.csv'), 'w') as f:
+            f.write(f"id,lat,lng\nnsu,{NSU_LAT},{NSU_LNG}\nb,{self.b[0]},{self.b[1]}\nc,{self.c[0]},{self.c[1]}\n")
+        with open(os.path.join(directory, 'edges.csv'), 'w') as f:
+            f.write("from,to,length_m,oneway\nnsu,b,1200,\nb,c,1000,yes\n")
+        call_command('build_road_graph', os.path.join(directory, 'nodes.csv'), os.path.join(directory, 'edges.csv'),
+                     path, stdout=StringIO())
+
+        graph = RoadGraph.open(path)
+        self.assertEqual((len(graph), graph.edge_count), (3, 3))
+        self.assertEqual(self.distances(graph.distances_from, self.c),
+                         self.distances(self.graph.distances_from, self.c))
+
+    def test_match_rides_uses_road_pickup_distance(self):
+        rider = make_user(0)
+        gulshan = {'destination_latitude': 23.7930, 'destination_longitude': 90.4080}
+        reachable = make_ride(make_user(1), *self.b, **gulshan)
+        # 900 m away in a straight line but nowhere near a street: straight-line distance stands
+        off_graph = make_ride(make_user(2), NSU_LAT - 0.008, NSU_LNG, **gulshan)
+        # 2.2 km by road, over a 2 km pickup limit that the 1.3 km straight line would pass
+        round_the_block = make_ride(make_user(3), *self.c, **gulshan)
+        trip = ((NSU_LAT, NSU_LNG), (23.7925, 90.4078), timezone.now(), timezone.now() + timedelta(hours=2))
+
+        with self.settings(ROAD_GRAPH_PATH=self.path):
+            matches = {match['ride'].id: match['pickup_km'] for match in match_rides(rider, *trip, max_pickup_km=2)}
+        self.assertEqual(set(matches), {reachable.id, off_graph.id})
+        self.assertAlmostEqual(matches[reachable.id], 1.2, places=5)
+
+        matches = {match['ride'].id for match in match_rides(rider, *trip, max_pickup_km=2)}
+        self.assertEqual(matches, {reachable.id, off_graph.id, round_the_block.id})
+
+        # A broken or missing graph file is a config error, not a reason to fail the request
+        broken = os.path.join(os.path.dirname(self.path), 'broken.graph')
+        with open(broken, 'wb') as f:
+            f.write(b'RSROADS1garbage')
+        for path in (broken, broken + '.missing'):
+            with self.settings(ROAD_GRAPH_PATH=path), self.assertLogs('rides.roads', 'ERROR'):
+                matches = {match['ride'].id for match in match_rides(rider, *trip, max_pickup_km=2)}
+            self.assertEqual(matches, {reachable.id, off_graph.id, round_the_block.id})
+
+
+class RideListQueryCountTests(APITestCase):
+    """Serializing a list of rides must cost the same number of queries however long the list is."""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.rider = make_user(0)
+        self.client.force_authenticate(user=self.rider)
+        self.next_index = 1
+
+    def add_rides(self, count, completed=False):
+        for _ in range(count):
+            host = make_user(self.next_index)
+            member = make_user(self.next_index + 1)
+            self.next_index += 2
+            ride = make_ride(host)
+            ride.members.add(member, self.rider)
+            if completed:
+                ride.is_completed = True
+                ride.save()
+
+    def count_queries(self, url_name, **params):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(reverse(url_name), params)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return len(context.captured_queries), response
+
+    def assert_constant_queries(self, url_name, completed=False, **params):
+        self.add_rides(2, completed=completed)
+        small, response = self.count_queries(url_name, **params)
+        self.assertEqual(len(response.data), 2)
+        self.add_rides(8, completed=completed)
+        large, response = self.count_queries(url_name, **params)
+        self.assertEqual(len(response.data), 10)
+        self.assertEqual(small, large)
+        return large
+
+    def test_list_rides(self):
+        self.assertLessEqual(self.assert_constant_queries('list_rides'), 2)
+
+    def test_list_rides_nearby(self):
+        self.assertLessEqual(self.assert_constant_queries('list_rides', lat=NSU_LAT, lng=NSU_LNG), 2)
+
+    def test_current_rides(self):
+        self.assertLessEqual(self.assert_constant_queries('current_rides'), 2)
+
+    def test_ride_history(self):
+        self.assertLessEqual(self.assert_constant_queries('ride_history', completed=True), 2)
+
+    def test_serialized_fare_and_members(self):
+        self.add_rides(1)
+        _, response = self.count_queries('current_rides')
+        ride = response.data[0]
+        self.assertEqual(len(ride['members']), 3)  # host + two members
+        self.assertEqual(ride['per_person_fare'], 100.0)
+
+
+class RideCursorPaginationTests(APITestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(user=make_user(0))
+        departure = timezone.now() + timedelta(hours=1)
+        # Two rides share a departure time so the id tie-breaker is exercised
+        self.rides = [make_ride(make_user(i), departure_time=departure + timedelta(minutes=i // 2))
+                      for i in range(1, 6)]
+        self.expected = [ride.id for ride in sorted(self.rides, key=lambda r: (r.departure_time, r.id), reverse=True)]
+
+    def test_walks_all_pages_in_ordering_without_offset(self):
+        seen, params = [], {'page_size': 2}
+        while True:
+            with CaptureQueriesContext(connection) as context:
+                response = self.client.get(reverse('list_rides'), params)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertFalse(any('OFFSET' in query['sql'] for query in context.captured_queries))
+            seen.extend(ride['id'] for ride in response.data['results'])
+            if not response.data['next_cursor']:
+                self.assertIsNone(response.data['next'])
+                break
+            params = {'page_size': 2, 'cursor': response.data['next_cursor']}
+        self.assertEqual(seen, self.expected)
+
+    def test_unpaginated_request_returns_plain_list(self):
+        response = self.client.get(reverse('list_rides'))
+        self.assertEqual([ride['id'] for ride in response.data], self.expected)
+
+    def test_invalid_cursor(self):
+        response = self.client.get(reverse('list_rides'), {'cursor': 'not-a-cursor'})
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+
+class JoinRideTests(APITestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.host = make_user(0, gender='Female')
+        self.ride = make_ride(self.host)  # CNG: two seats besides the host
+        self.riders = [make_user(i) for i in range(1, 4)]
+
+    def test_join_by_id_reserves_seat_and_approves_request(self):
+        self.client.force_authenticate(user=self.riders[0])
+        response = self.client.post(reverse('join_ride_by_id', args=[self.ride.id]))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['ride']['seats_available'], 1)
+        self.ride.refresh_from_db()
+        self.assertEqual(self.ride.seats_available, 1)
+        self.assertTrue(self.ride.members.filter(id=self.riders[0].id).exists())
+        self.assertTrue(RideRequest.objects.get(ride=self.ride, user=self.riders[0]).is_approved)
+
+    def test_join_by_code(self):
+        self.client.force_authenticate(user=self.riders[0])
+        response = self.client.post(reverse('join_ride_by_code'), {'ride_code': self.ride.ride_code})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_stale_instance_cannot_overbook(self):
+        stale = Ride.objects.get(pk=self.ride.pk)
+        join_ride(Ride.objects.get(pk=self.ride.pk), self.riders[0])
+        join_ride(Ride.objects.get(pk=self.ride.pk), self.riders[1])
+        # stale still believes two seats are free
+        with self.assertRaisesMessage(RideJoinError, "This ride is full."):
+            join_ride(stale, self.riders[2])
+        self.ride.refresh_from_db()
+        self.assertEqual(self.ride.seats_available, 0)
+        self.assertEqual(self.ride.members.count(), 2)
+        self.assertFalse(RideRequest.objects.filter(user=self.riders[2]).exists())
+
+    def test_cannot_join_twice(self):
+        join_ride(self.ride, self.riders[0])
+        with self.assertRaisesMessage(RideJoinError, "You are already a member of this ride."):
+            join_ride(self.ride, self.riders[0])
+        with self.assertRaisesMessage(RideJoinError, "You are already a member of this ride."):
+            join_ride(self.ride, self.host)
+
+    def test_pending_request_blocks_a_second_join(self):
+        RideRequest.objects.create(ride=self.ride, user=self.riders[0])
+        with self.assertRaisesMessage(RideJoinError, "You have already requested to join this ride."):
+            join_ride(self.ride, self.riders[0])
+        self.ride.refresh_from_db()
+        self.assertEqual(self.ride.seats_available, 2)
+        self.assertFalse(self.ride.members.exists())
+
+    def test_join_inserts_the_request_without_reading_it_back(self):
+        with CaptureQueriesContext(connection) as context:
+            join_ride(self.ride, self.riders[0])
+        request_queries = [query['sql'] for query in context.captured_queries if 'rides_riderequest' in query['sql']]
+        self.assertEqual(len(request_queries), 1)
+        self.assertTrue(request_queries[0].startswith('INSERT'))
+
+    def test_female_only_ride_rejects_male_rider(self):
+        ride = make_ride(make_user(9, gender='Female'), is_female_only=True)
+        self.client.force_authenticate(user=self.riders[0])
+        response = self.client.post(reverse('join_ride_by_id', args=[ride.id]))
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        ride.refresh_from_db()
+        self.assertEqual(ride.seats_available, 2)
+
+
+class RideChangeTrackingTests(APITestCase):
+    def setUp(self):
+        self.host = make_user(0, gender='Female')
+        self.ride = Ride.objects.get(pk=make_ride(self.host).pk)
+
+    def add_message(self):
+        return ChatMessage.objects.create(ride=self.ride, user=self.host, text='hi')
+
+    def test_unchanged_save_does_not_select_or_validate(self):
+        with self.assertNumQueries(1):  # just the UPDATE
+            self.ride.save()
+
+    def test_changed_field_is_validated_without_loading_host(self):
+        self.ride.vehicle_type = 'Spaceship'
+        with self.assertNumQueries(0):
+            with self.assertRaises(ValidationError):
+                self.ride.save()
+
+    def test_female_only_change_checks_host(self):
+        self.ride.host = make_user(1, gender='Male')
+        self.ride.is_female_only = True
+        with self.assertRaisesMessage(ValidationError, "Only female hosts can create female-only ride groups."):
+            self.ride.save()
+
+    def test_chat_purged_only_when_ride_becomes_completed(self):
+        self.add_message()
+        self.ride.is_completed = True
+        self.ride.save()
+        self.assertFalse(self.ride.chat_messages.exists())
+
+        # Saving the already-completed ride again keeps messages written since
+        message = self.add_message()
+        self.ride.vehicle_number_plate = 'DHAKA-1234'
+        self.ride.save()
+        self.assertTrue(ChatMessage.objects.filter(pk=message.pk).exists())
+
+    def test_refresh_from_db_resets_changes(self):
+        Ride.objects.filter(pk=self.ride.pk).update(seats_available=1)
+        self.ride.refresh_from_db(fields=['seats_available'])
+        self.assertEqual(self.ride.get_changed_fields(), set())
+
+
+class RideMembershipTests(APITestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.host = make_user(0)
+        self.ride = make_ride(self.host)
+        self.first, self.second = make_user(1), make_user(2)
+        join_ride(self.ride, self.first)
+        join_ride(self.ride, self.second)
+
+    def leave(self, user):
+        self.client.force_authenticate(user=user)
+        return self.client.post(reverse('leave_ride', args=[self.ride.id]))
+
+    def test_join_keeps_member_count_and_order(self):
+        self.ride.refresh_from_db()
+        self.assertEqual(self.ride.member_count, 2)
+        self.assertEqual(self.ride.seats_available, 0)
+        order = RideMembership.objects.filter(ride=self.ride).order_by('joined_at', 'id')
+        self.assertEqual([m.user for m in order], [self.first, self.second])
+
+    def test_member_leaving_frees_seat(self):
+        response = self.leave(self.second)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.ride.refresh_from_db()
+        self.assertEqual((self.ride.member_count, self.ride.seats_available), (1, 1))
+        self.assertFalse(RideRequest.objects.filter(ride=self.ride, user=self.second).exists())
+        self.assertEqual(response.data['ride']['per_person_fare'], 150.0)
+
+    def test_host_leaving_promotes_earliest_member(self):
+        response = self.leave(self.host)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.ride.refresh_from_db()
+        self.assertEqual(self.ride.host, self.first)
+        self.assertEqual(list(self.ride.members.all()), [self.second])
+        self.assertEqual((self.ride.member_count, self.ride.seats_available), (1, 1))
+
+    def test_host_hand_over_skips_a_member_who_left_at_the_same_moment(self):
+        delete = RideMembership.delete
+
+        def leave_first(membership, *args, **kwargs):
+            # The earliest member's own leave request commits between the lookup and the delete
+            if membership.user_id == self.first.id:
+                leave_ride(self.ride, self.first)
+            return delete(membership, *args, **kwargs)
+
+        with patch.object(RideMembership, 'delete', leave_first):
+            new_host = hand_over_host(self.ride)
+        self.assertEqual(new_host, self.second)
+        self.ride.refresh_from_db()
+        self.assertEqual(self.ride.host, self.second)
+        self.assertFalse(RideMembership.objects.filter(ride=self.ride).exists())
+        self.assertEqual((self.ride.member_count, self.ride.seats_available), (0, 2))
+
+    def test_non_member_cannot_leave(self):
+        response = self.leave(make_user(3))
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_related_manager_changes_resync_member_count(self):
+        self.ride.members.remove(self.first)
+        self.ride.refresh_from_db()
+        self.assertEqual(self.ride.member_count, 1)
+        self.second.ride_members.clear()
+        self.ride.refresh_from_db()
+        self.assertEqual(self.ride.member_count, 0)
+
+
+class RideEventOutboxTests(APITestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.host = make_user(0)
+        self.rider = make_user(1)
+        self.ride = make_ride(self.host)
+        self.layer = get_channel_layer()
+        self.channel = async_to_sync(self.layer.new_channel)()
+        async_to_sync(self.layer.group_add)(f'chat_ride_{self.ride.id}', self.channel)
+
+    def join(self, user):
+        self.client.force_authenticate(user=user)
+        return self.client.post(reverse('join_ride_by_id', args=[self.ride.id]))
+
+    def test_join_records_event_instead_of_writing_chat(self):
+        response = self.join(self.rider)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(RideEvent.objects.filter(ride=self.ride).count(), 1)
+        self.assertFalse(ChatMessage.objects.exists())
+
+    def test_failed_join_records_no_event(self):
+        self.ride.is_female_only = True
+        self.ride.host.gender = 'Female'
+        self.ride.save()
+        response = self.join(self.rider)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(RideEvent.objects.exists())
+
+    def test_dispatch_writes_chat_and_broadcasts(self):
+        self.join(self.rider)
+
+        self.assertEqual(dispatch_pending(), 1)
+
+        self.assertFalse(RideEvent.objects.exists())
+        message = ChatMessage.objects.get(ride=self.ride)
+        self.assertEqual(message.user, self.rider)
+        self.assertEqual(message.kind, ChatMessage.Kind.SYSTEM)
+        event = async_to_sync(self.layer.receive)(self.channel)
+        self.assertEqual(event['message_data'], wire_message(self.rider.id, message.text, message.kind, message.timestamp))
+
+    def test_completion_drops_undelivered_events(self):
+        self.join(self.rider)
+        self.client.force_authenticate(user=self.host)
+        self.client.post(reverse('complete_ride', args=[self.ride.id]))
+
+        dispatch_pending()
+
+        messages = [m.text for m in ChatMessage.objects.filter(ride=self.ride)]
+        self.assertEqual(len(messages), 1)
+        self.assertIn('has marked this ride as completed', messages[0])
+
+
+class RideEventDispatcherThreadTests(TransactionTestCase):
+    def test_thread_delivers_events_without_an_asgi_loop(self):
+        # How a WSGI worker or run_background_jobs runs the dispatcher
+        host = make_user(0)
+        ride = make_ride(host)
+        thread = dispatcher.start_thread()
+        try:
+            with transaction.atomic():
+                record_ride_event(ride, host, "Leaving in five minutes")
+            deadline = time.monotonic() + 5
+            while RideEvent.objects.exists() and time.monotonic() < deadline:
+                time.sleep(0.05)
+        finally:
+            dispatcher.stop()
+            thread.join(5)
+        self.assertFalse(RideEvent.objects.exists())
+        self.assertEqual(ChatMessage.objects.get(ride=ride).kind, ChatMessage.Kind.SYSTEM)
+        self.assertFalse(thread.is_alive())
+
+
+class RideExpiryTests(APITestCase):
+    def setUp(self):
+        self.now = timezone.now()
+        self.stale = [
+            make_ride(make_user(i), departure_time=self.now - timedelta(hours=7 + i)) for i in range(3)
+        ]
+        self.recent = make_ride(make_user(10), departure_time=self.now - timedelta(hours=1))
+        self.upcoming = make_ride(make_user(11))
+
+    def test_expires_only_rides_past_grace_period(self):
+        ChatMessage.objects.create(ride=self.stale[0], user=self.stale[0].host, text='hi')
+
+        expired = expire_stale_rides(grace=timedelta(hours=6), chunk_size=2, now=self.now)
+        dispatch_pending()
+
+        self.assertEqual(expired, 3)
+        self.assertEqual(Ride.objects.filter(is_completed=True).count(), 3)
+        self.assertFalse(Ride.objects.filter(pk__in=[self.recent.pk, self.upcoming.pk], is_completed=True).exists())
+        # The old chat is purged and each expired ride gets exactly the system message
+        for ride in self.stale:
+            messages = list(ChatMessage.objects.filter(ride=ride))
+            self.assertEqual([m.text for m in messages], [EXPIRY_MESSAGE])
+            self.assertEqual(messages[0].user, ride.host)
+
+    def test_expiry_notifies_ride_chat(self):
+        layer = get_channel_layer()
+        channel = async_to_sync(layer.new_channel)()
+        async_to_sync(layer.group_add)(f'chat_ride_{self.stale[0].id}', channel)
+
+        expire_stale_rides(grace=timedelta(hours=6), now=self.now)
+        dispatch_pending()
+
+        event = async_to_sync(layer.receive)(channel)
+        self.assertEqual(event['type'], 'chat_message')
+        self.assertEqual(event['message_data']['m'], EXPIRY_MESSAGE)
+
+    def test_command_dry_run_changes_nothing(self):
+        call_command('expire_rides', '--grace-hours', '6', '--dry-run', stdout=StringIO())
+        self.assertFalse(Ride.objects.filter(is_completed=True).exists())
+        call_command('expire_rides', '--grace-hours', '6', stdout=StringIO())
+        self.assertEqual(Ride.objects.filter(is_completed=True).count(), 3)
+
+
+@skipUnless(connection.vendor == 'sqlite', 'Query plans are checked against SQLite EXPLAIN QUERY PLAN output')
+class QueryPlanAssertions:
+    """For the query plan tests of each app: the hot queries are answered from an index, not a full table scan."""
+
+    def assertUsesIndex(self, queryset, index_name):
+        plan = queryset.explain()
+        self.assertIn(f'USING INDEX {index_name}', plan.replace('USING COVERING INDEX', 'USING INDEX'))
+
+
+class QueryPlanTests(QueryPlanAssertions, APITestCase):
+    def setUp(self):
+        self.user = make_user(0)
+
+    def test_list_rides_uses_joinable_index(self):
+        rides = Ride.objects.filter(seats_available__gt=0, is_completed=False)
+        self.assertUsesIndex(rides, 'ride_joinable_departure_idx')
+
+    def test_active_hosted_ride_check_uses_host_index(self):
+        self.assertUsesIndex(Ride.objects.filter(host=self.user, is_completed=False), 'ride_host_open_idx')
+
+    def test_match_candidates_use_pickup_cell_index(self):
+        now = timezone.now()
+        rides = candidate_rides(self.user, (NSU_LAT, NSU_LNG), (23.7925, 90.4078), now, now + timedelta(hours=2))
+        self.assertUsesIndex(rides.values_list(*RideCandidates.FIELDS), 'ride_open_pickup_cell_idx')
+
+    def test_ride_history_does_not_scan_rides(self):
+        plan = Ride.objects.involving(self.user).filter(is_completed=True).explain()
+        self.assertIn('MULTI-INDEX OR', plan)
+        self.assertNotIn('SCAN rides_ride\n', plan + '\n')
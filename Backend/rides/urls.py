@@ -2,7 +2,7 @@ from django.urls import path
 from .views import (
     CreateRideView, JoinRideByIdView, JoinRideByCodeView, DeleteRideView,
     ListRidesView, LeaveRideView, CurrentRidesView, RideHistoryView, CompleteRideView,
-    RideDetailView
+    RideDetailView, MatchRidesView
 )
 
 urlpatterns = [
@@ -11,6 +11,7 @@ urlpatterns = [
     path('join-by-code/', JoinRideByCodeView.as_view(), name='join_ride_by_code'),
     path('delete/<int:ride_id>/', DeleteRideView.as_view(), name='delete_ride'),
     path('list/', ListRidesView.as_view(), name='list_rides'),
+    path('match/', MatchRidesView.as_view(), name='match_rides'),
     path('<int:ride_id>/', RideDetailView.as_view(), name='ride_detail'),
     path('leave/<int:ride_id>/', LeaveRideView.as_view(), name='leave_ride'),
     path('current/', CurrentRidesView.as_view(), name='current_rides'),
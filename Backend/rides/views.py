@@ -2,18 +2,31 @@ from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated
 from rest_framework import status
-from .models import Ride, RideRequest
+from .models import Ride
 from .serializers import RideSerializer
 from django.shortcuts import get_object_or_404
-from channels.layers import get_channel_layer
-from asgiref.sync import async_to_sync
+from django.db import transaction
 from django.utils import timezone
-from chat.models import ChatMessage
+from django.utils.dateparse import parse_datetime
+from .matching import match_rides
+from .outbox import notify_membership_changed, record_ride_event
+from .pagination import RideCursorPagination
+from .services import join_ride, leave_ride, hand_over_host, RideJoinError
+from datetime import timedelta
 import logging
 
 logger = logging.getLogger(__name__)
 
 
+def paginated_ride_response(request, rides):
+    """Serialize rides, one cursor page at a time when the client asks for pagination."""
+    paginator = RideCursorPagination()
+    page = paginator.paginate_queryset(rides, request)
+    if page is None:
+        return Response(RideSerializer(rides, many=True).data)
+    return paginator.get_paginated_response(RideSerializer(page, many=True).data)
+
+
 class CreateRideView(APIView):
     permission_classes = [IsAuthenticated]
 
@@ -27,32 +40,13 @@ class CreateRideView(APIView):
 
         serializer = RideSerializer(data=request.data)
         if serializer.is_valid():
-            ride = serializer.save(host=request.user)
-            
-            # Prepare system message for ride creation
-            message_data = {
-                "message": f"{request.user.first_name} {request.user.last_name} has created this ride from {ride.pickup_name} to {ride.destination_name}.",
-                "First Name": "System",
-                "Last Name": "",
-                "timestamp": str(timezone.now()),
-            }
-
-            # Save the system message to the database
-            ChatMessage.objects.create(
-                ride=ride,
-                user=request.user,  # User who triggered the action
-                message_json=message_data
-            )
-
-            # Notify WebSocket group
-            channel_layer = get_channel_layer()
-            async_to_sync(channel_layer.group_send)(
-                f"chat_ride_{ride.id}",
-                {
-                    "type": "chat_message",
-                    "message_data": message_data,
-                }
-            )
+            with transaction.atomic():
+                ride = serializer.save(host=request.user)
+                # System message for ride creation, delivered to the chat by the outbox dispatcher
+                record_ride_event(
+                    ride, request.user,
+                    f"{request.user.first_name} {request.user.last_name} has created this ride from {ride.pickup_name} to {ride.destination_name}.",
+                )
 
             return Response(serializer.data, status=status.HTTP_201_CREATED)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
@@ -64,47 +58,12 @@ class JoinRideByIdView(APIView):
     def post(self, request, ride_id):
         ride = get_object_or_404(Ride, id=ride_id)
 
-        if ride.is_completed:
-            return Response({"error": "This ride is already completed."}, status=status.HTTP_400_BAD_REQUEST)
-        if ride.seats_available <= 0:
-            return Response({"error": "This ride is full."}, status=status.HTTP_400_BAD_REQUEST)
-        if ride.members.filter(id=request.user.id).exists() or ride.host == request.user:
-            return Response({"error": "You are already a member of this ride."}, status=status.HTTP_400_BAD_REQUEST)
-        if RideRequest.objects.filter(ride=ride, user=request.user).exists():
-            return Response({"error": "You have already requested to join this ride."}, status=status.HTTP_400_BAD_REQUEST)
-
-        ride_request = RideRequest(ride=ride, user=request.user)
-        ride_request.save()
-        ride_request.is_approved = True
-        ride_request.save()
-        ride.members.add(request.user)
-        ride.seats_available -= 1
-        ride.save()
-
-        # Prepare system message for ride joining
-        message_data = {
-            "message": f"{request.user.first_name} {request.user.last_name} has joined this ride",
-            "First Name": "System",
-            "Last Name": "",
-            "timestamp": str(timezone.now()),
-        }
-
-        # Save the system message to the database
-        ChatMessage.objects.create(
-            ride=ride,
-            user=request.user,
-            message_json=message_data
-        )
-
-        # Notify WebSocket group
-        channel_layer = get_channel_layer()
-        async_to_sync(channel_layer.group_send)(
-            f"chat_ride_{ride_id}",
-            {
-                "type": "chat_message",
-                "message_data": message_data,
-            }
-        )
+        try:
+            with transaction.atomic():
+                join_ride(ride, request.user)
+                record_ride_event(ride, request.user, f"{request.user.first_name} {request.user.last_name} has joined this ride")
+        except RideJoinError as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
 
         return Response({"message": "Successfully joined the ride.", "ride": RideSerializer(ride).data}, status=status.HTTP_200_OK)
 
@@ -119,47 +78,12 @@ class JoinRideByCodeView(APIView):
 
         ride = get_object_or_404(Ride, ride_code=ride_code)
 
-        if ride.is_completed:
-            return Response({"error": "This ride is already completed."}, status=status.HTTP_400_BAD_REQUEST)
-        if ride.seats_available <= 0:
-            return Response({"error": "This ride is full. The code is no longer valid."}, status=status.HTTP_400_BAD_REQUEST)
-        if ride.members.filter(id=request.user.id).exists() or ride.host == request.user:
-            return Response({"error": "You are already a member of this ride."}, status=status.HTTP_400_BAD_REQUEST)
-        if RideRequest.objects.filter(ride=ride, user=request.user).exists():
-            return Response({"error": "You have already requested to join this ride."}, status=status.HTTP_400_BAD_REQUEST)
-
-        ride_request = RideRequest(ride=ride, user=request.user)
-        ride_request.save()
-        ride_request.is_approved = True
-        ride_request.save()
-        ride.members.add(request.user)
-        ride.seats_available -= 1
-        ride.save()
-
-        # Prepare system message for ride joining
-        message_data = {
-            "message": f"{request.user.first_name} {request.user.last_name} has joined this ride",
-            "First Name": "System",
-            "Last Name": "",
-            "timestamp": str(timezone.now()),
-        }
-
-        # Save the system message to the database
-        ChatMessage.objects.create(
-            ride=ride,
-            user=request.user,
-            message_json=message_data
-        )
-
-        # Notify WebSocket group
-        channel_layer = get_channel_layer()
-        async_to_sync(channel_layer.group_send)(
-            f"chat_ride_{ride.id}",
-            {
-                "type": "chat_message",
-                "message_data": message_data,
-            }
-        )
+        try:
+            with transaction.atomic():
+                join_ride(ride, request.user, full_message="This ride is full. The code is no longer valid.")
+                record_ride_event(ride, request.user, f"{request.user.first_name} {request.user.last_name} has joined this ride")
+        except RideJoinError as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
 
         return Response({"message": "Successfully joined the ride.", "ride": RideSerializer(ride).data}, status=status.HTTP_200_OK)
 
@@ -180,11 +104,13 @@ class DeleteRideView(APIView):
             return Response({"error": "Only the host can delete this ride."}, status=status.HTTP_403_FORBIDDEN)
             
         # Check if there are members
-        if ride.members.exists():
+        if ride.member_count:
             return Response({"error": "Cannot delete ride with members."}, status=status.HTTP_400_BAD_REQUEST)
 
         logger.info(f"Deleting ride {ride_id}")
-        ride.delete()
+        with transaction.atomic():
+            ride.delete()
+            notify_membership_changed(ride_id)
         logger.info(f"Ride {ride_id} deleted successfully")
 
         return Response({"message": "Ride deleted successfully."}, status=status.HTTP_200_OK)
@@ -192,12 +118,91 @@ class DeleteRideView(APIView):
 class ListRidesView(APIView):
     permission_classes = [IsAuthenticated]
 
+    DEFAULT_RADIUS_KM = 5
+    MAX_RADIUS_KM = 25
+
     def get(self, request):
-        rides = Ride.objects.filter(seats_available__gt=0, is_completed=False)
+        rides = Ride.objects.for_listing().filter(seats_available__gt=0, is_completed=False)
         if request.user.gender != 'Female':
             rides = rides.exclude(is_female_only=True)
-        serializer = RideSerializer(rides, many=True)
-        return Response(serializer.data)
+
+        lat = request.query_params.get('lat')
+        lng = request.query_params.get('lng')
+        if lat is None and lng is None:
+            return paginated_ride_response(request, rides)
+
+        # Proximity mode: only rides whose pickup point is within radius_km of (lat, lng)
+        try:
+            lat = float(lat)
+            lng = float(lng)
+            radius_km = float(request.query_params.get('radius_km', self.DEFAULT_RADIUS_KM))
+        except (TypeError, ValueError):
+            return Response({"error": "lat, lng and radius_km must be numbers."}, status=status.HTTP_400_BAD_REQUEST)
+        if not (-90 <= lat <= 90 and -180 <= lng <= 180):
+            return Response({"error": "lat or lng is out of range."}, status=status.HTTP_400_BAD_REQUEST)
+        if not (0 < radius_km <= self.MAX_RADIUS_KM):
+            return Response({"error": f"radius_km must be between 0 and {self.MAX_RADIUS_KM}."}, status=status.HTTP_400_BAD_REQUEST)
+
+        nearby = rides.nearby(lat, lng, radius_km)
+        serializer = RideSerializer([ride for ride, _ in nearby], many=True)
+        data = serializer.data
+        for item, (_, distance) in zip(data, nearby):
+            item['distance_km'] = round(distance, 3)
+        return Response(data)
+
+
+class MatchRidesView(APIView):
+    """
+    Rank open rides by how well they fit a trip: pickup distance, destination distance,
+    departure time, fare per seat and female-only eligibility.
+    """
+    permission_classes = [IsAuthenticated]
+
+    DEFAULT_WINDOW = timedelta(hours=2)
+    MAX_LIMIT = 50
+
+    def get(self, request):
+        params = request.query_params
+        try:
+            origin = (float(params['origin_lat']), float(params['origin_lng']))
+            destination = (float(params['destination_lat']), float(params['destination_lng']))
+            limit = int(params.get('limit', 10))
+        except KeyError as e:
+            return Response({"error": f"{e.args[0]} is required."}, status=status.HTTP_400_BAD_REQUEST)
+        except ValueError:
+            return Response({"error": "Coordinates and limit must be numbers."}, status=status.HTTP_400_BAD_REQUEST)
+        if not all(-90 <= lat <= 90 and -180 <= lng <= 180 for lat, lng in (origin, destination)):
+            return Response({"error": "Coordinates are out of range."}, status=status.HTTP_400_BAD_REQUEST)
+        if not (1 <= limit <= self.MAX_LIMIT):
+            return Response({"error": f"limit must be between 1 and {self.MAX_LIMIT}."}, status=status.HTTP_400_BAD_REQUEST)
+
+        departure_after = self.parse_time(params, 'departure_after', timezone.now())
+        if departure_after is None:
+            return Response({"error": "departure_after must be an ISO 8601 datetime."}, status=status.HTTP_400_BAD_REQUEST)
+        departure_before = self.parse_time(params, 'departure_before', departure_after + self.DEFAULT_WINDOW)
+        if departure_before is None:
+            return Response({"error": "departure_before must be an ISO 8601 datetime."}, status=status.HTTP_400_BAD_REQUEST)
+        if departure_before < departure_after:
+            return Response({"error": "departure_before must not be earlier than departure_after."}, status=status.HTTP_400_BAD_REQUEST)
+
+        matches = match_rides(request.user, origin, destination, departure_after, departure_before, limit=limit)
+        data = RideSerializer([match['ride'] for match in matches], many=True).data
+        for item, match in zip(data, matches):
+            item['match_score'] = round(match['score'], 4)
+            item['pickup_distance_km'] = round(match['pickup_km'], 3)
+            item['destination_distance_km'] = round(match['destination_km'], 3)
+        return Response(data)
+
+    def parse_time(self, params, name, default):
+        if name not in params:
+            return default
+        try:
+            value = parse_datetime(params[name])
+        except ValueError:
+            return None
+        if value is not None and timezone.is_naive(value):
+            value = timezone.make_aware(value)
+        return value
 
 
 class LeaveRideView(APIView):
@@ -209,73 +214,38 @@ class LeaveRideView(APIView):
         if ride.is_completed:
             return Response({"error": "Cannot leave a completed ride."}, status=status.HTTP_400_BAD_REQUEST)
 
-        # Check if user is in the ride
-        if not ride.members.filter(id=request.user.id).exists() and ride.host != request.user:
-            return Response({"error": "You are not a member of this ride."}, status=status.HTTP_400_BAD_REQUEST)
-
         # Handle host leaving
         if ride.host == request.user:
-            if not ride.members.exists():
+            if not ride.member_count:
                 # If no members, delete the ride instead
-                ride.delete()
+                with transaction.atomic():
+                    ride.delete()
+                    notify_membership_changed(ride_id)
                 return Response({"message": "Ride deleted as it had no members."}, status=status.HTTP_200_OK)
-            else:
+
+            with transaction.atomic():
                 # Reassign host to the earliest joined member
-                earliest_request = RideRequest.objects.filter(
-                    ride=ride, 
-                    is_approved=True
-                ).order_by('requested_at').first()
-                
-                if earliest_request:
-                    new_host = earliest_request.user
-                    ride.host = new_host
-                    ride.members.remove(new_host)  # Remove new host from members
-                    ride.seats_available += 1  # Adjust seats as original host is leaving
-                    
-                    # Prepare system message for host change
-                    message_data = {
-                        "message": f"{request.user.first_name} {request.user.last_name} has left the ride. "
-                                  f"{new_host.first_name} {new_host.last_name} is now the host.",
-                        "First Name": "System",
-                        "Last Name": "",
-                        "timestamp": str(timezone.now()),
-                    }
-                else:
-                    # This shouldn't happen due to members check, but as a fallback
+                new_host = hand_over_host(ride)
+                if new_host is None:
+                    # This shouldn't happen due to member_count check, but as a fallback
                     return Response({"error": "Unable to reassign host."}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+                notify_membership_changed(ride.id, request.user.id)
+                # System message for host change
+                record_ride_event(
+                    ride, request.user,
+                    f"{request.user.first_name} {request.user.last_name} has left the ride. "
+                    f"{new_host.first_name} {new_host.last_name} is now the host.",
+                )
         else:
             # Regular member leaving
-            ride.members.remove(request.user)
-            ride.seats_available += 1
-            RideRequest.objects.filter(ride=ride, user=request.user).delete()  # Clean up request
-            
-            # Prepare system message for member leaving
-            message_data = {
-                "message": f"{request.user.first_name} {request.user.last_name} has left the ride.",
-                "First Name": "System",
-                "Last Name": "",
-                "timestamp": str(timezone.now()),
-            }
-
-        # Save changes to ride
-        ride.save()
-
-        # Save the system message to the database
-        ChatMessage.objects.create(
-            ride=ride,
-            user=request.user,
-            message_json=message_data
-        )
-
-        # Notify WebSocket group
-        channel_layer = get_channel_layer()
-        async_to_sync(channel_layer.group_send)(
-            f"chat_ride_{ride_id}",
-            {
-                "type": "chat_message",
-                "message_data": message_data,
-            }
-        )
+            with transaction.atomic():
+                if not leave_ride(ride, request.user):
+                    return Response({"error": "You are not a member of this ride."}, status=status.HTTP_400_BAD_REQUEST)
+
+                notify_membership_changed(ride.id, request.user.id)
+                # System message for member leaving
+                record_ride_event(ride, request.user, f"{request.user.first_name} {request.user.last_name} has left the ride.")
 
         return Response({
             "message": "Successfully left the ride.",
@@ -319,19 +289,15 @@ class CurrentRidesView(APIView):
     permission_classes = [IsAuthenticated]
 
     def get(self, request):
-        rides = Ride.objects.filter(members=request.user, is_completed=False)
-        serializer = RideSerializer(rides, many=True)
-        return Response(serializer.data)
+        rides = Ride.objects.for_listing().filter(members=request.user, is_completed=False)
+        return paginated_ride_response(request, rides)
 
 class RideHistoryView(APIView):
     permission_classes = [IsAuthenticated]
 
     def get(self, request):
-        hosted_rides = Ride.objects.filter(host=request.user, is_completed=True)
-        member_rides = Ride.objects.filter(members=request.user, is_completed=True)
-        all_rides = (hosted_rides | member_rides).distinct()
-        serializer = RideSerializer(all_rides, many=True)
-        return Response(serializer.data)
+        all_rides = Ride.objects.for_listing().involving(request.user).filter(is_completed=True)
+        return paginated_ride_response(request, all_rides)
     
     
 class CompleteRideView(APIView):
@@ -348,34 +314,17 @@ class CompleteRideView(APIView):
         if ride.is_completed:
             return Response({"error": "This ride is already completed."}, status=status.HTTP_400_BAD_REQUEST)
 
-        # Mark the ride as completed
-        ride.is_completed = True
-        ride.save()
-
-        # Prepare system message for ride completion
-        message_data = {
-            "message": f"{request.user.first_name} {request.user.last_name} has marked this ride as completed.",
-            "First Name": "System",
-            "Last Name": "",
-            "timestamp": str(timezone.now()),
-        }
-
-        # Save the system message to the database
-        ChatMessage.objects.create(
-            ride=ride,
-            user=request.user,
-            message_json=message_data
-        )
-
-        # Notify WebSocket group
-        channel_layer = get_channel_layer()
-        async_to_sync(channel_layer.group_send)(
-            f"chat_ride_{ride_id}",
-            {
-                "type": "chat_message",
-                "message_data": message_data,
-            }
-        )
+        with transaction.atomic():
+            # Mark the ride as completed
+            ride.is_completed = True
+            ride.save()
+            notify_membership_changed(ride.id)
+
+            # System message for ride completion
+            record_ride_event(
+                ride, request.user,
+                f"{request.user.first_name} {request.user.last_name} has marked this ride as completed.",
+            )
 
         return Response({
             "message": "Ride marked as completed successfully.",
@@ -4,11 +4,13 @@ from .models import SOSAlert, EmergencyContact
 
 @admin.register(SOSAlert)
 class SOSAlertAdmin(admin.ModelAdmin):
-    list_display = ('user', 'timestamp', 'location_display', 'status', 'is_community_alert', 'notified_users_count')
-    list_filter = ('status', 'is_community_alert', 'timestamp')
+    list_display = ('user', 'timestamp', 'location_display', 'status', 'is_community_alert', 'notified_users_count',
+                    'fanout_status', 'push_sent', 'push_delivered')
+    list_filter = ('status', 'fanout_status', 'is_community_alert', 'timestamp')
     search_fields = ('user__username', 'user__email', 'status')
     date_hierarchy = 'timestamp'
-    readonly_fields = ('timestamp', 'location_display')
+    readonly_fields = ('timestamp', 'location_display', 'fanout_error', 'push_sent', 'push_failed', 'push_delivered',
+                       'fanout_started_at', 'fanout_finished_at', 'receipts_checked_at')
     raw_id_fields = ('user', 'notified_users', 'escalated_from')
     
     fieldsets = (
@@ -21,6 +23,10 @@ class SOSAlertAdmin(admin.ModelAdmin):
         ('Relationships', {
             'fields': ('notified_users', 'escalated_from')
         }),
+        ('Notifications', {
+            'fields': ('fanout_status', 'fanout_error', 'push_sent', 'push_failed', 'push_delivered',
+                       'fanout_started_at', 'fanout_finished_at', 'receipts_checked_at')
+        }),
         ('Timestamp', {
             'fields': ('timestamp',)
         }),
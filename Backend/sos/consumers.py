@@ -0,0 +1,46 @@
+import json
+import logging
+
+from channels.db import database_sync_to_async
+from channels.generic.websocket import AsyncWebsocketConsumer
+from django.contrib.auth.models import AnonymousUser
+
+from RideShare.consumers import NoDatabaseDispatchMixin
+from .locations import InvalidLocation, location_writes, parse_location
+
+logger = logging.getLogger(__name__)
+
+
+class LocationConsumer(NoDatabaseDispatchMixin, AsyncWebsocketConsumer):
+    """
+    Location pings over one long-lived socket: each text frame is a JSON object with ``latitude``
+    and ``longitude`` (or ``lat``/``lng``). Nothing is sent back unless a ping is rejected.
+    """
+    # Pings never touch the database (sos.locations queues them)
+    NO_DB_MESSAGE_TYPES = frozenset({'websocket.receive'})
+
+    async def connect(self):
+        # Set by chat.auth.JWTAuthMiddleware
+        self.user = self.scope.get('user', AnonymousUser())
+        if isinstance(self.user, AnonymousUser):
+            await self.close(code=4403)
+            return
+        await self.accept()
+
+    async def receive(self, text_data=None, bytes_data=None):
+        try:
+            latitude, longitude = parse_location(json.loads(text_data or ''))
+        except json.JSONDecodeError:
+            await self.send_json({"error": "Invalid JSON"})
+            return
+        except InvalidLocation as e:
+            await self.send_json({"error": str(e)})
+            return
+        if location_writes.flush_interval:
+            location_writes.add(self.user.id, latitude, longitude)
+        else:
+            # Written as it arrives, so off the event loop
+            await database_sync_to_async(location_writes.add)(self.user.id, latitude, longitude)
+
+    async def send_json(self, content):
+        await self.send(text_data=json.dumps(content, separators=(',', ':')))
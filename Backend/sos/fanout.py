@@ -0,0 +1,207 @@
+"""
+SOS alert fan-out, off the request path.
+
+CreateSOSAlertView only saves the alert, with fanout_status "pending", and returns. Once that
+commits, the alert id goes to a pool of ``SOS_FANOUT_WORKERS`` threads. A worker claims the
+alert, picks who to notify (the users named in the request, else users nearby, else the sender's
+emergency contacts), sends the pushes (notifications.push) and records counts and timings on the
+alert for SOSAlertStatusView. ``SOS_RECEIPT_DELAY`` seconds later it polls the push receipts and
+records how many pushes reached a device.
+
+The alert row is the job. A worker's claim is a lease of ``SOS_FANOUT_LEASE`` seconds: an alert
+left pending because its process died before a worker got to it, or left sending because the
+worker died mid-way, is picked up again by the sweep thread every ``SOS_FANOUT_SWEEP_INTERVAL``
+seconds or by ``manage.py dispatch_sos_alerts``. With SOS_FANOUT_WORKERS = 0 the fan-out runs inline once the
+transaction commits, receipts included.
+"""
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import close_old_connections
+from django.db.models import F, Q
+from django.utils import timezone
+
+from RideShare.conf import setting_default
+from notifications.push import push_client
+from .models import EmergencyContact, SOSAlert
+from .serializers import SOSAlertSerializer
+
+logger = logging.getLogger(__name__)
+
+Status = SOSAlert.FanoutStatus
+NO_CONTACTS_ERROR = "No emergency contacts found to notify."
+
+
+def claimable(now):
+    """Alerts no live worker holds: pending, or sending under a lease that ran out."""
+    expired = now - timedelta(seconds=settings.SOS_FANOUT_LEASE)
+    return Q(fanout_status=Status.PENDING) | Q(fanout_status=Status.SENDING, fanout_started_at__lt=expired)
+
+
+def claim_alert(alert_id):
+    """Take the lease on an alert. False if another worker holds it or it is done."""
+    now = timezone.now()
+    return bool(SOSAlert.objects.filter(claimable(now), id=alert_id).update(
+        fanout_status=Status.SENDING, fanout_started_at=now,
+    ))
+
+
+def fan_out(alert_id):
+    """
+    Notify everyone an alert should reach, if it is still pending. Returns the push tickets for
+    the receipt check, or None if the alert was not claimed.
+    """
+    if not claim_alert(alert_id):
+        return None
+    try:
+        return _fan_out(SOSAlert.objects.select_related('user').get(id=alert_id))
+    except Exception:
+        # Not left "sending" forever; the status endpoint shows the alert failed
+        SOSAlert.objects.filter(id=alert_id).update(
+            fanout_status=Status.FAILED, fanout_error="Notification failed.", fanout_finished_at=timezone.now(),
+        )
+        raise
+
+
+def _fan_out(alert):
+    serializer = SOSAlertSerializer()
+
+    # Users named in the request were set when the alert was created
+    if not alert.notified_users.exists():
+        nearby = serializer.get_nearby_users(alert.latitude, alert.longitude).exclude(id=alert.user_id)
+        alert.notified_users.set(nearby)
+        if not alert.is_community_alert and not alert.notified_users.exists():
+            contacts = list(EmergencyContact.objects.filter(user_id=alert.user_id)
+                            .values_list('contact_id', flat=True))
+            alert.notified_users.set(contacts)
+            if not contacts:
+                _finish(alert, Status.FAILED, error=NO_CONTACTS_ERROR)
+                return []
+
+    custom_message = alert.user.emergency_message or "An SOS alert has been created near you."
+    tickets = serializer.send_expo_notifications(alert, custom_message)
+    sent = sum(1 for ticket in tickets if ticket.ok)
+    if tickets and not sent:
+        _finish(alert, Status.FAILED, push_failed=len(tickets), error=tickets[0].message or tickets[0].error or '')
+    else:
+        _finish(alert, Status.SENT, push_sent=sent, push_failed=len(tickets) - sent)
+    logger.info(f"SOS alert {alert.id}: {sent} of {len(tickets)} pushes accepted, {alert.sent_ms}ms after "
+                f"creation ({alert.queued_ms}ms queued)")
+    return tickets
+
+
+def _finish(alert, status, push_sent=0, push_failed=0, error=''):
+    alert.fanout_status = status
+    alert.fanout_error = error[:255]
+    alert.fanout_finished_at = timezone.now()
+    alert.push_sent = push_sent
+    alert.push_failed = push_failed
+    alert.save(update_fields=['fanout_status', 'fanout_error', 'fanout_finished_at', 'push_sent', 'push_failed'])
+
+
+def record_receipts(alert_id, tickets, timeout=0.0):
+    """Poll the receipts of an alert's accepted pushes and record how many reached a device."""
+    accepted = [ticket for ticket in tickets if ticket.ok]
+    if not accepted:
+        return
+    pending = push_client.poll_receipts(accepted, timeout=timeout)
+    delivered = sum(1 for ticket in accepted if ticket.delivered)
+    failed = len(accepted) - delivered - len(pending)
+    SOSAlert.objects.filter(id=alert_id).update(
+        push_delivered=delivered, push_failed=F('push_failed') + failed, receipts_checked_at=timezone.now(),
+    )
+
+
+def pending_alert_ids(older_than=None):
+    """Ids of alerts no live worker holds, oldest first; older_than skips ones just created."""
+    now = timezone.now()
+    alerts = SOSAlert.objects.filter(claimable(now))
+    if older_than is not None:
+        alerts = alerts.filter(timestamp__lt=now - older_than)
+    return list(alerts.order_by('timestamp').values_list('id', flat=True))
+
+
+class SOSFanoutDispatcher:
+    """Runs fan-outs on a bounded thread pool, plus a thread that sweeps up alerts left pending."""
+
+    def __init__(self, workers=None, sweep_interval=None):
+        self._workers = workers
+        self._sweep_interval = sweep_interval
+        self._executor = None
+        self._sweeper = None
+        self._stopped = threading.Event()
+        self._lock = threading.Lock()
+
+    @property
+    def workers(self):
+        return setting_default(self._workers, 'SOS_FANOUT_WORKERS')
+
+    @property
+    def sweep_interval(self):
+        return setting_default(self._sweep_interval, 'SOS_FANOUT_SWEEP_INTERVAL')
+
+    def submit(self, alert_id):
+        """Fan an alert out on a worker thread, or right here if there are no workers."""
+        if not self.workers:
+            tickets = fan_out(alert_id)
+            if tickets:
+                record_receipts(alert_id, tickets)
+            return
+        self._get_executor().submit(self._run, alert_id)
+
+    def _run(self, alert_id):
+        try:
+            tickets = fan_out(alert_id)
+            if tickets:
+                # Checked from a timer, so no worker is held up waiting for receipts
+                timer = threading.Timer(settings.SOS_RECEIPT_DELAY, self._check_receipts, (alert_id, tickets))
+                timer.daemon = True
+                timer.start()
+        except Exception:
+            logger.exception(f"SOS alert {alert_id} fan-out failed")
+        finally:
+            close_old_connections()
+
+    def _check_receipts(self, alert_id, tickets):
+        try:
+            # Receipts not ready yet are asked for again for up to another delay
+            record_receipts(alert_id, tickets, timeout=settings.SOS_RECEIPT_DELAY)
+        except Exception:
+            logger.exception(f"SOS alert {alert_id} receipt check failed")
+        finally:
+            close_old_connections()
+
+    def start_sweeper(self):
+        """Start the sweep thread once per process."""
+        with self._lock:
+            if self._sweeper is None or not self._sweeper.is_alive():
+                self._stopped.clear()
+                self._sweeper = threading.Thread(target=self._sweep, name='sos-fanout-sweep', daemon=True)
+                self._sweeper.start()
+            return self._sweeper
+
+    def stop(self):
+        self._stopped.set()
+
+    def _sweep(self):
+        while not self._stopped.wait(self.sweep_interval):
+            try:
+                # Alerts younger than a sweep interval are still on their way to a worker
+                for alert_id in pending_alert_ids(older_than=timedelta(seconds=self.sweep_interval)):
+                    self.submit(alert_id)
+            except Exception:
+                logger.exception("SOS fan-out sweep failed")
+            finally:
+                close_old_connections()
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='sos-fanout')
+            return self._executor
+
+
+fanout_dispatcher = SOSFanoutDispatcher()
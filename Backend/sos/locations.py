@@ -0,0 +1,161 @@
+"""
+Coalesced location pings.
+
+Phones report their position every few seconds, over POST /api/sos/location/ or the
+``ws/location/`` socket. A ping updates the SOS proximity index (sos.nearby) straight away and
+replaces whatever position that user already had queued here, so each user has at most one
+pending write however often they ping. Every ``LOCATION_FLUSH_INTERVAL`` seconds a background
+thread writes the queue, stamping ``location_updated_at`` so the indexes of other processes pick
+the positions up on their next sync: one prepared UPDATE run with executemany, committed every
+``LOCATION_WRITE_BATCH_SIZE`` users, instead of a statement and commit per ping. (bulk_update
+would build a CASE expression per row, which costs more than the write itself.) Whatever is still
+queued when the process exits is written by an atexit hook.
+
+The writes send no post_save, so the index is updated here rather than by the User receivers in
+sos.models, and cached WebSocket users (users.cache) keep their old coordinates until they expire.
+With LOCATION_FLUSH_INTERVAL = 0 every ping is written as it arrives.
+"""
+import atexit
+import logging
+import threading
+
+from django.db import close_old_connections, connection, transaction
+from django.utils import timezone
+
+from RideShare.conf import setting_default
+from users.models import User
+from .nearby import nearby_users
+
+logger = logging.getLogger(__name__)
+
+
+class InvalidLocation(ValueError):
+    pass
+
+
+def parse_location(data):
+    """(lat, lng) from a ping body: ``latitude``/``longitude`` or ``lat``/``lng``."""
+    if not isinstance(data, dict):
+        raise InvalidLocation("Expected an object with latitude and longitude.")
+    lat = data.get('latitude', data.get('lat'))
+    lng = data.get('longitude', data.get('lng'))
+    try:
+        lat, lng = float(lat), float(lng)
+    except (TypeError, ValueError):
+        raise InvalidLocation("latitude and longitude must be numbers.")
+    # NaN fails both comparisons
+    if not (-90 <= lat <= 90 and -180 <= lng <= 180):
+        raise InvalidLocation("latitude must be within ±90 and longitude within ±180.")
+    return lat, lng
+
+
+class LocationWriteBuffer:
+    def __init__(self, flush_interval=None, batch_size=None):
+        self._flush_interval = flush_interval
+        self._batch_size = batch_size
+        self.pending = {}  # user_id -> (lat, lng); a newer ping replaces the queued one
+        # The batch being written right now, so positions stay visible to the index until stored
+        self.inflight = {}
+        self._lock = threading.Lock()
+        # Held for a whole flush, so batches reach the database in the order they were taken
+        self._flush_lock = threading.Lock()
+        self._flusher = None
+        self._stopped = threading.Event()
+
+    @property
+    def flush_interval(self):
+        return setting_default(self._flush_interval, 'LOCATION_FLUSH_INTERVAL')
+
+    @property
+    def batch_size(self):
+        return setting_default(self._batch_size, 'LOCATION_WRITE_BATCH_SIZE')
+
+    def __len__(self):
+        return len(self.pending)
+
+    def add(self, user_id, lat, lng):
+        """Record a user's latest position. Safe to call from any thread or the event loop; never queries."""
+        nearby_users.update(user_id, lat, lng)
+        with self._lock:
+            self.pending[user_id] = (lat, lng)
+        if not self.flush_interval:
+            self.flush()
+        elif self._flusher is None:
+            self.start()
+
+    def has_pending(self, user_id):
+        """True if a position for the user was received but is not stored yet."""
+        with self._lock:
+            return user_id in self.pending or user_id in self.inflight
+
+    def positions(self):
+        """{user_id: (lat, lng)} received but not stored yet, for the index to lay over a reload."""
+        with self._lock:
+            return {**self.inflight, **self.pending}
+
+    def flush(self):
+        """Write every queued position. Returns how many users were written."""
+        with self._flush_lock:
+            with self._lock:
+                batch, self.pending = self.pending, {}
+                self.inflight = batch
+            if not batch:
+                return 0
+            try:
+                self._write(batch)
+            except Exception:
+                # Back in the queue unless a newer ping for the user arrived meanwhile
+                with self._lock:
+                    self.pending = {**batch, **self.pending}
+                    self.inflight = {}
+                raise
+            with self._lock:
+                self.inflight = {}
+            return len(batch)
+
+    def _write(self, batch):
+        quote = connection.ops.quote_name
+        opts = User._meta
+        sql = (f"UPDATE {quote(opts.db_table)} SET {quote(opts.get_field('latitude').column)} = %s, "
+               f"{quote(opts.get_field('longitude').column)} = %s, "
+               f"{quote(opts.get_field('location_updated_at').column)} = %s WHERE {quote(opts.pk.column)} = %s")
+        updated_at = opts.get_field('location_updated_at').get_db_prep_value(timezone.now(), connection)
+        rows = [(lat, lng, updated_at, user_id) for user_id, (lat, lng) in batch.items()]
+        # Users deleted since their ping simply match no row
+        for start in range(0, len(rows), self.batch_size):
+            with transaction.atomic(), connection.cursor() as cursor:
+                cursor.executemany(sql, rows[start:start + self.batch_size])
+
+    def start(self):
+        """Start the flush thread once per process."""
+        with self._lock:
+            if self._flusher is None or not self._flusher.is_alive():
+                self._stopped.clear()
+                self._flusher = threading.Thread(target=self._run, name='location-flush', daemon=True)
+                self._flusher.start()
+            return self._flusher
+
+    def stop(self):
+        self._stopped.set()
+
+    def _run(self):
+        while not self._stopped.wait(self.flush_interval or 1):
+            try:
+                self.flush()
+            except Exception:
+                logger.exception(f"Failed to write {len(self)} user locations")
+            finally:
+                close_old_connections()
+
+    def flush_sync(self):
+        """Write what is queued at interpreter exit."""
+        try:
+            self.flush()
+        except Exception:
+            logger.exception(f"Lost {len(self)} user locations at shutdown")
+        finally:
+            close_old_connections()
+
+
+location_writes = LocationWriteBuffer()
+atexit.register(location_writes.flush_sync)
@@ -0,0 +1,69 @@
+import random
+
+from django.core.management.base import BaseCommand
+
+from RideShare.bench import isolated_database, timed
+from sos.locations import LocationWriteBuffer
+from sos.nearby import nearby_users
+from users.models import User
+
+
+class Command(BaseCommand):
+    help = ("Location pings/sec for a burst from many phones: an UPDATE per ping versus sos.locations, "
+            "which keeps each user's latest ping and writes them in batches.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=2000, help="Phones pinging.")
+        parser.add_argument('--pings', type=int, default=3, help="Pings per phone between flushes.")
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        rng = random.Random(1)
+        with isolated_database():
+            User.objects.bulk_create([
+                User(email=f'ping{i}@northsouth.edu', first_name='Ping', last_name=str(i), student_id=str(i),
+                     latitude=23.78, longitude=90.40)
+                for i in range(options['users'])
+            ])
+            user_ids = list(User.objects.values_list('id', flat=True))
+            nearby_users.clear()
+            nearby_users.within(23.78, 90.40, 1)
+
+            def burst():
+                return [
+                    (user_id, 23.78 + rng.uniform(-0.1, 0.1), 90.40 + rng.uniform(-0.1, 0.1))
+                    for _ in range(options['pings']) for user_id in user_ids
+                ]
+
+            def update_each(pings):
+                for user_id, lat, lng in pings:
+                    User.objects.filter(id=user_id).update(latitude=lat, longitude=lng)
+                    nearby_users.update(user_id, lat, lng)
+
+            buffer = LocationWriteBuffer(flush_interval=3600, batch_size=options['batch_size'])
+
+            def coalesced(pings):
+                for user_id, lat, lng in pings:
+                    buffer.add(user_id, lat, lng)
+                return buffer.flush()
+
+            pings = burst()
+            _, before = timed(update_each, pings)
+            self.check_stored(pings)
+            pings = burst()
+            written, after = timed(coalesced, pings)
+            self.check_stored(pings)
+            buffer.stop()
+
+        total = len(pings)
+        self.stdout.write(f"pings: {total} from {options['users']} phones")
+        self.stdout.write(f"update per ping: {total / before * 1000:,.0f} pings/s ({total} transactions)")
+        self.stdout.write(f"coalesced      : {total / after * 1000:,.0f} pings/s ({written} rows in "
+                          f"{-(-written // options['batch_size'])} transactions)")
+
+    def check_stored(self, pings):
+        """Either way every user must end up at their last ping."""
+        last = {user_id: (lat, lng) for user_id, lat, lng in pings}
+        stored = {user_id: (lat, lng) for user_id, lat, lng in User.objects.values_list('id', 'latitude', 'longitude')}
+        if stored != last:
+            raise AssertionError("stored locations differ from the last pings")
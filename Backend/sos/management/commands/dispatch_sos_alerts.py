@@ -0,0 +1,27 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+
+from sos.fanout import fan_out, pending_alert_ids, record_receipts
+
+
+class Command(BaseCommand):
+    help = ("Fan out SOS alerts that no live worker holds: never picked up, or abandoned mid-way "
+            "because the server process died.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--older-than', type=float, default=30,
+                            help="Only alerts created at least this many seconds ago.")
+        parser.add_argument('--receipt-timeout', type=float, default=0,
+                            help="Seconds to keep polling push receipts after sending (default: one check).")
+
+    def handle(self, *args, **options):
+        dispatched = 0
+        for alert_id in pending_alert_ids(older_than=timedelta(seconds=options['older_than'])):
+            tickets = fan_out(alert_id)
+            if tickets is None:
+                continue
+            dispatched += 1
+            if tickets:
+                record_receipts(alert_id, tickets, timeout=options['receipt_timeout'])
+        self.stdout.write(f"Dispatched {dispatched} pending SOS alerts")
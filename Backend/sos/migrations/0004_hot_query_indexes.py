@@ -0,0 +1,19 @@
+# Generated by Django 5.1.7 on 2026-10-17 12:18
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sos', '0003_emergencycontact'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='sosalert',
+            index=models.Index(condition=models.Q(('status', 'active')), fields=['timestamp'], name='sos_active_timestamp_idx'),
+        ),
+    ]
@@ -0,0 +1,66 @@
+# Generated by Django 5.1.7 on 2026-10-17 13:02
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sos', '0004_hot_query_indexes'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='sosalert',
+            name='fanout_error',
+            field=models.CharField(blank=True, max_length=255),
+        ),
+        migrations.AddField(
+            model_name='sosalert',
+            name='fanout_finished_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='sosalert',
+            name='fanout_started_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        # Existing alerts were notified when they were created; only new ones start out pending, so
+        # the fan-out sweep does not send them again
+        migrations.AddField(
+            model_name='sosalert',
+            name='fanout_status',
+            field=models.CharField(choices=[('pending', 'Pending'), ('sending', 'Sending'), ('sent', 'Sent'), ('failed', 'Failed')], default='sent', max_length=10),
+        ),
+        migrations.AlterField(
+            model_name='sosalert',
+            name='fanout_status',
+            field=models.CharField(choices=[('pending', 'Pending'), ('sending', 'Sending'), ('sent', 'Sent'), ('failed', 'Failed')], default='pending', max_length=10),
+        ),
+        migrations.AddField(
+            model_name='sosalert',
+            name='push_delivered',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='sosalert',
+            name='push_failed',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='sosalert',
+            name='push_sent',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='sosalert',
+            name='receipts_checked_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='sosalert',
+            index=models.Index(condition=models.Q(('fanout_status', 'pending')), fields=['timestamp'], name='sos_fanout_pending_idx'),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.1.7 on 2026-10-17 13:23
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sos', '0005_sosalert_fanout'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='sosalert',
+            name='sos_fanout_pending_idx',
+        ),
+        migrations.AddIndex(
+            model_name='sosalert',
+            index=models.Index(condition=models.Q(('fanout_status__in', ['pending', 'sending'])), fields=['timestamp'], name='sos_fanout_unsent_idx'),
+        ),
+    ]
@@ -1,8 +1,20 @@
 # sos/models.py
-from django.db import models
+from functools import partial
+
+from django.db import models, transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
 from users.models import User
+from .locations import location_writes
+from .nearby import nearby_users
 
 class SOSAlert(models.Model):
+    class FanoutStatus(models.TextChoices):
+        PENDING = 'pending'  # Saved, waiting for a fan-out worker (sos.fanout)
+        SENDING = 'sending'
+        SENT = 'sent'
+        FAILED = 'failed'
+
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     latitude = models.FloatField(null=True, blank=True)
     longitude = models.FloatField(null=True, blank=True)
@@ -12,6 +24,25 @@ class SOSAlert(models.Model):
     escalated_from = models.ForeignKey('self', null=True, blank=True, on_delete=models.SET_NULL)
     is_community_alert = models.BooleanField(default=False)
 
+    # Fan-out progress, reported by SOSAlertStatusView
+    fanout_status = models.CharField(max_length=10, choices=FanoutStatus.choices, default=FanoutStatus.PENDING)
+    fanout_error = models.CharField(max_length=255, blank=True)
+    fanout_started_at = models.DateTimeField(null=True, blank=True)
+    fanout_finished_at = models.DateTimeField(null=True, blank=True)  # Every push handed to Expo
+    push_sent = models.PositiveIntegerField(default=0)  # Accepted by Expo
+    push_failed = models.PositiveIntegerField(default=0)  # Rejected, or failed in the receipt
+    push_delivered = models.PositiveIntegerField(default=0)  # Confirmed by the receipt
+    receipts_checked_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            # ActiveSOSAlertsView only ever looks at active alerts
+            models.Index(fields=['timestamp'], condition=models.Q(status='active'), name='sos_active_timestamp_idx'),
+            # The fan-out sweep only looks at alerts not sent yet
+            models.Index(fields=['timestamp'], condition=models.Q(fanout_status__in=['pending', 'sending']),
+                         name='sos_fanout_unsent_idx'),
+        ]
+
     def __str__(self):
         lat = f"{self.latitude:.4f}" if self.latitude is not None else "None"
         lon = f"{self.longitude:.4f}" if self.longitude is not None else "None"
@@ -21,6 +52,30 @@ class SOSAlert(models.Model):
     def location(self):
         return (self.latitude, self.longitude) if self.latitude and self.longitude else None
 
+    @property
+    def queued_ms(self):
+        """Milliseconds from creation until a fan-out worker picked the alert up."""
+        return _elapsed_ms(self.timestamp, self.fanout_started_at)
+
+    @property
+    def sent_ms(self):
+        """Milliseconds from creation until every push was handed to Expo."""
+        return _elapsed_ms(self.timestamp, self.fanout_finished_at)
+
+    @property
+    def delivered_ms(self):
+        """
+        Milliseconds from creation until receipts confirmed a push reached a device. Expo does not
+        say when a device got the push, so this is an upper bound: receipts are checked
+        SOS_RECEIPT_DELAY seconds after sending.
+        """
+        return _elapsed_ms(self.timestamp, self.receipts_checked_at) if self.push_delivered else None
+
+
+def _elapsed_ms(start, end):
+    return round((end - start).total_seconds() * 1000) if start and end else None
+
+
 class EmergencyContact(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='emergency_contacts')
     contact = models.ForeignKey(User, on_delete=models.CASCADE, related_name='emergency_contact_of')
@@ -30,4 +85,23 @@ class EmergencyContact(models.Model):
         unique_together = ('user', 'contact')
 
     def __str__(self):
-        return f"{str(self.contact)} is an emergency contact for {str(self.user)}"  # Use str() for both
\ No newline at end of file
+        return f"{str(self.contact)} is an emergency contact for {str(self.user)}"  # Use str() for both
+
+@receiver(post_save, sender=User)
+def track_user_location(sender, instance, update_fields=None, **kwargs):
+    if update_fields is not None and not {'latitude', 'longitude'} & update_fields:
+        return
+    # Applied on commit, so a rolled-back location change never reaches the index
+    transaction.on_commit(partial(index_saved_location, instance.pk, instance.latitude, instance.longitude))
+
+
+def index_saved_location(user_id, lat, lng):
+    # A queued ping is newer than a position loaded with the user before the save, and is
+    # already in the index; a full save of a stale instance must not move the user back.
+    if not location_writes.has_pending(user_id):
+        nearby_users.update(user_id, lat, lng)
+
+
+@receiver(post_delete, sender=User)
+def forget_user_location(sender, instance, **kwargs):
+    transaction.on_commit(partial(nearby_users.remove, instance.pk))
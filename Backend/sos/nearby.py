@@ -0,0 +1,255 @@
+"""
+In-process spatial index of user locations, for finding the users near an SOS alert.
+
+Users are bucketed by the same lat/lng grid as ride search (rides.geo, ~1.1 km cells), so a
+"within R km" query reads the few cells around the alert and checks only their users with
+haversine. The index is loaded from the database on first use and kept current by the User
+save/delete receivers in sos.models and by location pings (sos.locations).
+
+Pings received by other processes reach the database when their buffer is flushed, stamped with
+``location_updated_at``. A lookup made ``SOS_NEARBY_INDEX_SYNC_INTERVAL`` seconds or more after the
+last sync first reads the users stamped since then, one indexed query, so an alert sees positions at
+most about a flush interval old whichever process took the ping. Saves and deletes made by other
+processes are picked up when the whole index is reloaded, every ``SOS_NEARBY_INDEX_MAX_AGE``
+seconds. Only the first load runs inside a lookup; later reloads run in a background thread while
+lookups keep using the current index, and updates that arrive during a load or sync are applied
+again once it is done.
+
+Road distance is optional: with ``SOS_ROAD_DISTANCE_TOP_K`` set, only that many of the closest
+users are kept and checked by road, on the offline road graph (rides.roads) when one is configured
+and otherwise against the Distance Matrix API if a Google Maps key is set.
+"""
+import logging
+import math
+import threading
+import time
+
+from datetime import timedelta
+
+import requests
+from django.conf import settings
+from django.db import close_old_connections
+from django.utils import timezone
+
+from RideShare.conf import setting_default
+from rides.geo import covering_cells, grid_cell, haversine_km
+from rides.roads import road_graph
+from users.models import User
+
+logger = logging.getLogger(__name__)
+
+DISTANCE_MATRIX_URL = "https://maps.googleapis.com/maps/api/distancematrix/json"
+# The Distance Matrix API takes at most 25 destinations per origin
+DISTANCE_MATRIX_MAX_DESTINATIONS = 25
+# A sync rereads users stamped this long before the previous one, for flushes that took their
+# timestamp before it but committed after
+SYNC_OVERLAP = timedelta(seconds=10)
+
+
+class NearbyUserIndex:
+    def __init__(self, max_age=None, sync_interval=None):
+        self._max_age = max_age
+        self._sync_interval = sync_interval
+        self._cells = {}  # grid cell -> {user_id: (lat, lng)}
+        self._locations = {}  # user_id -> grid cell
+        self._loaded_at = None
+        # When the index last read the database: monotonic, and as the wall-clock time sync reads from
+        self._synced_at = None
+        self._synced_since = None
+        # {user_id: (lat, lng)} updated while a load reads the database, replayed over its result
+        self._changes = None
+        self._lock = threading.Lock()
+        # Held for a whole load, so only one runs at a time
+        self._reload_lock = threading.Lock()
+
+    @property
+    def max_age(self):
+        return setting_default(self._max_age, 'SOS_NEARBY_INDEX_MAX_AGE')
+
+    @property
+    def sync_interval(self):
+        return setting_default(self._sync_interval, 'SOS_NEARBY_INDEX_SYNC_INTERVAL')
+
+    def __len__(self):
+        return len(self._locations)
+
+    def within(self, lat, lng, radius_km):
+        """Return [(distance_km, user_id)] for every indexed user within radius_km, closest first."""
+        self._ensure_loaded()
+        cells = covering_cells(lat, lng, radius_km)
+        with self._lock:
+            # Near the poles the box covers too many cells; scan everything instead
+            buckets = self._cells.values() if cells is None else filter(None, map(self._cells.get, cells))
+            results = []
+            for bucket in buckets:
+                for user_id, (user_lat, user_lng) in bucket.items():
+                    distance = haversine_km(lat, lng, user_lat, user_lng)
+                    if distance <= radius_km:
+                        results.append((distance, user_id))
+        results.sort()
+        return results
+
+    def update(self, user_id, lat, lng):
+        """Record a user's new location; a missing coordinate removes them. Ignored until loaded."""
+        with self._lock:
+            if self._changes is not None:
+                self._changes[user_id] = (lat, lng)
+            if self._loaded_at is not None:
+                self._place(user_id, lat, lng)
+
+    def locations(self, user_ids):
+        """{user_id: (lat, lng)} for those of user_ids that are indexed."""
+        with self._lock:
+            return {
+                user_id: self._cells[self._locations[user_id]][user_id]
+                for user_id in user_ids if user_id in self._locations
+            }
+
+    def remove(self, user_id):
+        self.update(user_id, None, None)
+
+    def clear(self):
+        with self._lock:
+            self._cells, self._locations, self._loaded_at, self._synced_at = {}, {}, None, None
+
+    def _ensure_loaded(self):
+        loaded_at = self._loaded_at
+        if loaded_at is None:
+            # Nothing to answer from yet, so the first lookup loads the index itself
+            with self._reload_lock:
+                if self._loaded_at is None:
+                    self._load()
+        elif time.monotonic() - loaded_at >= self.max_age and self._reload_lock.acquire(blocking=False):
+            # Stale: keep answering from the current index and reload behind it
+            threading.Thread(target=self._reload, name='nearby-index-reload', daemon=True).start()
+        elif time.monotonic() - self._synced_at >= self.sync_interval and self._reload_lock.acquire(blocking=False):
+            # Pings other processes have written since the last sync; skipped while a reload runs
+            try:
+                self._load(since=self._synced_since - SYNC_OVERLAP)
+            except Exception:
+                logger.exception("Failed to sync the nearby-user index")
+            finally:
+                self._reload_lock.release()
+
+    def _reload(self):
+        try:
+            self._load()
+        except Exception:
+            # Tried again on the next lookup; the current index is still served
+            logger.exception("Failed to reload the nearby-user index")
+        finally:
+            self._reload_lock.release()
+            close_old_connections()
+
+    def _load(self, since=None):
+        """Load every located user, or with ``since``, lay the users stamped since then over the index."""
+        from .locations import location_writes
+
+        with self._lock:
+            self._changes = {}
+        try:
+            synced_since = timezone.now()
+            # Pings not written yet are newer than the database; taken first, so one written while
+            # the query runs is read back from the database instead
+            unflushed = location_writes.positions()
+            if since is None:
+                users = User.objects.filter(latitude__isnull=False, longitude__isnull=False)
+            else:
+                users = User.objects.filter(location_updated_at__gte=since)
+            locations = list(users.values_list('id', 'latitude', 'longitude'))
+        except Exception:
+            with self._lock:
+                self._changes = None
+            raise
+        with self._lock:
+            if since is None:
+                self._cells, self._locations = {}, {}
+            for user_id, lat, lng in locations:
+                self._place(user_id, lat, lng)
+            for user_id, (lat, lng) in unflushed.items():
+                self._place(user_id, lat, lng)
+            # Saves, deletes and pings that came in while the database was read
+            for user_id, (lat, lng) in self._changes.items():
+                self._place(user_id, lat, lng)
+            self._changes = None
+            self._synced_at, self._synced_since = time.monotonic(), synced_since
+            if since is None:
+                self._loaded_at = self._synced_at
+
+    def _place(self, user_id, lat, lng):
+        old_cell = self._locations.pop(user_id, None)
+        if old_cell is not None:
+            bucket = self._cells[old_cell]
+            del bucket[user_id]
+            if not bucket:
+                del self._cells[old_cell]
+        cell = grid_cell(lat, lng)
+        if cell is not None:
+            self._cells.setdefault(cell, {})[user_id] = (lat, lng)
+            self._locations[user_id] = cell
+
+
+nearby_users = NearbyUserIndex()
+
+
+def find_nearby_user_ids(lat, lng, radius_km):
+    """Ids of users within radius_km of a point, closest first, optionally refined by road distance."""
+    candidates = nearby_users.within(lat, lng, radius_km)
+    top_k = settings.SOS_ROAD_DISTANCE_TOP_K
+    if top_k:
+        graph = road_graph()
+        if graph is not None:
+            return refine_by_road_graph(graph, lat, lng, candidates[:top_k], radius_km)
+        if settings.GOOGLE_MAPS_API_KEY:
+            return refine_by_road_distance(lat, lng, candidates[:top_k], radius_km)
+    return [user_id for _, user_id in candidates]
+
+
+def refine_by_road_graph(graph, lat, lng, candidates, radius_km):
+    """
+    Keep the candidates who can reach the alert within radius_km by road, closest by road first.
+    Users off the graph keep their straight-line distance.
+    """
+    points = nearby_users.locations([user_id for _, user_id in candidates])
+    candidates = [(distance, user_id) for distance, user_id in candidates if user_id in points]
+    if not candidates:
+        return []
+    lats, lngs = zip(*(points[user_id] for _, user_id in candidates))
+    road_km = graph.distances_to(lat, lng, lats, lngs, max_km=radius_km)
+    distances = [
+        straight_km if math.isnan(distance) else distance
+        for distance, (straight_km, _) in zip(road_km.tolist(), candidates)
+    ]
+    return [user_id for distance, (_, user_id) in sorted(zip(distances, candidates)) if distance <= radius_km]
+
+
+def refine_by_road_distance(lat, lng, candidates, radius_km):
+    """
+    Keep the candidates whose road distance is within radius_km. If the API fails, the straight-line
+    result stands: an SOS must never fail because of a maps outage.
+    """
+    user_ids = [user_id for _, user_id in candidates]
+    points = {user_id: point for user_id, *point in
+              User.objects.filter(id__in=user_ids).values_list('id', 'latitude', 'longitude')}
+    kept = []
+    for start in range(0, len(user_ids), DISTANCE_MATRIX_MAX_DESTINATIONS):
+        chunk = [user_id for user_id in user_ids[start:start + DISTANCE_MATRIX_MAX_DESTINATIONS] if user_id in points]
+        try:
+            response = requests.get(DISTANCE_MATRIX_URL, params={
+                'origins': f"{lat},{lng}",
+                'destinations': '|'.join(f"{points[user_id][0]},{points[user_id][1]}" for user_id in chunk),
+                'units': 'metric',
+                'key': settings.GOOGLE_MAPS_API_KEY,
+            }, timeout=settings.SOS_ROAD_DISTANCE_TIMEOUT)
+            data = response.json()
+            if data['status'] != 'OK':
+                raise ValueError(data.get('error_message', data['status']))
+            elements = data['rows'][0]['elements']
+        except (requests.RequestException, ValueError, KeyError, IndexError) as e:
+            logger.warning(f"Road distance refinement failed, using straight-line distance: {e}")
+            return user_ids
+        kept += [
+            user_id for user_id, element in zip(chunk, elements)
+            if element['status'] != 'OK' or element['distance']['value'] <= radius_km * 1000
+        ]
+    return kept
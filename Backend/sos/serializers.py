@@ -2,8 +2,12 @@
 from rest_framework import serializers
 from .models import SOSAlert, EmergencyContact
 from users.models import User
-import requests
+from .nearby import find_nearby_user_ids
+from notifications.push import forget_unregistered_tokens, push_client
 from django.conf import settings
+import logging
+
+logger = logging.getLogger(__name__)
 
 class UserSerializer(serializers.ModelSerializer):
     class Meta:
@@ -56,71 +60,37 @@ class SOSAlertSerializer(serializers.ModelSerializer):
 
         if notified_users:
             sos_alert.notified_users.set(notified_users)
-        elif is_community_alert:
-            nearby_users = self.get_nearby_users(sos_alert.latitude, sos_alert.longitude)
-            sos_alert.notified_users.set(nearby_users.exclude(id=user.id))
-        else:
-            nearby_users = self.get_nearby_users(sos_alert.latitude, sos_alert.longitude)
-            sos_alert.notified_users.set(nearby_users.exclude(id=user.id))
-
-        custom_message = user.emergency_message or "An SOS alert has been created near you."
-        self.send_expo_notifications(sos_alert, custom_message)
+        # Nearby users and pushes are left to the fan-out workers (sos.fanout)
         return sos_alert
 
-    def get_nearby_users(self, latitude, longitude, radius_km=5):
-        users = User.objects.filter(latitude__isnull=False, longitude__isnull=False)
-        if not users.exists():
-            return User.objects.none()
-
-        origin = f"{latitude},{longitude}"
-        destinations = '|'.join(f"{user.latitude},{user.longitude}" for user in users)
-        url = (
-            f"https://maps.googleapis.com/maps/api/distancematrix/json?"
-            f"origins={origin}&destinations={destinations}&units=metric&key={settings.GOOGLE_MAPS_API_KEY}"
-        )
-        response = requests.get(url)
-        data = response.json()
-
-        if data['status'] != 'OK':
-            raise serializers.ValidationError("Error with Google Maps API: " + data.get('error_message', 'Unknown error'))
-
-        nearby_users = []
-        for i, row in enumerate(data['rows'][0]['elements']):
-            if row['status'] == 'OK':
-                distance_m = row['distance']['value']
-                if distance_m <= radius_km * 1000:
-                    nearby_users.append(users[i])
-
-        return User.objects.filter(id__in=[user.id for user in nearby_users])
+    def get_nearby_users(self, latitude, longitude, radius_km=None):
+        # Answered from the in-process spatial index; no per-user Distance Matrix call (sos.nearby)
+        radius_km = radius_km or settings.SOS_NEARBY_RADIUS_KM
+        return User.objects.filter(id__in=find_nearby_user_ids(latitude, longitude, radius_km))
 
     def send_expo_notifications(self, sos_alert, custom_message=None):
-        notified = sos_alert.notified_users.all()
-        if not notified:
-            return
-
-        messages = []
-        for user in notified:
-            if user.expo_push_token:
-                message_body = custom_message.format(location=sos_alert.location) if custom_message else f"An SOS alert has been created near you at {sos_alert.location}."
-                messages.append({
-                    "to": user.expo_push_token,
-                    "sound": "default",
-                    "title": "SOS Alert",
-                    "body": message_body,
-                    "data": {"sos_alert_id": sos_alert.id}
-                })
-
-        if not messages:
-            return
-
-        url = "https://exp.host/--/api/v2/push/send"
-        headers = {
-            "Accept": "application/json",
-            "Content-Type": "application/json"
-        }
-        response = requests.post(url, json=messages, headers=headers)
-
-        if response.status_code != 200:
-            print(f"Failed to send Expo notifications: {response.text}")
-        else:
-            print(f"Expo notifications sent successfully to {len(messages)} users")
\ No newline at end of file
+        # Chunked, pooled and sent concurrently, with retries (notifications.push)
+        tokens = list(dict.fromkeys(
+            sos_alert.notified_users.exclude(expo_push_token__isnull=True).exclude(expo_push_token='')
+            .values_list('expo_push_token', flat=True)
+        ))
+        if not tokens:
+            return []
+
+        message_body = custom_message.format(location=sos_alert.location) if custom_message else f"An SOS alert has been created near you at {sos_alert.location}."
+        messages = [
+            {
+                "to": token,
+                "sound": "default",
+                "title": "SOS Alert",
+                "body": message_body,
+                "data": {"sos_alert_id": sos_alert.id}
+            }
+            for token in tokens
+        ]
+        tickets = push_client.send(messages)
+        forget_unregistered_tokens(tickets)
+        accepted = sum(1 for ticket in tickets if ticket.ok)
+        if accepted < len(tickets):
+            logger.warning(f"SOS alert {sos_alert.id}: Expo accepted {accepted} of {len(tickets)} notifications")
+        return tickets
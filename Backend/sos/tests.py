@@ -1,16 +1,41 @@
-from django.test import TestCase
+import json
+import os
+import random
+import tempfile
+import threading
+import time
+from datetime import timedelta
+from io import StringIO
+
+import requests
+from asgiref.sync import async_to_sync
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+from django.core.management import call_command
+from django.test import TestCase, TransactionTestCase, override_settings
 from rest_framework.test import APITestCase, APIClient
 from rest_framework import status
 from django.urls import reverse
 from django.contrib.auth import get_user_model
+from .fanout import claim_alert
+from .locations import LocationWriteBuffer, location_writes
 from .models import SOSAlert, EmergencyContact
+from .nearby import NearbyUserIndex, find_nearby_user_ids, nearby_users
+from .routing import websocket_urlpatterns
 from .serializers import SOSAlertSerializer
+from RideShare.bench import local_expo_server
+from chat.auth import JWTAuthMiddleware
+from rides.geo import haversine_km
+from rides.roads import RoadGraph
+from rides.tests import QueryPlanAssertions
 from users.models import User
 from django.utils import timezone
 from unittest.mock import patch
+from rest_framework_simplejwt.tokens import AccessToken
 
 User = get_user_model()
 
+@override_settings(SOS_FANOUT_WORKERS=0)  # Fan out inline once the create request commits
 class SOSBackendTests(APITestCase):
     def setUp(self):
         # Set up the API client
@@ -65,12 +90,12 @@ class SOSBackendTests(APITestCase):
 
     # Test SOS Alert Creation
     @patch('sos.serializers.SOSAlertSerializer.get_nearby_users')
-    @patch('requests.post')  # Mock Expo notifications
-    def test_create_sos_alert_success(self, mock_post, mock_get_nearby_users):
+    @patch('sos.serializers.push_client.send')  # Mock Expo notifications
+    def test_create_sos_alert_success(self, mock_send, mock_get_nearby_users):
         # Mock the get_nearby_users method
         mock_get_nearby_users.side_effect = self.mock_get_nearby_users
         # Mock the Expo notification response
-        mock_post.return_value.status_code = 200
+        mock_send.return_value = []
 
         url = reverse('create-sos')
         data = {
@@ -78,7 +103,8 @@ class SOSBackendTests(APITestCase):
             'longitude': -74.0060,
             'is_community_alert': False
         }
-        response = self.client.post(url, data, format='json')
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(url, data, format='json')
         self.assertEqual(response.status_code, status.HTTP_201_CREATED)
         self.assertEqual(SOSAlert.objects.count(), 1)
         sos_alert = SOSAlert.objects.first()
@@ -89,6 +115,19 @@ class SOSBackendTests(APITestCase):
         self.assertIn(self.user2, sos_alert.notified_users.all())
         self.assertNotIn(self.user3, sos_alert.notified_users.all())
 
+    @patch('sos.serializers.SOSAlertSerializer.get_nearby_users')
+    def test_create_sos_alert_pushes_to_nearby_users(self, mock_get_nearby_users):
+        mock_get_nearby_users.side_effect = self.mock_get_nearby_users
+        with local_expo_server() as server, self.settings(EXPO_PUSH_URL=server.url):
+            with self.captureOnCommitCallbacks(execute=True):
+                response = self.client.post(reverse('create-sos'), {'latitude': 40.7128, 'longitude': -74.0060},
+                                            format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        (path, messages), (receipts_path, _) = server.requests
+        self.assertEqual((path, receipts_path), ('/send', '/getReceipts'))
+        self.assertEqual([message['to'] for message in messages], ['ExponentPushToken[def456]'])
+        self.assertEqual(messages[0]['data'], {'sos_alert_id': response.data['id']})
+
     def test_create_sos_alert_missing_location(self):
         url = reverse('create-sos')
         data = {
@@ -158,12 +197,12 @@ class SOSBackendTests(APITestCase):
 
     # Test SOS Alert with Emergency Contacts
     @patch('sos.serializers.SOSAlertSerializer.get_nearby_users')
-    @patch('requests.post')  # Mock Expo notifications
-    def test_sos_alert_notifies_emergency_contacts(self, mock_post, mock_get_nearby_users):
+    @patch('sos.serializers.push_client.send')  # Mock Expo notifications
+    def test_sos_alert_notifies_emergency_contacts(self, mock_send, mock_get_nearby_users):
         # Mock the get_nearby_users method
         mock_get_nearby_users.side_effect = self.mock_get_nearby_users
         # Mock the Expo notification response
-        mock_post.return_value.status_code = 200
+        mock_send.return_value = []
 
         # Add user2 as an emergency contact for user1
         EmergencyContact.objects.create(user=self.user1, contact=self.user2)
@@ -173,10 +212,418 @@ class SOSBackendTests(APITestCase):
             'longitude': -74.0060,
             'is_community_alert': False
         }
-        response = self.client.post(url, data, format='json')
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(url, data, format='json')
         self.assertEqual(response.status_code, status.HTTP_201_CREATED)
         sos_alert = SOSAlert.objects.first()
         # user2 should be notified because they are an emergency contact
         self.assertIn(self.user2, sos_alert.notified_users.all())
         # user3 should not be notified (mocked as not nearby)
-        self.assertNotIn(self.user3, sos_alert.notified_users.all())
\ No newline at end of file
+        self.assertNotIn(self.user3, sos_alert.notified_users.all())
+
+@override_settings(SOS_FANOUT_WORKERS=0)
+class SOSFanoutTests(APITestCase):
+    def setUp(self):
+        nearby_users.clear()
+        self.sender = User.objects.create_user(email='sender@northsouth.edu', first_name='Sender', last_name='User',
+                                               student_id='700001', latitude=23.78, longitude=90.40)
+        self.neighbour = User.objects.create_user(
+            email='neighbour@northsouth.edu', first_name='Near', last_name='User', student_id='700002',
+            latitude=23.781, longitude=90.401, expo_push_token='ExponentPushToken[neighbour]',
+        )
+        self.client.force_authenticate(user=self.sender)
+
+    def create_alert(self, execute=True):
+        with self.captureOnCommitCallbacks(execute=execute) as callbacks:
+            response = self.client.post(reverse('create-sos'), {'latitude': 23.78, 'longitude': 90.40}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        return response, callbacks
+
+    def test_create_returns_before_fan_out(self):
+        with patch('sos.serializers.push_client.send') as mock_send:
+            response, callbacks = self.create_alert(execute=False)
+            alert = SOSAlert.objects.get(id=response.data['id'])
+            self.assertEqual(response.data['fanout_status'], 'pending')
+            self.assertFalse(alert.notified_users.exists())
+            mock_send.assert_not_called()
+
+            mock_send.return_value = []
+            for callback in callbacks:
+                callback()
+        alert.refresh_from_db()
+        self.assertEqual(alert.fanout_status, 'sent')
+        self.assertEqual(list(alert.notified_users.all()), [self.neighbour])
+
+    def test_status_endpoint_reports_delivery(self):
+        with local_expo_server() as server, self.settings(EXPO_PUSH_URL=server.url):
+            response, _ = self.create_alert()
+
+        status_response = self.client.get(response.data['status_url'])
+        self.assertEqual(status_response.status_code, status.HTTP_200_OK)
+        data = status_response.data
+        self.assertEqual(
+            (data['fanout_status'], data['notified_count'], data['push_sent'], data['push_delivered']),
+            ('sent', 1, 1, 1),
+        )
+        self.assertTrue(data['receipts_checked'])
+        self.assertGreaterEqual(data['sent_ms'], data['queued_ms'])
+        self.assertGreaterEqual(data['delivered_ms'], data['sent_ms'])
+
+        self.client.force_authenticate(user=self.neighbour)
+        self.assertEqual(self.client.get(response.data['status_url']).status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_nobody_to_notify_fails_the_fan_out(self):
+        self.neighbour.latitude = self.neighbour.longitude = None
+        with self.captureOnCommitCallbacks(execute=True):
+            self.neighbour.save()
+        response, _ = self.create_alert()
+
+        data = self.client.get(response.data['status_url']).data
+        self.assertEqual((data['fanout_status'], data['error']), ('failed', "No emergency contacts found to notify."))
+
+    @patch('sos.serializers.push_client.send', return_value=[])
+    def test_command_dispatches_alerts_left_pending(self, mock_send):
+        response, _ = self.create_alert(execute=False)
+        SOSAlert.objects.filter(id=response.data['id']).update(timestamp=timezone.now() - timedelta(minutes=5))
+
+        out = StringIO()
+        call_command('dispatch_sos_alerts', stdout=out)
+        self.assertIn("Dispatched 1 pending SOS alerts", out.getvalue())
+        self.assertEqual(SOSAlert.objects.get(id=response.data['id']).fanout_status, 'sent')
+        # Already claimed: a second run does not send again
+        call_command('dispatch_sos_alerts', stdout=StringIO())
+        self.assertEqual(mock_send.call_count, 1)
+
+    @patch('sos.serializers.push_client.send', return_value=[])
+    def test_alert_abandoned_after_its_claim_is_sent_once_the_lease_runs_out(self, mock_send):
+        response, _ = self.create_alert(execute=False)
+        alert_id = response.data['id']
+        SOSAlert.objects.filter(id=alert_id).update(timestamp=timezone.now() - timedelta(minutes=5))
+        # The worker died right after claiming the alert
+        self.assertTrue(claim_alert(alert_id))
+
+        # Still within the lease: another worker cannot take it
+        self.assertFalse(claim_alert(alert_id))
+        call_command('dispatch_sos_alerts', stdout=StringIO())
+        self.assertEqual(SOSAlert.objects.get(id=alert_id).fanout_status, 'sending')
+        mock_send.assert_not_called()
+
+        SOSAlert.objects.filter(id=alert_id).update(fanout_started_at=timezone.now() - timedelta(minutes=3))
+        out = StringIO()
+        call_command('dispatch_sos_alerts', stdout=out)
+        self.assertIn("Dispatched 1 pending SOS alerts", out.getvalue())
+        self.assertEqual(SOSAlert.objects.get(id=alert_id).fanout_status, 'sent')
+        self.assertEqual(mock_send.call_count, 1)
+
+
+@override_settings(SOS_FANOUT_WORKERS=2, SOS_RECEIPT_DELAY=0)
+class SOSFanoutWorkerTests(TransactionTestCase):
+    def test_worker_fans_out_after_the_response(self):
+        nearby_users.clear()
+        sender = User.objects.create_user(email='sender@northsouth.edu', first_name='Sender', last_name='User',
+                                          student_id='700001', latitude=23.78, longitude=90.40)
+        User.objects.create_user(email='neighbour@northsouth.edu', first_name='Near', last_name='User',
+                                 student_id='700002', latitude=23.781, longitude=90.401,
+                                 expo_push_token='ExponentPushToken[neighbour]')
+        client = APIClient()
+        client.force_authenticate(user=sender)
+
+        with local_expo_server(latency=0.2) as server, self.settings(EXPO_PUSH_URL=server.url):
+            start = time.monotonic()
+            response = client.post(reverse('create-sos'), {'latitude': 23.78, 'longitude': 90.40}, format='json')
+            # The push round trip is not part of the request
+            self.assertLess(time.monotonic() - start, 0.2)
+            self.assertEqual(response.data['fanout_status'], 'pending')
+
+            deadline = time.monotonic() + 5
+            while time.monotonic() < deadline:
+                alert = SOSAlert.objects.get(id=response.data['id'])
+                if alert.receipts_checked_at is not None:
+                    break
+                time.sleep(0.05)
+        self.assertEqual((alert.fanout_status, alert.push_sent, alert.push_delivered), ('sent', 1, 1))
+        self.assertGreaterEqual(alert.sent_ms, 200)
+
+
+class NearbyUserIndexTests(TestCase):
+    def setUp(self):
+        # The index is per process and user ids are reused between tests
+        nearby_users.clear()
+        rng = random.Random(7)
+        # Scattered over ~30 km around Dhaka
+        self.points = {}
+        for i in range(300):
+            lat, lng = 23.78 + rng.uniform(-0.15, 0.15), 90.40 + rng.uniform(-0.15, 0.15)
+            user = User.objects.create_user(
+                email=f'near{i}@northsouth.edu', first_name='Near', last_name=str(i),
+                student_id=f'9{i:05d}', latitude=lat, longitude=lng,
+            )
+            self.points[user.id] = (lat, lng)
+
+    def brute_force(self, lat, lng, radius_km):
+        return sorted(
+            (haversine_km(lat, lng, *point), user_id) for user_id, point in self.points.items()
+            if haversine_km(lat, lng, *point) <= radius_km
+        )
+
+    def test_matches_brute_force_haversine(self):
+        for lat, lng, radius_km in [(23.78, 90.40, 5), (23.70, 90.30, 2), (23.90, 90.55, 10), (23.78, 90.40, 0.5)]:
+            self.assertEqual(nearby_users.within(lat, lng, radius_km), self.brute_force(lat, lng, radius_km))
+
+    def test_follows_location_updates_after_loading(self):
+        user_id = next(iter(self.points))
+        nearby_users.within(23.78, 90.40, 1)
+        user = User.objects.get(id=user_id)
+        user.latitude, user.longitude = 10.0, 10.0
+        with self.captureOnCommitCallbacks(execute=True):
+            user.save()
+
+        self.assertNotIn(user_id, [found for _, found in nearby_users.within(*self.points[user_id], 0.1)])
+        self.assertEqual(nearby_users.within(10.0, 10.0, 0.1), [(0.0, user_id)])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            user.delete()
+        self.assertEqual(nearby_users.within(10.0, 10.0, 0.1), [])
+
+    @patch('sos.nearby.requests.get')
+    def test_nearby_lookup_makes_no_http_call(self, mock_get):
+        with self.assertNumQueries(2):  # Index load, then the returned queryset
+            users = list(SOSAlertSerializer().get_nearby_users(23.78, 90.40))
+        self.assertEqual({user.id for user in users}, {user_id for _, user_id in self.brute_force(23.78, 90.40, 5)})
+        mock_get.assert_not_called()
+
+    @override_settings(SOS_ROAD_DISTANCE_TOP_K=3, GOOGLE_MAPS_API_KEY='test-key')
+    @patch('sos.nearby.requests.get')
+    def test_road_distance_refines_only_the_closest(self, mock_get):
+        mock_get.return_value.json.return_value = {'status': 'OK', 'rows': [{'elements': [
+            {'status': 'OK', 'distance': {'value': 900}},
+            {'status': 'OK', 'distance': {'value': 9000}},
+            {'status': 'ZERO_RESULTS'},
+        ]}]}
+        closest = [user_id for _, user_id in self.brute_force(23.78, 90.40, 5)[:3]]
+
+        self.assertEqual(find_nearby_user_ids(23.78, 90.40, 5), [closest[0], closest[2]])
+        self.assertEqual(mock_get.call_count, 1)
+
+        mock_get.side_effect = requests.Timeout
+        self.assertEqual(find_nearby_user_ids(23.78, 90.40, 5), closest)
+
+    @patch('sos.nearby.requests.get')
+    def test_road_graph_refines_without_http(self, mock_get):
+        # Away from the random users: the first has a street straight to the alert, the second's
+        # only way round is a ~17 km detour and the third is off the graph, so keeps their
+        # straight-line distance
+        alert, detour = (10.0, 10.0), (10.08, 10.01)
+        points = [(10.005, 10.0), (10.0, 10.01), (9.99, 9.99)]
+        user_ids = [
+            User.objects.create_user(email=f'road{i}@northsouth.edu', first_name='Road', last_name=str(i),
+                                     student_id=f'8{i:05d}', latitude=lat, longitude=lng).id
+            for i, (lat, lng) in enumerate(points)
+        ]
+        lats, lngs = zip(alert, points[0], points[1], detour)
+        graph = RoadGraph.from_edges(lats, lngs, [1, 2, 3], [0, 3, 0])
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, 'roads.graph')
+            graph.save(path)
+            with self.settings(SOS_ROAD_DISTANCE_TOP_K=3, GOOGLE_MAPS_API_KEY='test-key', ROAD_GRAPH_PATH=path):
+                self.assertEqual(find_nearby_user_ids(*alert, 5), [user_ids[0], user_ids[2]])
+        mock_get.assert_not_called()
+
+    @override_settings(SOS_ROAD_DISTANCE_TOP_K=5, GOOGLE_MAPS_API_KEY=None,
+                       ROAD_GRAPH_PATH='/nonexistent/sos-test-roads.graph')
+    def test_missing_road_graph_falls_back_to_straight_line(self):
+        with self.assertLogs('rides.roads', 'ERROR'):
+            found = find_nearby_user_ids(23.78, 90.40, 5)
+        self.assertEqual(found, [user_id for _, user_id in self.brute_force(23.78, 90.40, 5)])
+
+
+class NearbyUserIndexReloadTests(TransactionTestCase):
+    def test_stale_index_is_reloaded_behind_lookups(self):
+        users = [
+            User.objects.create_user(email=f'reload{i}@northsouth.edu', first_name='Reload', last_name=str(i),
+                                     student_id=f'72{i:04d}', latitude=23.78, longitude=90.40)
+            for i in range(2)
+        ]
+        index = NearbyUserIndex(max_age=0.01)
+        self.assertEqual(len(index.within(23.78, 90.40, 1)), 2)
+        User.objects.filter(id=users[1].id).update(latitude=10.0, longitude=10.0)
+
+        reading, release = threading.Event(), threading.Event()
+
+        def slow_positions():
+            reading.set()
+            release.wait(5)
+            return {}
+
+        time.sleep(0.02)
+        with patch.object(location_writes, 'positions', side_effect=slow_positions):
+            start = time.monotonic()
+            # Answered from the stale index while the reload waits on the database
+            self.assertEqual(len(index.within(23.78, 90.40, 1)), 2)
+            self.assertLess(time.monotonic() - start, 1)
+            self.assertTrue(reading.wait(5))
+            # A ping that comes in during the reload, and is not in the database it reads
+            index.update(users[0].id, 11.0, 11.0)
+            release.set()
+            self.assertTrue(index._reload_lock.acquire(timeout=5))
+            index._reload_lock.release()
+
+        index._max_age = 3600  # No further reload while checking the result
+        self.assertEqual(index.within(23.78, 90.40, 1), [])
+        self.assertEqual(index.within(10.0, 10.0, 0.1), [(0.0, users[1].id)])
+        self.assertEqual(index.within(11.0, 11.0, 0.1), [(0.0, users[0].id)])
+
+    def test_pings_written_by_another_process_are_synced(self):
+        user = User.objects.create_user(email='synced@northsouth.edu', first_name='Sync', last_name='Ed',
+                                        student_id='720100', latitude=23.78, longitude=90.40)
+        index = NearbyUserIndex(max_age=3600, sync_interval=0)
+        stale = NearbyUserIndex(max_age=3600, sync_interval=3600)
+        self.assertEqual(len(index.within(23.78, 90.40, 1)), 1)
+        self.assertEqual(len(stale.within(23.78, 90.40, 1)), 1)
+
+        # Another process's buffer: the ping never reaches these indexes, only the database
+        other = LocationWriteBuffer(flush_interval=3600)
+        other.pending[user.id] = (10.0, 10.0)
+        other.flush()
+
+        self.assertEqual(index.within(10.0, 10.0, 0.1), [(0.0, user.id)])
+        self.assertEqual(index.within(23.78, 90.40, 1), [])
+        # Until its next sync the other index still has the old position
+        self.assertEqual(stale.within(10.0, 10.0, 0.1), [])
+
+
+@override_settings(LOCATION_FLUSH_INTERVAL=3600)  # Written only when a test flushes
+class LocationUpdateTests(APITestCase):
+    def setUp(self):
+        nearby_users.clear()
+        location_writes.pending.clear()
+        self.users = [
+            User.objects.create_user(email=f'pinger{i}@northsouth.edu', first_name='Ping', last_name=str(i),
+                                     student_id=f'71{i:04d}', latitude=23.78, longitude=90.40)
+            for i in range(3)
+        ]
+
+    def ping(self, user, latitude, longitude):
+        self.client.force_authenticate(user=user)
+        return self.client.post(reverse('location-update'), {'latitude': latitude, 'longitude': longitude},
+                                format='json')
+
+    def test_pings_are_coalesced_into_one_batched_write(self):
+        nearby_users.within(23.78, 90.40, 1)
+        for step in range(5):
+            for i, user in enumerate(self.users):
+                response = self.ping(user, 10.0 + i, 10.0 + step / 1000)
+                self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+
+        # Not in the database yet, but SOS proximity already sees the latest positions
+        self.assertEqual(User.objects.filter(latitude=23.78).count(), 3)
+        self.assertEqual(len(location_writes), 3)
+        self.assertEqual(nearby_users.within(11.0, 10.004, 0.1), [(0.0, self.users[1].id)])
+
+        with self.assertNumQueries(3):  # One executemany for all three users, inside a savepoint
+            self.assertEqual(location_writes.flush(), 3)
+        self.assertEqual(
+            sorted(User.objects.filter(id__in=[user.id for user in self.users]).values_list('latitude', 'longitude')),
+            [(10.0, 10.004), (11.0, 10.004), (12.0, 10.004)],
+        )
+        self.assertEqual(location_writes.flush(), 0)
+
+    def test_index_reload_keeps_unwritten_pings(self):
+        self.ping(self.users[0], 10.0, 10.0)
+        nearby_users.clear()
+        self.assertEqual(nearby_users.within(10.0, 10.0, 0.1), [(0.0, self.users[0].id)])
+        self.assertNotIn(self.users[0].id, [user_id for _, user_id in nearby_users.within(23.78, 90.40, 1)])
+
+    def test_profile_saves_do_not_undo_a_ping(self):
+        nearby_users.within(23.78, 90.40, 1)
+        user = self.users[0]  # Loaded before the ping, still at its old position
+        self.ping(user, 10.0, 10.0)
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(reverse('user-settings'), {'sound_enabled': False}, format='json')
+            self.assertEqual(User.objects.get(id=user.id).sound_enabled, False)
+            # A full save of the stale instance (admin, shell) leaves the index alone too
+            user.save()
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(nearby_users.within(10.0, 10.0, 0.1), [(0.0, user.id)])
+
+        location_writes.flush()
+        user.refresh_from_db()
+        self.assertEqual((user.latitude, user.longitude), (10.0, 10.0))
+
+    def test_rejects_bad_coordinates(self):
+        for body in [{'latitude': 91, 'longitude': 0}, {'latitude': 'north', 'longitude': 0}, {'latitude': 1}]:
+            self.client.force_authenticate(user=self.users[0])
+            response = self.client.post(reverse('location-update'), body, format='json')
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+            self.assertIn('error', response.data)
+        self.assertEqual(len(location_writes), 0)
+
+    @override_settings(LOCATION_FLUSH_INTERVAL=0)
+    def test_writes_each_ping_without_a_flush_interval(self):
+        self.ping(self.users[0], 10.0, 10.0)
+        self.users[0].refresh_from_db()
+        self.assertEqual((self.users[0].latitude, self.users[0].longitude), (10.0, 10.0))
+
+
+class LocationSocketTests(TransactionTestCase):
+    def setUp(self):
+        nearby_users.clear()
+        location_writes.pending.clear()
+        self.user = User.objects.create_user(email='socket@northsouth.edu', first_name='Socket', last_name='User',
+                                             student_id='720001', latitude=23.78, longitude=90.40)
+
+    def socket(self, token=None):
+        return WebsocketCommunicator(
+            JWTAuthMiddleware(URLRouter(websocket_urlpatterns)), '/ws/location/',
+            headers=[(b'authorization', f'Bearer {token or AccessToken.for_user(self.user)}'.encode())],
+        )
+
+    @override_settings(LOCATION_FLUSH_INTERVAL=3600)
+    def test_socket_pings_are_queued(self):
+        async def scenario():
+            communicator = self.socket()
+            connected, _ = await communicator.connect()
+            for step in range(3):
+                await communicator.send_to(text_data=json.dumps({'lat': 10.0, 'lng': 10.0 + step / 1000}))
+            await communicator.send_to(text_data=json.dumps({'lat': 'x', 'lng': 0}))
+            error = await communicator.receive_json_from()
+            await communicator.disconnect()
+            return connected, error
+
+        connected, error = async_to_sync(scenario)()
+        self.assertTrue(connected)
+        self.assertIn('error', error)
+        self.assertEqual(location_writes.positions(), {self.user.id: (10.0, 10.002)})
+
+        location_writes.flush()
+        self.user.refresh_from_db()
+        self.assertEqual((self.user.latitude, self.user.longitude), (10.0, 10.002))
+
+    def test_anonymous_socket_is_refused(self):
+        async def scenario():
+            communicator = self.socket(token='not-a-token')
+            connected, code = await communicator.connect()
+            return connected, code
+
+        self.assertEqual(async_to_sync(scenario)(), (False, 4403))
+
+    def test_flush_thread_writes_queued_pings(self):
+        buffer = LocationWriteBuffer(flush_interval=0.05)
+        self.addCleanup(buffer.stop)
+        buffer.add(self.user.id, 10.0, 10.0)
+        deadline = time.monotonic() + 5
+        while time.monotonic() < deadline:
+            self.user.refresh_from_db()
+            if self.user.latitude == 10.0:
+                break
+            time.sleep(0.02)
+        self.assertEqual((self.user.latitude, self.user.longitude), (10.0, 10.0))
+
+
+class SOSQueryPlanTests(QueryPlanAssertions, TestCase):
+    def test_active_sos_alerts_use_partial_index(self):
+        user = User.objects.create_user(email='viewer@northsouth.edu', first_name='View', last_name='Er',
+                                        student_id='730001')
+        # The query ActiveSOSAlertsView runs
+        alerts = SOSAlert.objects.filter(status='active').exclude(user=user)
+        self.assertUsesIndex(alerts, 'sos_active_timestamp_idx')
@@ -1,9 +1,11 @@
 # sos/urls.py
 from django.urls import path
-from .views import CreateSOSAlertView, ActiveSOSAlertsView, UserListView, EmergencyContactView, UserSettingsView
+from .views import CreateSOSAlertView, SOSAlertStatusView, LocationUpdateView, ActiveSOSAlertsView, UserListView, EmergencyContactView, UserSettingsView
 
 urlpatterns = [
     path('create/', CreateSOSAlertView.as_view(), name='create-sos'),
+    path('<int:alert_id>/status/', SOSAlertStatusView.as_view(), name='sos-status'),
+    path('location/', LocationUpdateView.as_view(), name='location-update'),
     path('active/', ActiveSOSAlertsView.as_view(), name='active-sos'),
     path('users/', UserListView.as_view(), name='user-list'),
     path('emergency-contacts/', EmergencyContactView.as_view(), name='emergency-contacts'),
@@ -7,7 +7,12 @@ from .models import SOSAlert, EmergencyContact
 from .serializers import SOSAlertSerializer, UserSerializer, EmergencyContactSerializer
 from users.models import User
 from django.contrib.auth import get_user_model
+from django.db import transaction
 from django.db.models import Q
+from django.urls import reverse
+from functools import partial
+from .fanout import fanout_dispatcher
+from .locations import InvalidLocation, location_writes, parse_location
 
 User = get_user_model()
 
@@ -17,25 +22,55 @@ class CreateSOSAlertView(APIView):
     def post(self, request):
         serializer = SOSAlertSerializer(data=request.data, context={'request': request})
         if serializer.is_valid():
-            sos_alert = serializer.save()
-            
-            if not sos_alert.notified_users.exists() and not sos_alert.is_community_alert:
-                emergency_contacts = EmergencyContact.objects.filter(user=request.user)
-                if emergency_contacts.exists():
-                    notified_users = [ec.contact for ec in emergency_contacts]
-                    sos_alert.notified_users.set(notified_users)
-                    sos_alert.save()
-                else:
-                    return Response(
-                        {"error": "No emergency contacts found to notify."},
-                        status=status.HTTP_400_BAD_REQUEST
-                    )
+            with transaction.atomic():
+                sos_alert = serializer.save()
+                # Acknowledged straight away; workers find who to notify and send the pushes
+                transaction.on_commit(partial(fanout_dispatcher.submit, sos_alert.id))
 
             response_data = serializer.data
-            response_data['notification_status'] = f"Notifications sent to {sos_alert.notified_users.count()} users"
+            response_data['fanout_status'] = sos_alert.fanout_status
+            response_data['notification_status'] = "SOS alert received. Notifying nearby users and emergency contacts."
+            response_data['status_url'] = reverse('sos-status', args=[sos_alert.id])
             return Response(response_data, status=status.HTTP_201_CREATED)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
+class SOSAlertStatusView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, alert_id):
+        try:
+            sos_alert = SOSAlert.objects.get(id=alert_id, user=request.user)
+        except SOSAlert.DoesNotExist:
+            return Response({"error": "SOS alert not found."}, status=status.HTTP_404_NOT_FOUND)
+
+        return Response({
+            'id': sos_alert.id,
+            'status': sos_alert.status,
+            'fanout_status': sos_alert.fanout_status,
+            'error': sos_alert.fanout_error or None,
+            'notified_count': sos_alert.notified_users.count(),
+            'push_sent': sos_alert.push_sent,
+            'push_failed': sos_alert.push_failed,
+            'push_delivered': sos_alert.push_delivered,
+            'receipts_checked': sos_alert.receipts_checked_at is not None,
+            'queued_ms': sos_alert.queued_ms,
+            'sent_ms': sos_alert.sent_ms,
+            'delivered_ms': sos_alert.delivered_ms,
+        }, status=status.HTTP_200_OK)
+
+class LocationUpdateView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request):
+        try:
+            latitude, longitude = parse_location(request.data)
+        except InvalidLocation as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        # Queued and written with other users' pings in one batch (sos.locations)
+        location_writes.add(request.user.id, latitude, longitude)
+        return Response({"latitude": latitude, "longitude": longitude}, status=status.HTTP_202_ACCEPTED)
+
 class ActiveSOSAlertsView(APIView):
     permission_classes = [IsAuthenticated]
 
@@ -120,6 +155,9 @@ class UserSettingsView(APIView):
         user.notifications_enabled = data.get('notifications_enabled', user.notifications_enabled)
         user.vibration_enabled = data.get('vibration_enabled', user.vibration_enabled)
         user.emergency_message = data.get('emergency_message', user.emergency_message)
-        user.save()
+        # Only the settings: a full save would write back the position loaded with request.user
+        user.save(update_fields=[
+            'sound_enabled', 'location_enabled', 'notifications_enabled', 'vibration_enabled', 'emergency_message',
+        ])
 
         return Response({"message": "Settings updated successfully"}, status=status.HTTP_200_OK)
\ No newline at end of file
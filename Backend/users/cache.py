@@ -0,0 +1,42 @@
+"""
+Short-lived cache of User rows for authenticating WebSocket connects.
+
+Entries live in Django's cache for ``WEBSOCKET_USER_CACHE_TTL`` seconds and are deleted once a
+save or delete of the user commits (see the receivers in users.models), so a profile or is_active change
+takes effect on the next connect. With a per-process cache backend, other processes pick the
+change up when their entry expires.
+"""
+from django.conf import settings
+from django.core.cache import cache
+
+from .models import User
+
+
+def user_cache_key(user_id):
+    return f"ws_user_{user_id}"
+
+
+def get_cached_user(user_id):
+    """The user with this id, from the cache when possible. Returns None if there is no such user."""
+    key = user_cache_key(user_id)
+    user = cache.get(key)
+    if user is None:
+        user = User.objects.filter(pk=user_id).first()
+        if user is not None:
+            cache.set(key, user, timeout=settings.WEBSOCKET_USER_CACHE_TTL)
+    return user
+
+
+async def aget_cached_user(user_id):
+    """get_cached_user for async callers, using the async cache and ORM APIs."""
+    key = user_cache_key(user_id)
+    user = await cache.aget(key)
+    if user is None:
+        user = await User.objects.filter(pk=user_id).afirst()
+        if user is not None:
+            await cache.aset(key, user, timeout=settings.WEBSOCKET_USER_CACHE_TTL)
+    return user
+
+
+def invalidate_cached_user(user_id):
+    cache.delete(user_cache_key(user_id))
@@ -1,6 +1,9 @@
 # users/models.py
-from django.db import models
+from functools import partial
+from django.db import models, transaction
 from django.contrib.auth.models import AbstractBaseUser, BaseUserManager, PermissionsMixin
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
 
 class UserManager(BaseUserManager):
     def create_user(self, email, first_name, last_name, student_id=None, password=None, **extra_fields):
@@ -47,6 +50,8 @@ class User(AbstractBaseUser, PermissionsMixin):
     expo_push_token = models.CharField(max_length=255, blank=True, null=True)
     latitude = models.FloatField(blank=True, null=True)
     longitude = models.FloatField(blank=True, null=True)
+    # Set when sos.locations writes a ping, so other processes' SOS indexes (sos.nearby) can sync
+    location_updated_at = models.DateTimeField(blank=True, null=True, editable=False, db_index=True)
     is_active = models.BooleanField(default=True)
     is_staff = models.BooleanField(default=False)
 
@@ -63,4 +68,11 @@ class User(AbstractBaseUser, PermissionsMixin):
     REQUIRED_FIELDS = ['first_name', 'last_name']
 
     def __str__(self):
-        return f"{self.first_name} {self.last_name} ({self.email})"
\ No newline at end of file
+        return f"{self.first_name} {self.last_name} ({self.email})"
+
+@receiver([post_save, post_delete], sender=User)
+def invalidate_websocket_user_cache(sender, instance, **kwargs):
+    """Profile and is_active changes must reach WebSocket auth (users.cache) on the next connect."""
+    from .cache import invalidate_cached_user
+    # On commit: deleted any earlier, a connect in between would cache the old row again
+    transaction.on_commit(partial(invalidate_cached_user, instance.pk))
@@ -1,3 +1,66 @@
+from rest_framework.test import APITestCase, APIClient
+from rest_framework import status
+from django.core.cache import cache
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from rides.tests import make_user, make_ride
+from .cache import get_cached_user, user_cache_key
+from .models import User
 
-# Create your tests here.
+
+class ProfileUpdateTests(APITestCase):
+    def test_update_without_photo(self):
+        user = make_user(0)
+        self.client.force_authenticate(user=user)
+        response = self.client.put(reverse('profile'), {'first_name': 'Renamed'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['user']['first_name'], 'Renamed')
+        user.refresh_from_db()
+        self.assertEqual(user.first_name, 'Renamed')
+
+
+class UserCompleteProfileQueryCountTests(APITestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.user = make_user(0)
+        self.client.force_authenticate(user=self.user)
+        self.next_index = 1
+
+    def add_completed_rides(self, count):
+        for _ in range(count):
+            ride = make_ride(make_user(self.next_index))
+            self.next_index += 1
+            ride.members.add(self.user)
+            ride.is_completed = True
+            ride.save()
+
+    def count_queries(self):
+        url = reverse('user_complete_profile', args=[self.user.id])
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return len(context.captured_queries), response
+
+    def test_ride_history_costs_constant_queries(self):
+        self.add_completed_rides(2)
+        self.count_queries()  # creates the badge on first view
+        small, response = self.count_queries()
+        self.assertEqual(response.data['user']['total_completed_rides'], 2)
+
+        self.add_completed_rides(8)
+        large, response = self.count_queries()
+        self.assertEqual(response.data['user']['total_completed_rides'], 10)
+        self.assertEqual(small, large)
+
+
+class WebsocketUserCacheTests(TestCase):
+    def test_entry_is_deleted_when_the_save_commits(self):
+        user = make_user(0)
+        with self.captureOnCommitCallbacks(execute=True):
+            user.is_active = False
+            user.save()
+            # A connect on another connection still reads the committed, active row and caches it
+            cache.set(user_cache_key(user.id), User(id=user.id, email=user.email, is_active=True))
+        self.assertFalse(get_cached_user(user.id).is_active)
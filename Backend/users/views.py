@@ -16,7 +16,6 @@ from django.core.mail import send_mail
 from django.shortcuts import get_object_or_404
 from django.conf import settings
 from django.db import transaction
-from django.db.models import Q
 import random
 import os
 
@@ -104,7 +103,7 @@ class CustomTokenObtainPairView(APIView):
             if user and user.check_password(password):
                 if expo_push_token and user.expo_push_token != expo_push_token:  # Update token if changed
                     user.expo_push_token = expo_push_token
-                    user.save()
+                    user.save(update_fields=['expo_push_token'])
                 refresh = RefreshToken.for_user(user)
                 user_data = UserProfileSerializer(user).data
                 response_data = {
@@ -137,10 +136,9 @@ class UserCompleteProfileView(APIView):
             user_profile_serializer = UserProfileSerializer(user)
 
             # Ride history (both hosted and joined rides)
-            ride_history = Ride.objects.filter(
-                Q(host=user) | Q(members=user),
+            ride_history = Ride.objects.for_listing().involving(user).filter(
                 is_completed=True
-            ).distinct().order_by('-departure_time')
+            ).order_by('-departure_time')
             ride_history_serializer = RideSerializer(ride_history, many=True)
 
             # User reviews
@@ -160,7 +158,7 @@ class UserCompleteProfileView(APIView):
                     "badge": badge_serializer.data,
                     "ride_history": ride_history_serializer.data,
                     "reviews": review_serializer.data,
-                    "total_completed_rides": ride_history.count(),
+                    "total_completed_rides": len(ride_history_serializer.data),
                     "average_rating": badge.get_average_rating(),
                 }
             }
@@ -184,11 +182,15 @@ class ProfileView(APIView):
         serializer = UserProfileSerializer(request.user, data=request.data, partial=True)
         if serializer.is_valid():
             with transaction.atomic():  # Ensure atomicity for profile photo update
+                # Only the fields changed here are saved; the position is written by location pings
+                changed = []
                 # Update name fields if provided
                 if 'first_name' in request.data:
                     request.user.first_name = request.data['first_name']
+                    changed.append('first_name')
                 if 'last_name' in request.data:
                     request.user.last_name = request.data['last_name']
+                    changed.append('last_name')
 
                 # Handle profile photo upload with custom naming
                 if 'profile_photo' in request.FILES:
@@ -213,10 +215,11 @@ class ProfileView(APIView):
 
                     # Update the user's profile_photo field with the relative path
                     user.profile_photo = os.path.join('profiles', new_filename)
+                    changed.append('profile_photo')
 
                 # Save all changes
-                user.save()
-                serializer = UserProfileSerializer(user)  # Refresh serializer with updated data
+                request.user.save(update_fields=changed)
+                serializer = UserProfileSerializer(request.user)  # Refresh serializer with updated data
                 return Response({"message": "Profile updated successfully", "user": serializer.data}, status=status.HTTP_200_OK)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
@@ -261,7 +264,7 @@ class VerifyForgotPasswordOTPView(APIView):
 
             user = User.objects.get(email=email)
             user.set_password(new_password)
-            user.save()
+            user.save(update_fields=['password'])
 
             cache.delete(f"forgot_otp_{email}")
             return Response({"message": "Password reset successfully."}, status=status.HTTP_200_OK)
@@ -275,6 +278,6 @@ class ChangePasswordView(APIView):
         if serializer.is_valid():
             user = request.user
             user.set_password(serializer.validated_data['new_password'])
-            user.save()
+            user.save(update_fields=['password'])
             return Response({"message": "Password changed successfully."}, status=status.HTTP_200_OK)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
\ No newline at end of file